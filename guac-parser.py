@@ -5,34 +5,56 @@
 # Python >= 3.13.1
 # pip >= 24.3.1
 ########################################################################################################################
+import asyncio
 import base64
+import binascii
 import logging
+import mmap
+import os
+import re
+import sys
 import time
 import hashlib
-from enum import verify
+import html
+import json
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+import random
+import tracemalloc
+try:
+    import resource  # Peak memory (not available on Windows)
+except ImportError:
+    resource = None
+from enum import verify, IntEnum
 
 # import urllib.request
 import requests
-import tkinter as tk
 import numpy as np  # Causes issues on 3.13.1
 import threading
 # import imageio.v2 as iio
 from datetime import datetime, UTC
 # from encodings.johab import codec
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 from io import BytesIO
-from PIL import ImageFile, Image, ImageTk
-from math import floor
+from PIL import ImageFile, Image
 from typing import Callable, List, Any, Dict
-from concurrent.futures import ThreadPoolExecutor
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed, wait
+from dataclasses import dataclass, make_dataclass
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
 
 disable_warnings(InsecureRequestWarning)
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from functools import partial
+from urllib.parse import urlparse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO,
@@ -43,10 +65,14 @@ headers = {
     'User-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.3',
 }
 
+# The tail of the recording scanned for the last sync timestamp ('tail' trigger resolution)
+TAIL_SIZE = 64 << 10
+SYNC_PATTERN = re.compile(rb'4\.sync,(\d{1,2})\.(\d+)[,;]')
+
 """ Helper Functions """
 def to_int(_bytes) -> int:
     # return int.from_bytes(_bytes, byteorder='little')
-    return int(_bytes.decode())
+    return int(_bytes)
 
 def to_str(_bytes) -> str:
     if _bytes is None:
@@ -65,22 +91,6 @@ def to_seconds(_in: int):
 def round_number(_in):
     return round(_in)
 
-def ulist(_list, keep_the_last_duplicate=True):
-    nlist = []
-    _i = -1
-    for _e in _list:
-        _i += 1
-        if _e.id not in [_ne.id for _ne in nlist]:
-            nlist.append(_e)
-
-        else:  # _e.id in [_id for _id in nlist]:
-            for e_to_rm in nlist:
-                if e_to_rm.id == _e.id:
-                    nlist.remove(e_to_rm)
-            nlist.append(_e)
-
-    return nlist
-
 """ Configuration / Handlers """
 Instruction_Handlers = OrderedDict()
 Instruction_Handlers.update({
@@ -90,7 +100,8 @@ Instruction_Handlers.update({
         'end': {
             'arguments': {'stream_index': [to_int]}},
         'sync': {
-            'arguments': {'timestamp': [to_int, to_seconds]}},
+            'arguments': {'timestamp_ms': [to_int]},
+            'properties': {'timestamp': lambda inst_obj: to_seconds(inst_obj.timestamp_ms)}},
         'img': {
             'arguments': {
                 'stream_index': [to_int],
@@ -112,34 +123,94 @@ Instruction_Handlers.update({
                 'data': None,
             },
         },
+        # Drawing instructions (https://guacamole.apache.org/doc/gug/protocol-reference.html#drawing-instructions)
+        'copy': {
+            'arguments': {
+                'src_layer': [to_int], 'src_x': [to_int], 'src_y': [to_int], 'src_width': [to_int],
+                'src_height': [to_int], 'channelMask': [to_int], 'dst_layer': [to_int], 'dst_x': [to_int],
+                'dst_y': [to_int]}},
+        'transfer': {
+            'arguments': {
+                'src_layer': [to_int], 'src_x': [to_int], 'src_y': [to_int], 'src_width': [to_int],
+                'src_height': [to_int], 'function': [to_int], 'dst_layer': [to_int], 'dst_x': [to_int],
+                'dst_y': [to_int]}},
+        'rect': {
+            'arguments': {'layer': [to_int], 'x': [to_int], 'y': [to_int], 'width': [to_int], 'height': [to_int]}},
+        'cfill': {
+            'arguments': {
+                'channelMask': [to_int], 'layer': [to_int], 'r': [to_int], 'g': [to_int], 'b': [to_int],
+                'a': [to_int]}},
+        'lfill': {
+            'arguments': {'channelMask': [to_int], 'layer': [to_int], 'src_layer': [to_int]}},
+        'cstroke': {
+            'arguments': {
+                'channelMask': [to_int], 'layer': [to_int], 'cap': [to_int], 'join': [to_int],
+                'thickness': [to_int], 'r': [to_int], 'g': [to_int], 'b': [to_int], 'a': [to_int]}},
+        'dispose': {
+            'arguments': {'layer': [to_int]}},
+        'move': {
+            'arguments': {'layer': [to_int], 'parent': [to_int], 'x': [to_int], 'y': [to_int], 'z': [to_int]}},
+        'shade': {
+            'arguments': {'layer': [to_int], 'opacity': [to_int]}},
+        'cursor': {
+            'arguments': {
+                'x': [to_int], 'y': [to_int], 'src_layer': [to_int], 'src_x': [to_int], 'src_y': [to_int],
+                'src_width': [to_int], 'src_height': [to_int]}},
+        # Deprecated (inline image data)
+        'png': {
+            'arguments': {'channelMask': [to_int], 'layer': [to_int], 'x': [to_int], 'y': [to_int], 'data': None}},
+        'jpeg': {
+            'arguments': {'channelMask': [to_int], 'layer': [to_int], 'x': [to_int], 'y': [to_int], 'data': None}},
     })
 
+# Instructions (opcodes) which are replayed onto the display (the image streams are replayed on their end)
+Drawing_Instructions = ['size', 'copy', 'transfer', 'rect', 'cfill', 'lfill', 'cstroke', 'dispose', 'move', 'shade',
+                        'cursor', 'png', 'jpeg']
+# Instructions (opcodes) which build the image streams and terminate the frames
+Stream_Instructions = ['img', 'blob', 'end', 'sync']
+
 """ GUAC Classes """
 class default_layer(object):
     DEFAULT_LAYER_WIDTH = 640
     DEFAULT_LAYER_HEIGHT = 480
 
+""" Channel masks (Porter-Duff compositing operations, as defined by Guacamole.Layer) """
+GUAC_COMP_RIN = 0x1
+GUAC_COMP_ROUT = 0x2
+GUAC_COMP_IN = 0x4
+GUAC_COMP_ATOP = 0x6
+GUAC_COMP_OUT = 0x8
+GUAC_COMP_RATOP = 0x9
+GUAC_COMP_XOR = 0xA
+GUAC_COMP_ROVER = 0xB
+GUAC_COMP_SRC = 0xC
+GUAC_COMP_OVER = 0xE
+GUAC_COMP_PLUS = 0xF
+
 class guac_instruction(object):
-    id = None
-    opcode_len = None
-    opcode = b''
-    data = b''
+    """ Base class of the instruction records
 
-    def __init__(self):
-        pass
+    The concrete (slotted) record types are created per opcode by guac_instruction_decoder, with one slot per argument
+    described in Instruction_Handlers. The opcode itself is a class attribute (guac_opcode), hence it costs no memory
+    per instance.
+    """
+    __slots__ = ()
+    opcode = None  # guac_opcode
+    name = ''      # Opcode name
+    fields = ()    # Argument names
 
     def get_data(self, size=None):
-        if self.opcode == b'blob':
+        if self.opcode == guac_opcode.blob:
             if size:
-                return base64.b64decode(self.data.decode())[:size]
+                return base64.b64decode(self.data)[:size]
             else:
-                return base64.b64decode(self.data.decode())
+                return base64.b64decode(self.data)
         else:
-            return self.data
+            return getattr(self, 'data', b'')
 
     def __repr__(self):
-        row = {'id': self.id, 'opcode': self.opcode.decode()}
-        for name, handlers in Instruction_Handlers[self.opcode.decode()].get('arguments', {}).items():
+        row = {'id': self.id, 'opcode': self.name}
+        for name in self.fields:
             row.update({name: getattr(self, name)})
 
         return str(row)
@@ -147,160 +218,2641 @@ class guac_instruction(object):
     def __str__(self):
         return self.__repr__()
 
-class guac_recording_frame(object):
-    buffer = None
-    x = 0
-    y = 0
-    width = 0
-    height = 0
-    layer_index = 0
-    mimetype = None
-    timestamp = None
-    elements = None
-
-    def __init__(self, buffer=None, layer: default_layer = None):
-
-        if layer is None: layer = default_layer()
-        if buffer is None: buffer = b''
-        if self.elements is None: self.elements = []
-        self.logger = logging
-        self.buffer = buffer
-        self.default_layer = layer
+@dataclass(slots=True, repr=False, eq=False)
+class guac_unsupported_instruction(guac_instruction):
+    """ An instruction without handlers (kept as a bare opcode name and its raw arguments) """
+    name: str = ''
+    arguments: tuple = ()
+    id: int = None
+
+class guac_instruction_decoder(object):
+    """ Precompiled decoder of a single instruction type
+
+    Built once from the Instruction_Handlers entry: the slotted record type with positional argument names and a single
+    (composed) converter per argument, so that decoding an instruction costs one table lookup plus the converters. The
+    values derived from the arguments (the entry's 'properties') are computed on access, they cost no memory.
+    """
+    def __init__(self, opcode: str, arguments: dict = None, properties: dict = None):
+        if arguments is None: arguments = {}
+        if properties is None: properties = {}
+        self.opcode = opcode.encode()
+        self.fields = tuple(arguments.keys())
+        self.converters = tuple(self.compose(handlers) for handlers in arguments.values())
+        namespace = {'opcode': guac_opcode[opcode], 'name': opcode, 'fields': self.fields}
+        namespace.update({name: property(getter) for name, getter in properties.items()})
+        # All the arguments default to None (in case the instruction carries fewer arguments than described)
+        self.record_type = make_dataclass(
+            'guac_instruction_%s' % opcode, [(name, Any, None) for name in self.fields] + [('id', int, None)],
+            bases=(guac_instruction,), namespace=namespace, slots=True, repr=False, eq=False)
+
+    @staticmethod
+    def compose(handlers):
+        """ Composes the list of handlers (applied in order) into a single converter (None when there is nothing to apply) """
+        if not handlers:
+            return None
 
-    def add_blob(self, _bytes: bytes):
-        self.buffer += _bytes
+        if len(handlers) == 1:
+            return handlers[0]
 
-    def get_buffer(self, raw=False, size=None):
+        handlers = tuple(handlers)
 
-        try:
-            if raw == True:
-                return self.buffer if size is None else self.buffer[:size]
+        def converter(value):
+            for handler in handlers:
+                value = handler(value)
+            return value
+
+        return converter
+
+    def __call__(self, elements: List[bytes]) -> guac_instruction:
+        """ Builds the instruction record from its elements (opcode followed by arguments)
+
+        Remark: Arguments not described by the instruction handlers are ignored
+        """
+        return self.record_type(
+            *[value if converter is None else converter(value) for converter, value in zip(self.converters, elements[1:])])
+
+def compile_instruction_handlers(handlers: dict) -> Dict[bytes, guac_instruction_decoder]:
+    """ Compiles the instruction handlers into the opcodes enum and the decoders table keyed by opcode bytes """
+    global guac_opcode
+    guac_opcode = IntEnum('guac_opcode', list(handlers.keys()), start=0)
+    return {opcode.encode(): guac_instruction_decoder(opcode, params.get('arguments', {}), params.get('properties'))
+            for opcode, params in handlers.items()}
+
+def register_instruction_handler(opcode: str, arguments: dict = None, properties: dict = None):
+    """ Adds (or replaces) the instruction handler and its precompiled decoder
+
+    The registered instructions are decoded only (e.g. to read their arguments from parse_stream_chunk), they are not
+    replayed: The frames and the display dispatch on the opcodes known at import time, hence the opcodes they replay
+    (the drawing instructions, the image streams and sync) cannot be registered.
+
+    Remark: The opcodes enum is rebuilt, the values of already known opcodes stay the same
+    """
+    global Instruction_Decoders
+    if opcode in Drawing_Instructions or opcode in Stream_Instructions:
+        raise ValueError('The replayed instructions cannot be registered: %s' % opcode)
+    Instruction_Handlers[opcode] = {'arguments': arguments} if arguments is not None else {}
+    if properties is not None: Instruction_Handlers[opcode]['properties'] = properties
+    Instruction_Decoders = compile_instruction_handlers(Instruction_Handlers)
+
+Instruction_Decoders = compile_instruction_handlers(Instruction_Handlers)
+
+class guac_instruction_tokenizer(object):
+    """ Incremental (streaming) tokenizer of the Guacamole instruction stream
+
+    The tokenizer walks the LENGTH prefixes of the elements instead of splitting the data on separators, hence the
+    values may contain arbitrary characters (including commas, semicolons and periods). The data is accumulated in a
+    growable buffer with a read cursor, so the bytes already consumed are never scanned again, and an incomplete
+    instruction (like a large blob spread over many network chunks) is resumed from the last complete element.
+
+    Remark: The LENGTH denotes the number of Unicode characters (not bytes) of the UTF-8 encoded value
+    """
+    # The number of consumed bytes after which the buffer gets compacted
+    COMPACT_THRESHOLD = 1 << 16
+    # The maximum number of digits of the element's length prefix
+    MAX_LENGTH_DIGITS = 20
+    # UTF-8 continuation bytes (10xxxxxx)
+    UTF8_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.reset()
+
+    def reset(self):
+        self.buffer.clear()
+        self.cursor = 0         # Offset (in the buffer) of the first byte of the pending instruction
+        self.consumed = 0       # Total number of bytes consumed from the stream (complete instructions only)
+        self._scan_pos = 0      # Offset (in the buffer) of the next element of the pending instruction
+        self._required = 0      # Buffer size required to make any progress with the pending instruction
+        self._elements = []     # Elements already parsed for the pending instruction
+        self._skipping = False  # Indicates that the rest of a malformed instruction is being skipped
+        self._non_ascii_end = 0 # Offset (in the buffer) up to which the non-ASCII bytes may appear
+
+    def pending(self) -> int:
+        """ Returns the number of buffered bytes not consumed yet """
+        return len(self.buffer) - self.cursor
+
+    def _utf8_value_end(self, start: int, length: int) -> int:
+        """ Returns the end offset of a value of given length (in characters), or -1 if the value is incomplete """
+        buf = self.buffer
+        size = len(buf)
+        end = start
+        remaining = length
+        while remaining > 0:
+            if end + remaining > size:
+                return -1
+            segment = buf[end:end + remaining]
+            end += remaining
+            # Each non-continuation byte starts a new character
+            remaining -= len(segment.translate(None, self.UTF8_CONTINUATION_BYTES))
+
+        # Include the continuation bytes of the last character
+        while end < size and buf[end] & 0xC0 == 0x80:
+            end += 1
+
+        return end if end < size else -1
+
+    def _malformed(self, pos: int, reason: str):
+        """ Discards the pending (malformed) instruction, the rest of it is skipped up to the next semicolon """
+        logging.error(' [-] Malformed instruction at stream offset %s (%s), skipping it...' % (
+            self.consumed + pos - self.cursor, reason))
+        self._skipping = True
+
+    def feed(self, data, offsets: list = None) -> List[List[bytes]]:
+        """ Appends the data to the buffer and returns the list of complete instructions (lists of elements)
+
+        :param offsets: If given, the stream offset following each returned instruction is appended to it
+        """
+        buf = self.buffer
+        buf += data
+        size = len(buf)
+        instructions = []
+
+        # The values are checked for non-ASCII characters only if such were fed (the byte length differs from LENGTH)
+        if isinstance(data, (bytes, bytearray)):
+            is_ascii = data.isascii()
+        else:
+            # memoryview (e.g. of a memory-mapped file), checked without a copy
+            is_ascii = not len(data) or np.frombuffer(data, dtype=np.uint8).max() < 0x80
+        if not is_ascii:
+            self._non_ascii_end = size
+
+        if size < self._required:
+            return instructions
+
+        pos = self._scan_pos
+        elements = self._elements
+        non_ascii_end = self._non_ascii_end
+        view = memoryview(buf)
+        while pos < size:
+            if self._skipping:
+                terminator = buf.find(b';', pos)
+                if terminator == -1:
+                    pos = size
+                    break
+                self._skipping = False
+                elements = []
+                pos = terminator + 1
+                self.consumed += pos - self.cursor
+                self.cursor = pos
+                continue
+
+            dot = buf.find(b'.', pos, pos + self.MAX_LENGTH_DIGITS + 1)
+            if dot == -1:
+                if size - pos > self.MAX_LENGTH_DIGITS:
+                    self._malformed(pos, 'missing length prefix')
+                    continue
+                self._required = size + 1
+                break
+
+            try:
+                length = int(buf[pos:dot])
+            except ValueError:
+                self._malformed(pos, 'invalid length prefix')
+                continue
+
+            start = dot + 1
+            end = start + length
+            if end >= size:
+                # Wait until the whole value (and its terminator) is buffered
+                self._required = end + 1
+                break
+
+            value = view[start:end].tobytes()
+            if (start < non_ascii_end and not value.isascii()) or buf[end] not in b',;':
+                end = self._utf8_value_end(start, length)
+                if end == -1:
+                    self._required = size + 1
+                    break
+                value = view[start:end].tobytes()
+
+            terminator = buf[end]
+            if terminator == 0x2C:  # ',' - Next element
+                elements.append(value)
+                pos = end + 1
+            elif terminator == 0x3B:  # ';' - End of instruction
+                elements.append(value)
+                instructions.append(elements)
+                elements = []
+                pos = end + 1
+                self.consumed += pos - self.cursor
+                self.cursor = pos
+                if offsets is not None:
+                    offsets.append(self.consumed)
             else:
-                return base64.b64decode(self.buffer.decode()) if size is None else base64.b64decode(
-                    self.buffer.decode())[:size]
-        except Exception as msg:
-            self.logger.error(' [-] Unable to get the buffer. Exception: %s' % str(msg))
-            return None
+                self._malformed(end, 'unexpected terminator')
+                pos = end
+        else:
+            self._required = size + 1
+
+        self._elements = elements
+        view.release()
+
+        # Drop the consumed bytes (only at the instruction boundary)
+        cursor = self.cursor
+        if cursor and (cursor >= self.COMPACT_THRESHOLD or cursor == size):
+            del buf[:cursor]
+            pos -= cursor
+            self._required -= cursor
+            self._non_ascii_end = max(0, self._non_ascii_end - cursor)
+            self.cursor = 0
+
+        self._scan_pos = pos
+        return instructions
+
+class guac_image_stream(object):
+    """ An image stream (img instruction), completed by its end instruction
+
+    The blobs are base64 decoded as they arrive (4-byte aligned pieces, the remainder is kept until the next blob) into a
+    single bytearray, and the decoded image is cached, hence the payload is decoded exactly once per stream.
+    """
+    __slots__ = ('stream_index', 'channelMask', 'layer', 'mimetype', 'x', 'y', 'buffer', '_pending', '_image', 'decoded')
+
+    opcode = guac_opcode.img  # Replayed as an img instruction by the display
+
+    def __init__(self, inst_obj: guac_instruction = None, buffer=None):
+
+        self.buffer = bytearray()  # Decoded payload
+        self._pending = b''        # Base64 remainder (not 4-byte aligned yet)
+        self._image = None         # Decoded image (cache)
+        self.decoded = None        # Decoded ahead of the compositor (pixels, opaque), see GuacImageDecoder
+        self.stream_index = getattr(inst_obj, 'stream_index', 0)
+        self.channelMask = getattr(inst_obj, 'channelMask', GUAC_COMP_OVER)
+        self.layer = getattr(inst_obj, 'layer', 0)
+        self.mimetype = getattr(inst_obj, 'mimetype', None)
+        self.x = getattr(inst_obj, 'x', 0)
+        self.y = getattr(inst_obj, 'y', 0)
+
+        if buffer: self.add_blob(buffer)
+
+    def add_blob(self, _bytes: bytes):
+        """ Decodes the base64 blob data (4-byte aligned part) and appends it to the payload """
+        if self._pending:
+            _bytes = self._pending + _bytes
+
+        aligned = len(_bytes) & ~3
+        try:
+            self.buffer += binascii.a2b_base64(memoryview(_bytes)[:aligned])
+        except binascii.Error as msg:
+            logging.error(' [-] Unable to decode the blob. Exception: %s' % str(msg))
+
+        self._pending = _bytes[aligned:]
+        self._image = None
+
+    def get_buffer(self, raw=False, size=None):
+        """ Returns the decoded payload (or base64 encoded one if raw) """
+        buffer = bytes(self.buffer) if size is None else bytes(self.buffer[:size])
+        return base64.b64encode(buffer) if raw == True else buffer
 
     def save(self, name_prefix):
         try:
-            with Image.open(BytesIO(self.get_buffer())) as img:
-                image_name = '%s_blob.jpg' % name_prefix
-                img.save('screenshots/%s' % image_name)
+            image_name = '%s_blob.jpg' % name_prefix
+            self.img().save('screenshots/%s' % image_name)
         except Exception as msg:
-            self.logger.error(' [-] Unable to save the image. Exception: %s' % str(msg))
+            logging.error(' [-] Unable to save the image. Exception: %s' % str(msg))
             with open('screenshots/%s_last_frame.png.err' % name_prefix, 'wb') as err_file:
-                err_file.write(self.get_buffer())
-
-    def is_complete(self):
-        if b'end' in self.elements:
-            return True
-        else:
-            return False
-
-    def is_synced(self):
-        if b'sync' in self.elements:
-            return True
-        else:
-            return False
+                err_file.write(self.buffer)
 
     def size(self):
-        return len(self.get_buffer(raw=True))
+        return len(self.buffer)
 
     def img(self):
-        return Image.open(BytesIO(self.get_buffer()))
+        if self._image is None:
+            self._image = Image.open(BytesIO(self.buffer))
+        return self._image
 
     def np(self):
         return np.array(self.img())
 
+    def __repr__(self):
+        return str({
+            'opcode': 'img',
+            'stream_index': self.stream_index,
+            'channelMask': self.channelMask,
+            'layer': self.layer,
+            'mimetype': self.mimetype,
+            'x': self.x,
+            'y': self.y,
+            'size': self.size(),
+        })
+
+class guac_recording_frame(object):
+    """ A single frame of the recording: The drawing operations up to the sync instruction terminating the frame
+
+    The opcodes the frame is built of are tracked as a bitfield (1 << guac_opcode). The image streams may span several
+    frames, hence they are tracked by the caller (streams) and become part of the frame they end in.
+    """
+    __slots__ = ('operations', 'timestamp', 'timestamp_ms', 'flags')
+
+    # Opcodes replayed onto the display
+    DRAWING = sum(1 << guac_opcode[name] for name in Drawing_Instructions)
+    SYNC = 1 << guac_opcode.sync
+
+    # Opcodes not supported (yet), logged once
+    unsupported = set()
+
+    def __init__(self):
+        self.operations = []  # Drawing instructions and (complete) image streams, in order
+        self.timestamp = None     # seconds
+        self.timestamp_ms = None  # milliseconds
+        self.flags = 0
+
+    def has(self, opcode) -> bool:
+        """ Indicates whether the frame already contains given opcode """
+        return opcode is not None and bool(self.flags & (1 << opcode))
+
+    def is_complete(self):
+        return self.is_synced()
+
+    def is_synced(self):
+        return bool(self.flags & self.SYNC)
+
+    def size(self):
+        """ The size of the (decoded) image payload """
+        return sum(op.size() for op in self.operations if isinstance(op, guac_image_stream))
+
     def __repr__(self):
         row = {}
         row.update({
-            'opcodes': list(map(bytes.decode, self.elements)),
-            'x': getattr(self, 'x'),
-            'y': getattr(self, 'y'),
-            'width': getattr(self, 'width'),
-            'height': getattr(self, 'height'),
-            'layer_index': getattr(self, 'layer_index'),
-            'mimetype': getattr(self, 'mimetype'),
-            'timestamp': getattr(self, 'timestamp'),
+            'opcodes': [opcode.name for opcode in guac_opcode if self.has(opcode)],
+            'operations': len(self.operations),
+            'size': self.size(),
+            'timestamp': self.timestamp,
         })
 
         return str(row)
 
-    def build(self, inst_obj: guac_instruction):
+    def build(self, inst_obj: guac_instruction, streams: dict) -> bool:
+        """ Adds the instruction to the frame, returns True once the frame is complete (synced)
 
-        if inst_obj.opcode in [b'i', b'end', b'img', b'blob', b'size', b'custom', b'sync']:
-            if inst_obj.opcode in self.elements and inst_obj.opcode not in [b'blob', b'custom', b'sync']:
-                self.logger.error(
-                    'Exception: The instruction opcode %s is already part of the frame...' % inst_obj.opcode.decode())
-                raise Exception(
-                    'Exception: The instruction opcode %s is already part of the frame...' % inst_obj.opcode.decode())
-            else:
-                self.elements.append(inst_obj.opcode)
-        else:
-            self.logger.error('Unsupported instruction: %s' % inst_obj.opcode.decode())
-            raise Exception('Unsupported instruction: %s' % inst_obj.opcode.decode())
+        :param streams: The open image streams (stream index -> guac_image_stream), shared across the frames
+        """
+        opcode = inst_obj.opcode
+        if opcode is None:
+            # Unknown opcodes do not affect the rendering, they are skipped
+            if inst_obj.name not in self.unsupported:
+                self.unsupported.add(inst_obj.name)
+                logging.debug('Unsupported instruction: %s' % inst_obj.name)
+            return False
 
-        if inst_obj.opcode in [b'blob']:
-            self.add_blob(_bytes=inst_obj.data)
+        self.flags |= 1 << opcode
 
-        if inst_obj.opcode in [b'sync']:
-            self.timestamp = getattr(inst_obj, 'timestamp')
+        if opcode == guac_opcode.blob:
+            # Blobs of the streams not rendered (audio, files, ...) are ignored
+            stream = streams.get(inst_obj.stream_index)
+            if stream is not None:
+                stream.add_blob(_bytes=inst_obj.data)
 
-        if inst_obj.opcode in [b'img']:
-            try:
-                self.layer_index = getattr(inst_obj, 'layer')
-                self.mimetype = getattr(inst_obj, 'mimetype')
-                self.x = getattr(inst_obj, 'x')
-                self.y = getattr(inst_obj, 'y')
-            except Exception as msg:
-                pass
-
-        if inst_obj.opcode in [b'size']:
-            self.layer_index = getattr(inst_obj, 'layer_index')
-            self.width = getattr(inst_obj, 'width')
-            self.height = getattr(inst_obj, 'height')
-            self.default_layer.DEFAULT_LAYER_WIDTH = self.width
-            self.default_layer.DEFAULT_LAYER_HEIGHT = self.height
-            pass
+        elif opcode == guac_opcode.img:
+            streams[inst_obj.stream_index] = guac_image_stream(inst_obj)
+
+        elif opcode == guac_opcode.end:
+            stream = streams.pop(inst_obj.stream_index, None)
+            if stream is not None:
+                self.operations.append(stream)
+
+        elif opcode == guac_opcode.sync:
+            self.timestamp = inst_obj.timestamp
+            self.timestamp_ms = inst_obj.timestamp_ms
+            return True
+
+        elif self.DRAWING & (1 << opcode):
+            self.operations.append(inst_obj)
+
+        return False
+
+class GuacTimestampIndex(object):
+    """ A lightweight index of the sync instructions, built while parsing the stream
+
+    Each entry (sync timestamp, byte offset, frame number) describes a frame (the instructions terminated by the sync),
+    where the frame number is the entry's position and the byte offset points right after the sync (where the next frame
+    starts), so the parser can seek to it. The timestamps are non-decreasing, hence any progress percentage or absolute
+    time maps to a frame by binary search.
+    """
+    def __init__(self):
+        self.timestamps = array('q')
+        self.offsets = array('q')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def add(self, timestamp: int, offset: int):
+        # Guard the ordering (a sync timestamp should never go back in time)
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            timestamp = self.timestamps[-1]
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+
+    def entry(self, frame_number: int) -> tuple:
+        return self.timestamps[frame_number], self.offsets[frame_number], frame_number
 
-        if inst_obj.opcode in [b'end']:
-            if self.width == 0 or self.height == 0:
-                self.width = self.default_layer.DEFAULT_LAYER_WIDTH
-                self.height = self.default_layer.DEFAULT_LAYER_HEIGHT
+    @property
+    def start_time(self):
+        return self.timestamps[0] if self.timestamps else None
+
+    @property
+    def end_time(self):
+        return self.timestamps[-1] if self.timestamps else None
+
+    @property
+    def duration(self):
+        return self.timestamps[-1] - self.timestamps[0] if self.timestamps else 0
+
+    def frame_at_time(self, time_s) -> int:
+        """ Returns the number of the first frame synced at/after given time (None if beyond the recording) """
+        frame_number = bisect_left(self.timestamps, time_s)
+        return frame_number if frame_number < len(self.timestamps) else None
+
+    def frame_at_progress(self, percentage) -> int:
+        """ Returns the number of the first frame at/after given percentage of the recording's progress """
+        return self.frame_at_time(self.time_at_progress(percentage))
+
+    def time_at_progress(self, percentage):
+        return self.start_time + self.duration * percentage / 100
+
+    def offset_at_time(self, time_s) -> int:
+        """ Returns the byte offset to seek to, in order to continue right after the last frame synced before given time """
+        frame_number = bisect_left(self.timestamps, time_s)
+        return self.offsets[frame_number - 1] if frame_number > 0 else 0
 
 class ScreenCaptureTrigger(object):
-    on_percent_of_progress = None
-    duration = None
-    elapsed_seconds = None
-    time_s = None
+    __slots__ = ('on_percent_of_progress', 'duration', 'elapsed_seconds', 'time_s', 'frame_number')
 
-    def __init__(self, on_percent_of_progress, total_duration, elapsed_seconds, time_s):
+    def __init__(self, on_percent_of_progress, total_duration, elapsed_seconds, time_s, frame_number=None):
         self.on_percent_of_progress = on_percent_of_progress
         self.duration = total_duration
         self.elapsed_seconds = elapsed_seconds
         self.time_s = time_s
-
-        md5_hash = hashlib.md5()
-        md5_hash.update(str('%s, %s, %s, %s' % (
-        self.on_percent_of_progress, self.elapsed_seconds, self.duration, self.time_s)).encode('utf-8'))
-        self.id = md5_hash.hexdigest()
+        self.frame_number = frame_number
 
     def __repr__(self):
         return '%s, %s, %s, %s' % (
         self.on_percent_of_progress, self.elapsed_seconds, self.duration, self.time_s)
 
+class ScreenCaptureSnapshot(object):
+    __slots__ = ('timestamp', 'frame_number', 'data')
+
+    def __init__(self, timestamp, frame_number, data: bytes):
+        self.timestamp = timestamp
+        self.frame_number = frame_number
+        self.data = data
+
+    def image(self) -> Image.Image:
+        return Image.open(BytesIO(self.data))
+
+class ScreenCaptureSnapshots(object):
+    """ A bounded set of (compressed) canvas snapshots, used to resolve the progress triggers when the recording
+    duration is not known up front.
+
+    The snapshots are taken on a regular time grid (the first synced frame at/after each grid point). Once the budget
+    is exceeded, the grid interval doubles and the snapshots not aligned with it are dropped, hence the snapshots always
+    cover the whole recording (seen so far) with a resolution of about duration/budget.
+    """
+    def __init__(self, budget: int = 32, interval: int = 1):
+        self.budget = max(budget, 2)
+        self.interval = interval
+        self.snapshots = []
+        self.start_time = None
+        self.next_time = None
+
+    @staticmethod
+    def encode(image: Image.Image) -> bytes:
+        # The screenshots are dumped as JPEG anyway, hence a high quality JPEG is good enough (and fast to encode)
+        buffered = BytesIO()
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(buffered, format='JPEG', quality=95)
+        return buffered.getvalue()
+
+    def is_due(self, timestamp) -> bool:
+        """ Indicates whether the snapshot is due at given time (the canvas does not need to be rendered otherwise) """
+        return self.next_time is None or timestamp >= self.next_time
+
+    def _slot(self, timestamp) -> int:
+        return (timestamp - self.start_time) // self.interval
+
+    def add(self, timestamp, frame_number, image: Image.Image, changed: bool = True):
+        """ Takes the snapshot of the canvas (if due), the last snapshot's data is reused if the canvas has not changed """
+        if self.start_time is None:
+            self.start_time = timestamp
+            self.next_time = timestamp
+
+        if timestamp < self.next_time:
+            return
+
+        if not changed and self.snapshots:
+            data = self.snapshots[-1].data
+        else:
+            data = self.encode(image)
+        self.snapshots.append(ScreenCaptureSnapshot(timestamp, frame_number, data))
+
+        if len(self.snapshots) > self.budget:
+            # Coarsen the grid, keep the first snapshot of each (new) slot only
+            self.interval *= 2
+            snapshots, last_slot = [], None
+            for snapshot in self.snapshots:
+                slot = self._slot(snapshot.timestamp)
+                if slot != last_slot:
+                    snapshots.append(snapshot)
+                    last_slot = slot
+            self.snapshots = snapshots
+
+        self.next_time = self.start_time + (self._slot(timestamp) + 1) * self.interval
+
+    def resolve(self, trigger_screenshot_on_progress: list, end_time):
+        """ Yields (percentage, snapshot) for each progress trigger, the snapshot is None if no snapshot covers it """
+        if self.start_time is None:
+            return
+
+        duration = end_time - self.start_time
+        used = set()
+        for _progress_percentage in sorted(trigger_screenshot_on_progress):
+            time_s = self.start_time + duration * _progress_percentage / 100
+            position = bisect_left(self.snapshots, time_s, key=attrgetter('timestamp'))
+            snapshot = self.snapshots[position] if position < len(self.snapshots) else None
+            if snapshot is not None:
+                if snapshot.frame_number in used:
+                    continue
+                used.add(snapshot.frame_number)
+            elif None in used:
+                continue
+            else:
+                used.add(None)
+            yield _progress_percentage, snapshot
+
+class ScreenChangeTrigger(object):
+    """ Triggers a screen capture once the screen content has changed significantly since the last capture
+
+    Attached to the compositor as a sink, it keeps a thumbnail of the canvas (the luma sampled once per block x block
+    pixels), where only the blocks covered by the changed regions (dirty rectangles) are sampled again, and only when
+    a capture may be due (the regions are merely accumulated on the other synced frames). The change is the fraction of the blocks whose luma differs by more than delta from the thumbnail of the
+    last capture, a capture is due once it reaches threshold (it is not evaluated while the changed area is smaller).
+    The captures are at least min_interval seconds (of the recording) apart, and at most max_count are taken.
+    """
+    def __init__(self, threshold: float = 0.1, min_interval: float = 5, max_count: int = 32, block: int = 8,
+                 delta: int = 24):
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.max_count = max_count
+        self.block = block
+        self.delta = delta
+        self.reset()
+
+    def reset(self):
+        self.current = None     # The thumbnail of the canvas (L)
+        self.reference = None   # The thumbnail of the last capture
+        self.count = 0
+        self.scores = []        # The change of each capture
+        self._changed = 0       # The number of blocks changed since the last capture (upper bound)
+        self._pending = []      # The blocks (bx0, by0, bx1, by1) changed since the last evaluation
+        self._due = False
+        self._last_ms = None
+
+    def __repr__(self):
+        return 'ScreenChangeTrigger(threshold=%s, min_interval=%s, max_count=%s, count=%s)' % (
+            self.threshold, self.min_interval, self.max_count, self.count)
+
+    def params(self) -> dict:
+        return {'threshold': self.threshold, 'min_interval': self.min_interval, 'max_count': self.max_count,
+                'block': self.block, 'delta': self.delta}
+
+    def resize(self, width: int, height: int):
+        pass  # The thumbnail is reset by present()
+
+    def present(self, image: Image.Image, regions: list = None, timestamp_ms: int = None):
+        block = self.block
+        columns, rows = image.width // block, image.height // block
+        if self.current is None or self.current.size != (columns, rows):
+            self.current = Image.new('L', (columns, rows))
+            self.reference = Image.new('L', (columns, rows))
+            self._pending = []
+            regions = None
+        if regions is None:
+            regions = [(0, 0, image.width, image.height)]
+
+        for x0, y0, x1, y1 in regions:
+            # Aligned to the blocks (the partial blocks at the right/bottom edges are ignored)
+            bx0, by0 = x0 // block, y0 // block
+            bx1, by1 = min(-(-x1 // block), columns), min(-(-y1 // block), rows)
+            if bx1 > bx0 and by1 > by0:
+                self._pending.append((bx0, by0, bx1, by1))
+                self._changed += (bx1 - bx0) * (by1 - by0)
+        if len(self._pending) > GuacDisplay.MAX_DIRTY_RECTANGLES:
+            self._pending = [GuacDisplay.bounding_box(self._pending)]
+
+        blocks = max(columns * rows, 1)
+        if timestamp_ms is None or self._changed < self.threshold * blocks or self.count >= self.max_count:
+            return
+        if self._last_ms is not None and timestamp_ms - self._last_ms < self.min_interval * 1000:
+            return
+
+        for bx0, by0, bx1, by1 in self._pending:
+            sample = image.resize((bx1 - bx0, by1 - by0), Image.NEAREST,
+                                  box=(bx0 * block, by0 * block, bx1 * block, by1 * block))
+            self.current.paste(sample.convert('L'), (bx0, by0))
+        self._pending = []
+
+        difference = np.abs(np.asarray(self.current, dtype=np.int16) - np.asarray(self.reference, dtype=np.int16))
+        score = np.count_nonzero(difference > self.delta) / blocks
+        if score >= self.threshold:
+            self.reference = self.current.copy()
+            self._changed = 0
+            self._last_ms = timestamp_ms
+            self._due = True
+            self.count += 1
+            self.scores.append(round(float(score), 3))
+
+    def take(self) -> bool:
+        """ Returns True (once) if a capture is due """
+        due, self._due = self._due, False
+        return due
+
+    def close(self):
+        pass
+
+class GuacLayer(object):
+    """ A layer (index >= 0) or buffer (index < 0) of the display, backed by an RGBA (height, width, 4) NumPy surface """
+    __slots__ = ('index', 'surface', 'parent', 'x', 'y', 'z', 'opacity', 'path')
+
+    def __init__(self, index: int, width: int = 0, height: int = 0):
+        self.index = index
+        self.surface = np.zeros((height, width, 4), dtype=np.uint8)
+        self.parent = 0 if index > 0 else None
+        self.x = 0
+        self.y = 0
+        self.z = 0
+        self.opacity = 255
+        self.path = []  # The current path (rectangles), consumed by the fill/stroke instructions
+
+    @property
+    def width(self) -> int:
+        return self.surface.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.surface.shape[0]
+
+    def is_buffer(self) -> bool:
+        return self.index < 0
+
+    def resize(self, width: int, height: int):
+        """ Resizes the layer, the content is preserved (cropped), not rescaled """
+        if (width, height) == (self.width, self.height):
+            return
+        surface = np.zeros((max(height, 0), max(width, 0), 4), dtype=np.uint8)
+        h, w = min(height, self.height), min(width, self.width)
+        surface[:h, :w] = self.surface[:h, :w]
+        self.surface = surface
+
+    def fit(self, right: int, bottom: int):
+        """ Buffers grow automatically to fit their contents """
+        if self.is_buffer() and (right > self.width or bottom > self.height):
+            self.resize(max(right, self.width), max(bottom, self.height))
+
+    def region(self, x: int, y: int, width: int, height: int) -> tuple:
+        """ Returns the pixels of the rectangle (clipped to the layer) and the clipped rectangle's origin """
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.width), min(y + height, self.height)
+        return self.surface[y0:max(y1, y0), x0:max(x1, x0)], x0, y0
+
+class GuacImageCache(object):
+    """ A bounded LRU cache of the decoded images (read-only RGBA pixels), keyed by a hash of their payload
+
+    The recordings send the same tiles over and over (cursors, icons, the unchanged regions of static screens), each one
+    is decoded once only. The size is bounded by the decoded pixels (bytes), the images larger than an eighth of it are
+    decoded but not cached (they would flush the cache, and they are seldom repeated).
+    """
+    def __init__(self, max_size: int = 64 << 20):
+        self.max_size = max_size
+        self._images = OrderedDict()  # hash -> (pixels, opaque)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.decode_time = 0.0  # Time spent decoding the images (seconds)
+
+    def __len__(self):
+        return len(self._images)
+
+    @staticmethod
+    def key(payload) -> bytes:
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    @staticmethod
+    def decode(payload) -> tuple:
+        """ Decodes the image payload, returns its RGBA pixels (read-only) and whether it is opaque """
+        image = Image.open(BytesIO(payload))
+        opaque = not image.has_transparency_data
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        pixels = np.asarray(image)
+        pixels.flags.writeable = False
+        return pixels, opaque
+
+    def lookup(self, key: bytes) -> tuple:
+        """ Returns the cached image (pixels, opaque), or None (a miss) """
+        entry = self._images.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._images.move_to_end(key)
+        else:
+            self.misses += 1
+        return entry
+
+    def store(self, key: bytes, entry: tuple):
+        size = entry[0].nbytes
+        if size > self.max_size >> 3 or key in self._images:
+            return
+        self._images[key] = entry
+        self.size += size
+        while self.size > self.max_size:
+            _key, (pixels, _opaque) = self._images.popitem(last=False)
+            self.size -= pixels.nbytes
+            self.evictions += 1
+
+    def get(self, payload, decoder: Callable = None) -> tuple:
+        """ Returns the decoded image (pixels, opaque) of the payload, decoder(payload) returns the image bytes """
+        key = self.key(payload)
+        entry = self.lookup(key)
+        if entry is not None:
+            return entry
+
+        started = time.perf_counter()
+        try:
+            entry = self.decode(decoder(payload) if decoder is not None else payload)
+        finally:
+            self.decode_time += time.perf_counter() - started
+        self.store(key, entry)
+        return entry
+
+    def clear(self):
+        self._images.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._images),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+            'decode_time': round(self.decode_time, 3),
+        }
+
+class GuacImageDecoder(object):
+    """ Decodes the image streams of the frames in a thread pool (PIL releases the GIL while decoding), ahead of the
+    compositor
+
+    The frames are put in the parsing order, and handed back strictly in the same order (reorder buffer) once their
+    images are decoded, hence the compositing order is unchanged. The cached images (GuacImageCache) are not decoded
+    again, and an image decoded by a worker already is shared by its repetitions in flight. The pending decodes
+    (max_pending) and frames (window) are bounded, put() waits for the oldest frame beyond them.
+    The inline png/jpeg instructions are decoded by the display itself.
+    """
+    def __init__(self, max_workers: int = 2, max_pending: int = None, window: int = 256,
+                 image_cache: GuacImageCache = None, profiler=None):
+        self.max_workers = max_workers
+        self.profiler = profiler  # GuacProfiler (decode stage)
+        self.max_pending = max_pending or 4 * max_workers
+        self.window = window
+        self.image_cache = image_cache
+        self._executor = None
+        self._frames = deque()  # (frame, context, [(stream, key, future, owned)])
+        self._inflight = {}     # key -> future (with an image cache)
+        self.pending = 0        # The decodes in flight
+        self.decodes = 0
+        self.waits = 0          # The images waited for (the compositor got ahead of the workers)
+        self.decode_time = 0.0  # CPU time spent decoding the images by the workers (seconds)
+
+    def decode(self, payload) -> tuple:
+        # CPU time of the worker (the wall time includes the waits for the GIL/cores)
+        started = self.profiler.clock() if self.profiler is not None else None
+        cpu = time.thread_time()
+        decoded = GuacImageCache.decode(payload)
+        if started is not None:
+            self.profiler.add('decode', started)
+        return decoded, time.thread_time() - cpu
+
+    def _submit(self, stream: guac_image_stream) -> tuple:
+        key = None
+        if self.image_cache is not None:
+            key = self.image_cache.key(stream.buffer)
+            stream.decoded = self.image_cache.lookup(key)
+            if stream.decoded is not None:
+                return None
+            future = self._inflight.get(key)
+            if future is not None:
+                return stream, key, future, False
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='GuacImageDecoder')
+        future = self._executor.submit(self.decode, stream.buffer)
+        if key is not None:
+            self._inflight[key] = future
+        self.pending += 1
+        self.decodes += 1
+        return stream, key, future, True
+
+    def _release(self, wait: bool = False) -> tuple:
+        """ Resolves the decoded images of the oldest frame, returns (frame, context) """
+        frame, context, decodes = self._frames.popleft()
+        for stream, key, future, owned in decodes:
+            if wait and not future.done():
+                self.waits += 1
+            try:
+                stream.decoded, elapsed = future.result()
+            except Exception:
+                # Decoded (and reported) by the display
+                stream.decoded, elapsed = None, 0.0
+
+            if owned:
+                self.pending -= 1
+                self.decode_time += elapsed
+                if key is not None:
+                    self._inflight.pop(key, None)
+                    self.image_cache.decode_time += elapsed
+                    if stream.decoded is not None:
+                        self.image_cache.store(key, stream.decoded)
+        return frame, context
+
+    def put(self, frame, context=None) -> list:
+        """ Submits the images of the frame, returns the list of the frames (frame, context) ready to be composited """
+        decodes = []
+        for operation in frame.operations:
+            if isinstance(operation, guac_image_stream):
+                decode = self._submit(operation)
+                if decode is not None:
+                    decodes.append(decode)
+        self._frames.append((frame, context, decodes))
+
+        ready = []
+        while self._frames:
+            if self.pending > self.max_pending or len(self._frames) > self.window:
+                ready.append(self._release(wait=True))
+            elif all(decode[2].done() for decode in self._frames[0][2]):
+                ready.append(self._release())
+            else:
+                break
+        return ready
+
+    def drain(self) -> list:
+        """ Waits for the pending frames, returns them (frame, context) in order """
+        return [self._release(wait=True) for _ in range(len(self._frames))]
+
+    def close(self):
+        self._frames.clear()
+        self._inflight.clear()
+        self.pending = 0
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.max_workers,
+            'decodes': self.decodes,
+            'waits': self.waits,
+            'decode_time': round(self.decode_time, 3),
+        }
+
+class GuacDisplay(object):
+    """ The remote display: The layer/buffer table, the drawing instructions are replayed onto NumPy surfaces
+
+    - Layers are created when first referenced, the non-buffer layers default to the size of the default layer (0),
+    while buffers (negative index) start at 0x0 and grow to fit their contents.
+    - The image streams are composited per channel mask (SRC and OVER, the other masks are approximated by OVER), the
+    copy/transfer/fill operations are vectorized slices of the surfaces, hence the cached (buffer) tiles are never
+    decoded again.
+    - The paths are limited to rectangles (rect), the other path instructions are not supported (yet).
+
+    The handlers return True if a visible layer (index >= 0) has changed, the changed regions are tracked as dirty
+    rectangles (display coordinates), collected by take_damage().
+    The decoded images are shared through the image cache (GuacImageCache), if any.
+    """
+    MAX_DIRTY_RECTANGLES = 64  # Beyond it, the dirty rectangles are merged into their bounding box
+
+    def __init__(self, image_cache: GuacImageCache = None, profiler=None):
+        self.layers = {0: GuacLayer(0)}
+        self.image_cache = image_cache
+        self.profiler = profiler  # GuacProfiler (decode stage)
+        self.cursor = None  # (hotspot x, hotspot y, RGBA pixels)
+        self.dirty = []     # (x0, y0, x1, y1)
+        self.handlers = {
+            guac_opcode.img: self.draw_stream,
+            guac_opcode.size: self.size_layer,
+            guac_opcode.copy: self.copy,
+            guac_opcode.transfer: self.transfer,
+            guac_opcode.rect: self.rect,
+            guac_opcode.cfill: self.cfill,
+            guac_opcode.lfill: self.lfill,
+            guac_opcode.cstroke: self.cstroke,
+            guac_opcode.dispose: self.dispose,
+            guac_opcode.move: self.move,
+            guac_opcode.shade: self.shade,
+            guac_opcode.cursor: self.set_cursor,
+            guac_opcode.png: self.draw_inline,
+            guac_opcode.jpeg: self.draw_inline,
+        }
+
+    @property
+    def size(self) -> tuple:
+        default = self.layers[0]
+        return default.width, default.height
+
+    def layer(self, index: int) -> GuacLayer:
+        layer = self.layers.get(index)
+        if layer is None:
+            if index < 0:
+                layer = GuacLayer(index)
+            else:
+                layer = GuacLayer(index, *self.size)
+            self.layers[index] = layer
+        return layer
+
+    def position(self, layer: GuacLayer) -> tuple:
+        """ Returns the absolute position of the layer (the layers are positioned relative to their parent) """
+        x, y, depth = 0, 0, len(self.layers)
+        while layer is not None and layer.index > 0 and depth:
+            x, y, depth = x + layer.x, y + layer.y, depth - 1
+            layer = self.layers.get(layer.parent)
+        return x, y
+
+    def damage(self, layer: GuacLayer, x0: int, y0: int, x1: int, y1: int):
+        """ Marks the region of the (visible) layer as dirty """
+        if layer.is_buffer():
+            return
+        if layer.index:
+            x, y = self.position(layer)
+            x0, y0, x1, y1 = x0 + x, y0 + y, x1 + x, y1 + y
+        width, height = self.size
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+        if x1 > x0 and y1 > y0:
+            self.dirty.append((x0, y0, x1, y1))
+            if len(self.dirty) > self.MAX_DIRTY_RECTANGLES:
+                self.dirty = [self.bounding_box(self.dirty)]
+
+    def damage_layer(self, layer: GuacLayer):
+        self.damage(layer, 0, 0, layer.width, layer.height)
+
+    def take_damage(self) -> list:
+        """ Returns (and clears) the dirty rectangles """
+        dirty, self.dirty = self.dirty, []
+        return dirty
+
+    @staticmethod
+    def bounding_box(rectangles: list) -> tuple:
+        return (min(r[0] for r in rectangles), min(r[1] for r in rectangles),
+                max(r[2] for r in rectangles), max(r[3] for r in rectangles))
+
+    def apply(self, operation) -> bool:
+        """ Replays the drawing instruction (or image stream), returns True if a visible layer has changed """
+        handler = self.handlers.get(operation.opcode)
+        if handler is None:
+            return False
+        return handler(operation)
+
+    """ Pixel operations """
+    @staticmethod
+    def blend(dst: np.ndarray, src: np.ndarray, channel_mask: int = GUAC_COMP_OVER, opacity: int = 255):
+        """ Composites the RGBA pixels src onto dst (same size), in place """
+        if channel_mask == GUAC_COMP_SRC and opacity == 255:
+            dst[...] = src
+            return
+
+        alpha = src[..., 3:4].astype(np.uint16)
+        if opacity != 255:
+            alpha = alpha * opacity // 255
+        if alpha.min() == 255:
+            dst[...] = src
+            return
+        if alpha.max() == 0:
+            return
+
+        inverse = 255 - alpha
+        dst[..., :3] = (src[..., :3] * alpha + dst[..., :3] * inverse + 127) // 255
+        dst[..., 3:] = alpha + (dst[..., 3:] * inverse + 127) // 255
+
+    @staticmethod
+    def raster(function: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        """ Applies the binary raster operation, the function is the 4-bit truth table of (src, dst) """
+        if function == 0x3:
+            return src
+        result = np.zeros_like(dst)
+        if function & 0x1: result |= src & dst
+        if function & 0x2: result |= src & ~dst
+        if function & 0x4: result |= ~src & dst
+        if function & 0x8: result |= ~src & ~dst
+        return result
+
+    def draw(self, layer_index: int, x: int, y: int, pixels: np.ndarray, channel_mask: int = GUAC_COMP_OVER) -> bool:
+        """ Composites the pixels at x, y of the layer (clipped) """
+        layer = self.layer(layer_index)
+        height, width = pixels.shape[:2]
+        layer.fit(x + width, y + height)
+
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, layer.width), min(y + height, layer.height)
+        if x1 <= x0 or y1 <= y0:
+            return False
+
+        if channel_mask not in (GUAC_COMP_SRC, GUAC_COMP_OVER):
+            logging.debug('Unsupported channel mask: %s (composited as OVER)' % channel_mask)
+        self.blend(layer.surface[y0:y1, x0:x1], pixels[y0 - y:y1 - y, x0 - x:x1 - x], channel_mask)
+        self.damage(layer, x0, y0, x1, y1)
+        return not layer.is_buffer()
+
+    def draw_image(self, layer_index: int, x: int, y: int, image: Image.Image, channel_mask: int) -> bool:
+        # Images without transparency (JPEG, most of the PNG tiles) are opaque, hence OVER is the same as SRC (copy)
+        if not image.has_transparency_data and channel_mask == GUAC_COMP_OVER:
+            channel_mask = GUAC_COMP_SRC
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        return self.draw(layer_index, x, y, np.asarray(image), channel_mask)
+
+    def draw_decoded(self, layer_index: int, x: int, y: int, decoded: tuple, channel_mask: int) -> bool:
+        """ Draws an image of the image cache (pixels, opaque) """
+        pixels, opaque = decoded
+        if opaque and channel_mask == GUAC_COMP_OVER:
+            channel_mask = GUAC_COMP_SRC
+        return self.draw(layer_index, x, y, pixels, channel_mask)
+
+    def decode(self, payload, decoder: Callable = None) -> tuple:
+        """ Decodes the image payload (pixels, opaque), through the image cache if any """
+        started = self.profiler.clock() if self.profiler is not None else None
+        try:
+            if self.image_cache is not None:
+                return self.image_cache.get(payload, decoder)
+            return GuacImageCache.decode(decoder(payload) if decoder is not None else payload)
+        finally:
+            if started is not None:
+                self.profiler.add('decode', started)
+
+    """ Instruction handlers """
+    def draw_stream(self, stream) -> bool:
+        try:
+            decoded = stream.decoded if stream.decoded is not None else self.decode(stream.buffer)
+            return self.draw_decoded(stream.layer, stream.x, stream.y, decoded, stream.channelMask)
+        except Exception as msg:
+            logging.error(' [-] Unable to decode the image stream: %s. Exception: %s' % (stream, str(msg)))
+            return False
+
+    def draw_inline(self, inst_obj) -> bool:
+        try:
+            # Keyed by the base64 payload (with an image cache), hence a hit is not decoded at all
+            return self.draw_decoded(inst_obj.layer, inst_obj.x, inst_obj.y,
+                                     self.decode(inst_obj.data, binascii.a2b_base64), inst_obj.channelMask)
+        except Exception as msg:
+            logging.error(' [-] Unable to decode the image: %s. Exception: %s' % (inst_obj.name, str(msg)))
+            return False
+
+    def size_layer(self, inst_obj) -> bool:
+        layer = self.layer(inst_obj.layer_index)
+        self.damage_layer(layer)
+        layer.resize(inst_obj.width, inst_obj.height)
+        self.damage_layer(layer)
+        return not layer.is_buffer()
+
+    def copy(self, inst_obj) -> bool:
+        pixels, x0, y0 = self.layer(inst_obj.src_layer).region(
+            inst_obj.src_x, inst_obj.src_y, inst_obj.src_width, inst_obj.src_height)
+        if pixels.size == 0:
+            return False
+        # Remark: Overlapping copies (within the same layer) are handled by NumPy (temporary copy)
+        return self.draw(inst_obj.dst_layer, inst_obj.dst_x + x0 - inst_obj.src_x, inst_obj.dst_y + y0 - inst_obj.src_y,
+                         pixels, inst_obj.channelMask)
+
+    def transfer(self, inst_obj) -> bool:
+        pixels, x0, y0 = self.layer(inst_obj.src_layer).region(
+            inst_obj.src_x, inst_obj.src_y, inst_obj.src_width, inst_obj.src_height)
+        if pixels.size == 0:
+            return False
+
+        layer = self.layer(inst_obj.dst_layer)
+        x, y = inst_obj.dst_x + x0 - inst_obj.src_x, inst_obj.dst_y + y0 - inst_obj.src_y
+        height, width = pixels.shape[:2]
+        layer.fit(x + width, y + height)
+        target, tx, ty = layer.region(x, y, width, height)
+        if target.size == 0:
+            return False
+
+        # The raster operation applies to the color channels, the alpha channel of the source is kept
+        source = pixels[ty - y:ty - y + target.shape[0], tx - x:tx - x + target.shape[1]]
+        target[..., :3] = self.raster(inst_obj.function, source[..., :3], target[..., :3])
+        target[..., 3] = source[..., 3]
+        self.damage(layer, tx, ty, tx + target.shape[1], ty + target.shape[0])
+        return not layer.is_buffer()
+
+    def rect(self, inst_obj) -> bool:
+        self.layer(inst_obj.layer).path.append((inst_obj.x, inst_obj.y, inst_obj.width, inst_obj.height))
+        return False
+
+    def fill(self, layer: GuacLayer, pattern: Callable, channel_mask: int) -> bool:
+        """ Fills (and closes) the current path of the layer, pattern(x, y, width, height) returns the pixels """
+        changed = False
+        for x, y, width, height in layer.path:
+            if width > 0 and height > 0:
+                changed |= self.draw(layer.index, x, y, pattern(x, y, width, height), channel_mask)
+        layer.path = []
+        return changed
+
+    def cfill(self, inst_obj) -> bool:
+        color = np.array([inst_obj.r, inst_obj.g, inst_obj.b, inst_obj.a], dtype=np.uint8)
+        return self.fill(self.layer(inst_obj.layer),
+                         lambda x, y, width, height: np.broadcast_to(color, (height, width, 4)),
+                         inst_obj.channelMask)
+
+    def lfill(self, inst_obj) -> bool:
+        source = self.layer(inst_obj.src_layer).surface
+        if source.size == 0:
+            self.layer(inst_obj.layer).path = []
+            return False
+
+        def pattern(x, y, width, height):
+            # The pattern is anchored at the layer's origin
+            rows, columns = -(-(y + height) // source.shape[0]), -(-(x + width) // source.shape[1])
+            return np.tile(source, (rows, columns, 1))[y:y + height, x:x + width]
+
+        return self.fill(self.layer(inst_obj.layer), pattern, inst_obj.channelMask)
+
+    def cstroke(self, inst_obj) -> bool:
+        layer = self.layer(inst_obj.layer)
+        color = np.array([inst_obj.r, inst_obj.g, inst_obj.b, inst_obj.a], dtype=np.uint8)
+        thickness, half = max(inst_obj.thickness, 1), max(inst_obj.thickness, 1) // 2
+
+        # The outline of each rectangle, as 4 (filled) edges
+        layer.path = [edge for x, y, width, height in layer.path for edge in (
+            (x - half, y - half, width + thickness, thickness),
+            (x - half, y + height - half, width + thickness, thickness),
+            (x - half, y - half, thickness, height + thickness),
+            (x + width - half, y - half, thickness, height + thickness))]
+        return self.fill(layer, lambda x, y, width, height: np.broadcast_to(color, (height, width, 4)),
+                         inst_obj.channelMask)
+
+    def dispose(self, inst_obj) -> bool:
+        # The default layer cannot be disposed
+        if inst_obj.layer == 0:
+            return False
+        layer = self.layers.get(inst_obj.layer)
+        if layer is None:
+            return False
+        self.damage_layer(layer)
+        del self.layers[inst_obj.layer]
+        return not layer.is_buffer()
+
+    def move(self, inst_obj) -> bool:
+        if inst_obj.layer <= 0:
+            return False
+        layer = self.layer(inst_obj.layer)
+        self.damage_layer(layer)
+        layer.parent, layer.x, layer.y, layer.z = inst_obj.parent, inst_obj.x, inst_obj.y, inst_obj.z
+        self.damage_layer(layer)
+        return True
+
+    def shade(self, inst_obj) -> bool:
+        layer = self.layer(inst_obj.layer)
+        layer.opacity = max(0, min(inst_obj.opacity, 255))
+        self.damage_layer(layer)
+        return not layer.is_buffer()
+
+    def set_cursor(self, inst_obj) -> bool:
+        pixels, _, _ = self.layer(inst_obj.src_layer).region(
+            inst_obj.src_x, inst_obj.src_y, inst_obj.src_width, inst_obj.src_height)
+        self.cursor = (inst_obj.x, inst_obj.y, pixels.copy())
+        return False
+
+    """ Rendering """
+    def flatten(self, region: tuple = None) -> np.ndarray:
+        """ Composites the visible layers onto the default layer, returns the RGBA pixels of the display (region)
+
+        :param region: The rectangle (x0, y0, x1, y1) to flatten, the whole display by default
+
+        Remark: Without any visible child layer, the default layer's surface (view) is returned as is (no copy)
+        """
+        root = self.layers[0]
+        x0, y0, x1, y1 = region if region is not None else (0, 0, root.width, root.height)
+        children = {}
+        for layer in self.layers.values():
+            if layer.index > 0:
+                children.setdefault(layer.parent, []).append(layer)
+        if not children.get(0):
+            return root.surface[y0:y1, x0:x1]
+
+        canvas = root.surface[y0:y1, x0:x1].copy()
+        self._flatten(canvas, (x0, y0), children, 0, 0, 0, (x0, y0, x1, y1))
+        return canvas
+
+    def _flatten(self, canvas: np.ndarray, origin: tuple, children: dict, parent: int, x: int, y: int, clip: tuple):
+        # The children are stacked by z-order, each one is clipped by its parent's bounds (and the flattened region)
+        ox, oy = origin
+        for layer in sorted(children.get(parent, ()), key=attrgetter('z', 'index')):
+            lx, ly = x + layer.x, y + layer.y
+            x0, y0 = max(lx, clip[0]), max(ly, clip[1])
+            x1, y1 = min(lx + layer.width, clip[2]), min(ly + layer.height, clip[3])
+            if x1 <= x0 or y1 <= y0:
+                continue
+            if layer.opacity:
+                self.blend(canvas[y0 - oy:y1 - oy, x0 - ox:x1 - ox], layer.surface[y0 - ly:y1 - ly, x0 - lx:x1 - lx],
+                           opacity=layer.opacity)
+            self._flatten(canvas, origin, children, layer.index, lx, ly, (x0, y0, x1, y1))
+
+    def image(self) -> Image.Image:
+        return Image.fromarray(self.flatten(), 'RGBA')
+
+class GuacCompositor(object):
+    """ Headless compositor: Replays the frames onto the display (GuacDisplay), without any display dependency
+
+    The flattened display is kept in a persistent RGB canvas, updated lazily (on access) from the dirty rectangles of
+    the display only, hence the cost is proportional to the changed area (not to the screen size), and there is no
+    mode conversion per screenshot. The sinks (like GuacViewer) attached to it get notified on every synced frame via
+    present(), along with the regions changed since the previous one.
+    """
+    def __init__(self, image_cache: GuacImageCache = None, profiler=None):
+        self.display = GuacDisplay(image_cache=image_cache, profiler=profiler)
+        self.profiler = profiler  # GuacProfiler (replay time per opcode, screenshot stage)
+        self.sinks = []
+        self.canvas = None      # RGB
+        self._unpresented = []  # The regions updated since the last present()
+
+    def attach(self, sink):
+        self.sinks.append(sink)
+
+    @property
+    def base_image(self) -> Image.Image:
+        """ The flattened display (RGB canvas), it is updated in place (use screenshot() for a copy) """
+        self.update()
+        return self.canvas
+
+    @property
+    def size(self) -> tuple:
+        return self.display.size
+
+    def draw(self, frame: guac_recording_frame) -> bool:
+        """ Replays the frame's operations, returns True if the canvas has changed """
+        changed = False
+        if self.profiler is not None:
+            for operation in frame.operations:
+                started = time.perf_counter()
+                changed |= self.display.apply(operation)
+                self.profiler.time_opcode(operation.opcode.name, time.perf_counter() - started)
+            return changed
+
+        for operation in frame.operations:
+            changed |= self.display.apply(operation)
+        return changed
+
+    def update(self) -> list:
+        """ Flushes the dirty rectangles of the display into the canvas, returns them """
+        dirty = self.display.take_damage()
+        if self.canvas is None or self.canvas.size != self.size:
+            canvas = Image.new('RGB', self.size)
+            if self.canvas is not None:
+                canvas.paste(self.canvas)
+            self.canvas = canvas
+            dirty = [(0, 0) + self.size] if self.size[0] and self.size[1] else []
+            self._unpresented = None  # Full update
+
+        for region in dirty:
+            # The alpha channel is dropped (pasting RGBA onto RGB)
+            self.canvas.paste(Image.fromarray(np.ascontiguousarray(self.display.flatten(region)), 'RGBA'),
+                              region[:2])
+
+        if self._unpresented is not None:
+            self._unpresented.extend(dirty)
+            if len(self._unpresented) > self.display.MAX_DIRTY_RECTANGLES:
+                self._unpresented = [self.display.bounding_box(self._unpresented)]
+        return dirty
+
+    def screenshot(self) -> Image.Image:
+        """ Returns an (independent) RGB copy of the canvas """
+        if self.profiler is not None:
+            started = self.profiler.clock()
+            try:
+                return self.base_image.copy()
+            finally:
+                self.profiler.add('screenshot', started)
+        return self.base_image.copy()
+
+    def present(self, timestamp_ms: int = None):
+        """ Notifies the sinks of the synced frame (at given sync timestamp) """
+        if not self.sinks:
+            # Headless, the canvas is updated on demand only
+            return
+
+        base_image = self.base_image
+        regions, self._unpresented = self._unpresented, []
+        for sink in self.sinks:
+            if regions is None:
+                sink.resize(*base_image.size)
+            sink.present(base_image, regions, timestamp_ms=timestamp_ms)
+
+    def close(self):
+        """ Closes the sinks, the first failure is raised once all of them are closed """
+        error = None
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as msg:
+                error = error or msg
+        if error is not None:
+            raise error
+
+class GuacKeyframe(object):
+    """ A snapshot of the display state (layers, buffers and cursor) right after a sync, the rendering resumes from it
+
+    The surfaces are zlib compressed (the screens are mostly made of flat areas), either on capture or later on through
+    compress() (e.g. by a worker thread, zlib releases the GIL). The offset points right after the sync (where the
+    parsing resumes, see GuacTimestampIndex).
+    """
+    __slots__ = ('frame_number', 'timestamp', 'offset', 'layers', 'cursor')
+    COMPRESSION_LEVEL = 1
+
+    def __init__(self, frame_number: int, timestamp: int, offset: int, layers: list, cursor: tuple = None):
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.offset = offset
+        self.layers = layers  # [(index, width, height, parent, x, y, z, opacity, compressed (or copied) RGBA surface)]
+        self.cursor = cursor  # (hotspot x, hotspot y, width, height, compressed (or copied) RGBA pixels)
+
+    def __repr__(self):
+        return 'GuacKeyframe(frame_number=%s, timestamp=%s, offset=%s, layers=%s, size=%s)' % (
+            self.frame_number, self.timestamp, self.offset, len(self.layers), self.size())
+
+    def size(self) -> int:
+        """ The size of the (compressed) surfaces (bytes) """
+        return sum(len(memoryview(layer[-1]).cast('B')) for layer in self.layers) + \
+            (len(memoryview(self.cursor[-1]).cast('B')) if self.cursor else 0)
+
+    @classmethod
+    def capture(cls, display: GuacDisplay, frame_number: int, timestamp: int, offset: int,
+                compress: bool = True) -> 'GuacKeyframe':
+        """ Snapshots the display state
+
+        :param compress: The surfaces are compressed right away, otherwise they are copied (see compress())
+        """
+        pack = cls._compress if compress else np.copy
+        layers = [(layer.index, layer.width, layer.height, layer.parent, layer.x, layer.y, layer.z, layer.opacity,
+                   pack(layer.surface)) for layer in display.layers.values()]
+        cursor = None
+        if display.cursor is not None:
+            x, y, pixels = display.cursor
+            cursor = (x, y, pixels.shape[1], pixels.shape[0], pack(pixels))
+        return cls(frame_number, timestamp, offset, layers, cursor)
+
+    @classmethod
+    def _compress(cls, pixels) -> bytes:
+        if isinstance(pixels, np.ndarray):
+            return zlib.compress(np.ascontiguousarray(pixels), cls.COMPRESSION_LEVEL)
+        return pixels
+
+    def compress(self):
+        """ Compresses the copied surfaces """
+        self.layers = [layer[:-1] + (self._compress(layer[-1]),) for layer in self.layers]
+        if self.cursor is not None:
+            self.cursor = self.cursor[:-1] + (self._compress(self.cursor[-1]),)
+
+    @staticmethod
+    def _pixels(data, width: int, height: int) -> np.ndarray:
+        if isinstance(data, np.ndarray):
+            return data.copy()
+        return np.frombuffer(bytearray(zlib.decompress(data)), dtype=np.uint8).reshape(height, width, 4)
+
+    def restore(self, display: GuacDisplay):
+        """ Restores the display state (the whole display gets dirty) """
+        display.layers = {}
+        for index, width, height, parent, x, y, z, opacity, data in self.layers:
+            layer = GuacLayer(index)
+            layer.surface = self._pixels(data, width, height)
+            layer.parent, layer.x, layer.y, layer.z, layer.opacity = parent, x, y, z, opacity
+            display.layers[index] = layer
+        display.layer(0)
+        display.cursor = None
+        if self.cursor is not None:
+            x, y, width, height, data = self.cursor
+            display.cursor = (x, y, self._pixels(data, width, height))
+        display.dirty = []
+        display.damage_layer(display.layers[0])
+
+    def to_bytes(self) -> bytes:
+        """ Serializes the keyframe: The length of the JSON header (4 bytes, little endian), the header, the surfaces """
+        self.compress()
+        blobs = [layer[-1] for layer in self.layers] + ([self.cursor[-1]] if self.cursor else [])
+        header = json.dumps({
+            'frame_number': self.frame_number, 'timestamp': self.timestamp, 'offset': self.offset,
+            'layers': [list(layer[:-1]) + [len(layer[-1])] for layer in self.layers],
+            'cursor': list(self.cursor[:-1]) + [len(self.cursor[-1])] if self.cursor else None,
+        }).encode()
+        return b''.join([len(header).to_bytes(4, 'little'), header] + blobs)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'GuacKeyframe':
+        header_size = int.from_bytes(data[:4], 'little')
+        header = json.loads(data[4:4 + header_size])
+        position = 4 + header_size
+
+        def blob(size: int) -> bytes:
+            nonlocal position
+            position += size
+            return bytes(data[position - size:position])
+
+        layers = [tuple(layer[:-1]) + (blob(layer[-1]),) for layer in header['layers']]
+        cursor = tuple(header['cursor'][:-1]) + (blob(header['cursor'][-1]),) if header['cursor'] else None
+        return cls(header['frame_number'], header['timestamp'], header['offset'], layers, cursor)
+
+class GuacKeyframeIndex(object):
+    """ The keyframes of a recording (ordered by frame number), taken every `interval` seconds of the recording
+
+    Rendering the frame N replays the frames following the nearest keyframe at/before N only (random access), instead
+    of all the frames from the start of the recording.
+    """
+    def __init__(self, interval: int = 60):
+        self.interval = interval
+        self.keyframes = []
+        self.frame_numbers = array('q')
+
+    def __len__(self):
+        return len(self.keyframes)
+
+    def __iter__(self):
+        return iter(self.keyframes)
+
+    def size(self) -> int:
+        return sum(keyframe.size() for keyframe in self.keyframes)
+
+    def is_due(self, timestamp: int) -> bool:
+        return not self.keyframes or timestamp - self.keyframes[-1].timestamp >= self.interval
+
+    def add(self, keyframe: GuacKeyframe):
+        if self.frame_numbers and keyframe.frame_number <= self.frame_numbers[-1]:
+            return
+        self.keyframes.append(keyframe)
+        self.frame_numbers.append(keyframe.frame_number)
+
+    def before(self, frame_number: int) -> GuacKeyframe:
+        """ Returns the nearest keyframe at/before given frame (None if there is none, the rendering starts over) """
+        position = bisect_right(self.frame_numbers, frame_number)
+        return self.keyframes[position - 1] if position else None
+
+class GuacViewer(object):
+    """ Viewer sink (Tk window) replaying the composited canvas
+
+    Remark: tkinter (and ImageTk) is imported only once the viewer is created, headless runs never load it
+    """
+    def __init__(self, width: int = default_layer.DEFAULT_LAYER_WIDTH, height: int = default_layer.DEFAULT_LAYER_HEIGHT,
+                 frame_delay: float = 0.02):
+        import tkinter as tk
+        from PIL import ImageTk
+
+        self.tk = tk
+        self.ImageTk = ImageTk
+        self.frame_delay = frame_delay
+        self.photo = None  # The displayed image (updated in place)
+
+        # Create a canvas to display images
+        self.root = tk.Tk()  # Create the main window
+        self.root.title("GUAC Stream Player")
+        self.canvas = tk.Canvas(self.root, width=width, height=height)
+        self.canvas.pack()
+        self.canvas.delete("all")
+        try:
+            self.root.state("zoomed")  # Maximize the window
+        except tk.TclError:
+            # The "zoomed" state is not supported by X11
+            self.root.attributes('-zoomed', True)
+
+    def resize(self, width: int, height: int):
+        self.canvas.config(width=width, height=height)
+        self.photo = None
+
+    def present(self, image: Image.Image, regions: list = None, timestamp_ms: int = None):
+        """ Uploads the changed regions (x0, y0, x1, y1) of the image, or the whole image if regions is None """
+        photo = self.photo
+        if regions is None or photo is None:
+            self.photo = self.ImageTk.PhotoImage(image)
+            self.canvas.delete("all")
+            self.canvas.create_image(0, 0, anchor=self.tk.NW, image=self.photo)
+        else:
+            for region in regions:
+                # Copied onto the displayed photo image (Tk photo copy), the region image is released right after
+                patch = self.ImageTk.PhotoImage(image.crop(region))
+                photo.tk.call(str(photo), 'copy', str(patch), '-to', region[0], region[1])
+        self.canvas.update()
+        if self.frame_delay: time.sleep(self.frame_delay)
+
+    def close(self):
+        try:
+            self.root.destroy()
+        except self.tk.TclError:
+            pass
+
+class GuacVideoExporter(object):
+    """ Video sink (headless): Pipes the composited canvas into ffmpeg (raw RGB frames) at a fixed frame rate
+
+    The synced frames are placed on the output timeline by their sync timestamp (divided by the speed-up factor), each
+    output frame shows the last canvas synced before it: The canvas is duplicated while the display is idle, and the
+    frames synced within the same output frame period are dropped but the last. The sink keeps a single frame buffer,
+    updated from the changed regions only, hence the memory usage does not depend on the recording length.
+
+    The output size is the display size of the first frame (the later resizes are cropped/padded), optionally scaled
+    down by ffmpeg. The codec is picked by the output extension (.mp4: H.264, .webm: VP9) unless given.
+    If ffmpeg exits early, the export stops (the later frames are ignored) and the failure, with its exit code and error
+    output, is kept in error and raised by close().
+    """
+    CODECS = {
+        '.mp4': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p', '-movflags', '+faststart'],
+        '.webm': ['-c:v', 'libvpx-vp9', '-crf', '32', '-b:v', '0', '-deadline', 'realtime', '-row-mt', '1', '-pix_fmt', 'yuv420p'],
+    }
+
+    def __init__(self, output: str, fps: int = 25, speed: float = 1.0, scale: float = 1.0, width: int = None,
+                 max_idle: float = None, codec_args: list = None, ffmpeg: str = 'ffmpeg'):
+        """
+        :param speed: The speed-up factor (e.g. 4 plays the recording 4 times faster)
+        :param scale: The downscaling factor of the output frames (or width, the height keeps the aspect ratio)
+        :param max_idle: The idle periods (no sync) longer than max_idle seconds (of the output) are shortened to it
+        :param codec_args: The ffmpeg output arguments (codec, quality...), picked by the output extension otherwise
+        """
+        self.ffmpeg = shutil.which(ffmpeg)
+        if self.ffmpeg is None:
+            raise RuntimeError('ffmpeg is required to export the video (not found: %s)' % ffmpeg)
+        if codec_args is None:
+            codec_args = self.CODECS.get(os.path.splitext(output)[1].lower())
+            if codec_args is None:
+                raise ValueError('Unsupported video format (use .mp4 or .webm, or give the codec_args): %s' % output)
+
+        self.output = os.fspath(output)
+        self.fps = fps
+        self.speed = speed
+        self.scale = scale
+        self.width = width
+        self.max_idle = max_idle
+        self.codec_args = codec_args
+        self.process = None
+        self.error = None          # The failure of ffmpeg (RuntimeError), if any
+        self._stderr = None        # The error output of ffmpeg
+        self.frame = None          # The frame buffer (RGB), the last presented canvas
+        self.frames_written = 0    # Output frames written so far
+        self.frames_presented = 0
+        self._start_ms = None      # The sync timestamp of the first frame
+        self._skipped_ms = 0       # The idle time cut out of the timeline (max_idle)
+        self._last_ms = None
+
+    def __repr__(self):
+        return 'GuacVideoExporter(%s, %s fps, x%s)' % (self.output, self.fps, self.speed)
+
+    def output_size(self, width: int, height: int) -> tuple:
+        """ The (even) output size, as required by the yuv420p encoders """
+        if self.width:
+            width, height = self.width, height * self.width / width
+        else:
+            width, height = width * self.scale, height * self.scale
+        return max(int(width) // 2 * 2, 2), max(int(height) // 2 * 2, 2)
+
+    def _start(self, width: int, height: int):
+        self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+        arguments = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+                     '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height), '-r', str(self.fps), '-i', '-']
+        if self.output_size(width, height) != (width, height):
+            arguments += ['-vf', 'scale=%d:%d' % self.output_size(width, height)]
+        # The error output goes to a file (a pipe nobody reads could fill up and block ffmpeg)
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(arguments + self.codec_args + [self.output], stdin=subprocess.PIPE,
+                                        stderr=self._stderr)
+        logging.info(' [-] Exporting the video: %s (%sx%s, %s fps)' % (self.output, width, height, self.fps))
+
+    def advance(self, timestamp_ms: int) -> int:
+        """ Returns the output frame number at which the frame synced at given time appears (moves the timeline on) """
+        if self.max_idle is not None and self._last_ms is not None:
+            idle = (timestamp_ms - self._last_ms) / self.speed - self.max_idle * 1000
+            if idle > 0:
+                self._skipped_ms += idle * self.speed
+        elapsed = (timestamp_ms - self._start_ms - self._skipped_ms) / self.speed
+        return int(elapsed * self.fps // 1000)
+
+    def _write(self, count: int):
+        for _ in range(count):
+            self.process.stdin.write(self.frame.data)
+        self.frames_written += count
+
+    def _wait(self) -> RuntimeError:
+        """ Waits for ffmpeg to exit, returns its failure (exit code and error output) if any """
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        return_code = self.process.wait()
+        self.process = None
+        self._stderr.seek(0)
+        stderr = self._stderr.read().decode(errors='replace').strip()
+        self._stderr.close()
+        self._stderr = None
+        if not return_code:
+            return None
+        return RuntimeError('ffmpeg failed to export the video: %s (exit code %s)%s' % (
+            self.output, return_code, ': %s' % stderr if stderr else ''))
+
+    def resize(self, width: int, height: int):
+        pass  # The output size is fixed, see present()
+
+    def present(self, image: Image.Image, regions: list = None, timestamp_ms: int = None):
+        if self.error is not None:
+            # The export stopped (ffmpeg exited)
+            return
+        if timestamp_ms is None:
+            # Not synced, shown on the next output frame
+            timestamp_ms = self._last_ms if self._last_ms is not None else 0
+        if self.process is None:
+            self._start(*image.size)
+            self._start_ms = timestamp_ms
+
+        # The previous canvas is shown up to this frame
+        position = self.advance(timestamp_ms)
+        if position > self.frames_written:
+            try:
+                self._write(position - self.frames_written)
+            except BrokenPipeError:
+                self.error = self._wait() or RuntimeError('ffmpeg exited early: %s' % self.output)
+                logging.error(' [-] The video export stopped: %s' % str(self.error))
+                return
+        self._last_ms = timestamp_ms
+        self.frames_presented += 1
+
+        height, width = self.frame.shape[:2]
+        if regions is None or image.size != (width, height):
+            regions = [(0, 0, min(image.width, width), min(image.height, height))]
+            if image.size != (width, height):
+                self.frame[:] = 0
+        for x0, y0, x1, y1 in regions:
+            x1, y1 = min(x1, width), min(y1, height)
+            if x1 > x0 and y1 > y0:
+                self.frame[y0:y1, x0:x1] = np.asarray(image.crop((x0, y0, x1, y1)))
+
+    def close(self):
+        if self.process is None:
+            if self.error is not None:
+                raise self.error
+            return
+        try:
+            # The last canvas is shown for one frame at least
+            self._write(1)
+        except BrokenPipeError:
+            pass
+        self.error = self._wait()
+        if self.error is not None:
+            raise self.error
+        logging.info(' [-] Video exported: %s (%s frames from %s synced frames)' % (
+            self.output, self.frames_written, self.frames_presented))
+
+class GuacScreenshotWriter(object):
+    """ Encodes and writes the screenshots off the render thread (worker pool)
+
+    The render thread hands an independent image (see GuacCompositor.screenshot()) over with submit() and carries on,
+    the workers encode it (JPEG, PNG or WebP, PIL releases the GIL while encoding) and write it into the output
+    directory (created on demand), or pass the encoded bytes to the sink (a callable(image_name, data)) instead. The
+    number of pending screenshots is bounded (max_pending), beyond which submit() waits for the workers.
+    """
+    FORMATS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp'}
+
+    def __init__(self, directory: str = 'screenshots', format: str = 'jpeg', quality: int = None, optimize: bool = False,
+                 max_workers: int = 2, max_pending: int = 64, sink: Callable = None, **save_options):
+        """
+        :param save_options: The other options of the PIL encoder (e.g. subsampling, progressive, method, lossless)
+        """
+        format = format.lower()
+        if format == 'jpg':
+            format = 'jpeg'
+        if format not in self.FORMATS:
+            raise ValueError('Unsupported screenshot format: %s' % format)
+
+        self.format = format
+        self.sink = sink
+        self.directory = os.fspath(directory) if sink is None else None
+        self.save_options = dict(save_options)
+        if quality is not None:
+            self.save_options['quality'] = quality
+        if optimize:
+            self.save_options['optimize'] = True
+
+        self.max_workers = max_workers
+        self.written = 0
+        self.errors = 0
+        self.profiler = None  # GuacProfiler (encode and write stages)
+        self._executor = None
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._directory_ready = False
+
+    def __repr__(self):
+        return 'GuacScreenshotWriter(%s, %s)' % (self.directory or self.sink, self.format)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def extension(self) -> str:
+        return self.FORMATS[self.format]
+
+    def path(self, image_name: str) -> str:
+        """ Returns the path the screenshot is written to (None with a sink) """
+        return os.path.join(self.directory, image_name) if self.directory is not None else None
+
+    def submit(self, image: Image.Image, image_name: str) -> Future:
+        """ Queues the screenshot (the image must not be modified afterward) """
+        self._pending.acquire()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='GuacScreenshotWriter')
+            future = self._executor.submit(self._save, image, image_name)
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._futures.discard(future)
+        self._pending.release()
+
+    def _save(self, image: Image.Image, image_name: str) -> bool:
+        try:
+            profiler = self.profiler
+            if profiler is None:
+                self.write(image_name, self.encode(image))
+                return True
+
+            started = profiler.clock()
+            data = self.encode(image)
+            profiler.add('encode', started)
+            started = profiler.clock()
+            self.write(image_name, data)
+            profiler.add('write', started)
+            return True
+        except Exception as msg:
+            with self._lock:
+                self.errors += 1
+            logging.error(' [-] Unable to save the image: %s. Exception: %s' % (image_name, str(msg)))
+            return False
+
+    def encode(self, image: Image.Image) -> bytes:
+        if self.format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffered = BytesIO()
+        image.save(buffered, format=self.format.upper(), **self.save_options)
+        return buffered.getvalue()
+
+    def write(self, image_name: str, data: bytes):
+        """ Writes the encoded screenshot (synchronously) """
+        if self.sink is not None:
+            self.sink(image_name, data)
+        else:
+            if not self._directory_ready:
+                os.makedirs(self.directory, exist_ok=True)
+                self._directory_ready = True
+            with open(self.path(image_name), 'wb') as file_obj:
+                file_obj.write(data)
+        with self._lock:
+            self.written += 1
+
+    def flush(self):
+        """ Waits for the pending screenshots """
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'written': self.written, 'errors': self.errors, 'pending': len(self._futures)}
+
+class GuacRecordingSource(object):
+    """ An input source of a recording: Iterates over its chunks (bytes-like objects)
+
+    Use GuacRecordingSource.open() to pick the source matching the given object: A URL (http/https), a local path
+    (memory-mapped), a file-like object (or '-' for stdin), or in-memory bytes. An instance of a (custom) subclass is
+    returned as is.
+    """
+    READ_SIZE = 1 << 16
+
+    def __init__(self, name: str, read_size: int = None):
+        self.name = name
+        self.read_size = read_size or self.READ_SIZE
+
+    def chunks(self, offset: int = 0):
+        """ Iterates over the chunks of the stream, starting at given (byte) offset """
+        raise NotImplementedError
+
+    def rereadable(self) -> bool:
+        """ Indicates whether the chunks can be iterated more than once (required by the pre-pass) """
+        return True
+
+    def tail(self, size: int) -> bytes:
+        """ Returns the last size bytes of the recording (without reading it), None if not supported """
+        return None
+
+    def close(self):
+        """ Stops the reading in progress (called from another thread), e.g. closes the HTTP response """
+        pass
+
+    def __iter__(self):
+        return self.chunks()
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, self.name)
+
+    @staticmethod
+    def open(source, read_size: int = None, session=None) -> 'GuacRecordingSource':
+        if isinstance(source, GuacRecordingSource):
+            return source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return GuacBytesSource(source, read_size=read_size)
+        if isinstance(source, str) and source.startswith(('http://', 'https://')):
+            return GuacURLSource(source, session=session, read_size=read_size)
+        if isinstance(source, str) and source == '-':
+            return GuacFileObjectSource(sys.stdin.buffer, read_size=read_size)
+        if isinstance(source, (str, os.PathLike)):
+            return GuacFileSource(source, read_size=read_size)
+        if hasattr(source, 'read'):
+            return GuacFileObjectSource(source, read_size=read_size)
+        raise ValueError('Unsupported recording source: %r' % (source,))
+
+class GuacURLSource(GuacRecordingSource):
+    """ A recording streamed over HTTP(S) """
+    READ_SIZE = 4096
+
+    def __init__(self, url: str, session=None, read_size: int = None):
+        super().__init__(url, read_size)
+        self.session = session if session is not None else requests.Session()
+        self.headers = None  # The response headers of the last request
+        self._response = None
+
+    def tail(self, size: int) -> bytes:
+        # A suffix range, the servers ignoring the ranges (200) are not read
+        with self.session.get(self.name, headers={'Range': 'bytes=-%d' % size}, stream=True, verify=False,
+                              timeout=120) as response:
+            if response.status_code != 206:
+                return None
+            return response.content
+
+    def close(self):
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def chunks(self, offset: int = 0):
+        range_header = {'Range': 'bytes=%d-' % offset} if offset else None
+        with self.session.get(self.name, headers=range_header, stream=True, verify=False, timeout=120) as response:
+            if offset and response.status_code == 416:
+                # The offset is at (or beyond) the end of the recording, nothing left to read
+                return
+            response.raise_for_status()
+            self.headers = response.headers
+            if offset and response.status_code == 206:
+                offset = 0
+            elif response.status_code != 200:
+                raise requests.HTTPError('Failed to retrieve stream: HTTP %s' % response.status_code, response=response)
+            self._response = response
+            try:
+                for chunk in response.iter_content(chunk_size=self.read_size):
+                    if not chunk:
+                        logging.info('The chunk is empty, exiting stream...')
+                        break
+                    if offset:
+                        # The range was ignored by the server, the leading bytes are skipped
+                        skipped = min(offset, len(chunk))
+                        chunk, offset = chunk[skipped:], offset - skipped
+                        if not chunk:
+                            continue
+                    yield chunk
+            finally:
+                self._response = None
+
+class GuacFileSource(GuacRecordingSource):
+    """ A local recording, memory-mapped: The chunks are zero-copy memoryviews of the mapping
+
+    Remark: The chunks are released once the consumer asks for the next one, hence they must not be kept
+    """
+    def __init__(self, path, read_size: int = None):
+        super().__init__(os.fspath(path), read_size)
+
+    def tail(self, size: int) -> bytes:
+        with open(self.name, 'rb') as file_obj:
+            file_obj.seek(max(os.fstat(file_obj.fileno()).st_size - size, 0))
+            return file_obj.read()
+
+    def chunks(self, offset: int = 0):
+        with open(self.name, 'rb') as file_obj:
+            size = os.fstat(file_obj.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                if hasattr(mapping, 'madvise'):
+                    mapping.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapping)
+                try:
+                    for start in range(offset, size, self.read_size):
+                        chunk = view[start:start + self.read_size]
+                        try:
+                            yield chunk
+                        finally:
+                            chunk.release()
+                finally:
+                    view.release()
+
+class GuacFileObjectSource(GuacRecordingSource):
+    """ A recording read from a file-like object (e.g. stdin), it can be read more than once only if it is seekable """
+    def __init__(self, file_obj, read_size: int = None):
+        super().__init__(getattr(file_obj, 'name', '<stream>'), read_size)
+        self.file_obj = file_obj
+        self._consumed = False
+
+    def rereadable(self) -> bool:
+        return hasattr(self.file_obj, 'seekable') and self.file_obj.seekable()
+
+    def tail(self, size: int) -> bytes:
+        if not self.rereadable():
+            return None
+        position = self.file_obj.tell()
+        try:
+            end = self.file_obj.seek(0, os.SEEK_END)
+            self.file_obj.seek(max(end - size, 0))
+            return self.file_obj.read(size)
+        finally:
+            self.file_obj.seek(position)
+
+    def chunks(self, offset: int = 0):
+        if self._consumed or offset:
+            if not self.rereadable():
+                raise ValueError('The recording source cannot be read twice, nor seeked (not seekable): %s' % self.name)
+            self.file_obj.seek(offset)
+        self._consumed = True
+
+        while True:
+            chunk = self.file_obj.read(self.read_size)
+            if not chunk:
+                break
+            yield chunk
+
+class GuacBytesSource(GuacRecordingSource):
+    """ An in-memory recording, the chunks are zero-copy memoryviews """
+    def __init__(self, data, read_size: int = None):
+        super().__init__('<bytes>', read_size)
+        self.data = data
+
+    def tail(self, size: int) -> bytes:
+        return bytes(self.data[-size:])
+
+    def chunks(self, offset: int = 0):
+        with memoryview(self.data) as view:
+            for start in range(offset, len(view), self.read_size):
+                chunk = view[start:start + self.read_size]
+                try:
+                    yield chunk
+                finally:
+                    chunk.release()
+
+class GuacCachingSource(GuacRecordingSource):
+    """ Tees a recording streamed over HTTP(S) into the cache (GuacDiskCache)
+
+    The raw stream is stored once it was read completely (an interrupted read is discarded), its content hash is known
+    from then on and the next reads are served by the stored copy.
+    """
+    def __init__(self, source: GuacURLSource, cache: 'GuacDiskCache'):
+        super().__init__(source.name, source.read_size)
+        self.source = source
+        self.cache = cache
+        self.content_hash = None
+
+    def tail(self, size: int) -> bytes:
+        stored = self.cache.object_path(self.content_hash) if self.content_hash is not None else None
+        return GuacFileSource(stored).tail(size) if stored is not None else self.source.tail(size)
+
+    def close(self):
+        self.source.close()
+
+    def chunks(self, offset: int = 0):
+        stored = self.cache.object_path(self.content_hash) if self.content_hash is not None else None
+        if stored is not None:
+            yield from GuacFileSource(stored, read_size=self.read_size).chunks(offset)
+            return
+        if offset:
+            # A partial read is not stored
+            yield from self.source.chunks(offset)
+            return
+
+        digest = hashlib.sha256()
+        fd, partial_path = tempfile.mkstemp(dir=self.cache.objects_dir, prefix='.partial-')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as partial:
+                for chunk in self.source.chunks():
+                    digest.update(chunk)
+                    partial.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                self.content_hash = self.cache.store_object(partial_path, digest.hexdigest(), url=self.name,
+                                                            headers=self.source.headers)
+            elif os.path.exists(partial_path):
+                os.remove(partial_path)
+
+class GuacFollowSource(GuacRecordingSource):
+    """ Follows a recording which is still being written (e.g. a live session), like tail -f
+
+    Once the end of the source is reached, it is polled for the bytes appended since: A growing local file is mapped
+    again from the last offset, a URL is requested again from it (Range request). The following stops once no new data
+    showed up for idle_timeout seconds (None follows forever), or once close() is called (from another thread).
+
+    Remark: The recording cannot be read twice (no pre-pass), nor cached since its content changes
+    """
+    def __init__(self, source, poll_interval: float = 1.0, idle_timeout: float = 60.0, read_size: int = None,
+                 session=None):
+        source = GuacRecordingSource.open(source, read_size=read_size, session=session)
+        super().__init__(source.name, source.read_size)
+        self.source = source
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.position = 0  # The bytes read so far
+        self.polls = 0
+        self._stopped = threading.Event()
+
+    def rereadable(self) -> bool:
+        return False
+
+    def close(self):
+        self._stopped.set()
+        self.source.close()
+
+    def chunks(self, offset: int = 0):
+        self._stopped.clear()
+        self.position = offset
+        last_data = time.monotonic()
+        while not self._stopped.is_set():
+            position = self.position
+            try:
+                for chunk in self.source.chunks(self.position):
+                    self.position += len(chunk)
+                    yield chunk
+                    if self._stopped.is_set():
+                        return
+            except Exception as msg:
+                if self._stopped.is_set():
+                    return
+                # Resumed from the last offset by the next poll (e.g. a dropped connection)
+                logging.warning(' [-] Unable to read the followed recording: %s. Exception: %s' % (self.name, str(msg)))
+
+            if self.position > position:
+                last_data = time.monotonic()
+            elif self.idle_timeout is not None and time.monotonic() - last_data >= self.idle_timeout:
+                logging.info(' [-] No new data for %s seconds, stop following: %s' % (self.idle_timeout, self.name))
+                return
+            self.polls += 1
+            self._stopped.wait(self.poll_interval)
+
+class GuacDiskCache(object):
+    """ A persistent, content-addressed on-disk cache of the recordings and of their derived artifacts
+
+    The raw streams (downloaded recordings) are stored once under objects/, by SHA-256 of their content, whatever the
+    number of URLs pointing to them. The URLs are mapped to their content along with the validators of the response
+    (ETag, Last-Modified), hence the next runs revalidate them (conditional request) instead of downloading them again.
+    The local recordings are not copied, they are hashed once (by path, size and modification time).
+
+    The artifacts derived from a recording are stored under artifacts/<content hash>/: The timestamp index, the frame
+    metadata, the keyframes and the screenshots of each artifact key (trigger set, resolution, output format). The entries (raw streams
+    and artifact directories) are evicted least recently used first, once the cache grows over max_size.
+
+    Remark: The bookkeeping is a SQLite database and the files are written atomically, so the cache directory can be
+    shared by the workers of a batch (each process opens its own GuacDiskCache)
+    """
+    INDEX_NAME = 'index.npz'
+    METADATA_NAME = 'metadata.json'
+    MANIFEST_NAME = 'manifest.json'
+
+    def __init__(self, directory: str = '.guac-cache', max_size: int = 10 << 30):
+        self.directory = os.fspath(directory)
+        self.max_size = max_size
+        self.objects_dir = os.path.join(self.directory, 'objects')
+        self.artifacts_dir = os.path.join(self.directory, 'artifacts')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.artifacts_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.directory, 'cache.db'), timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript('''
+                CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT, etag TEXT, last_modified TEXT);
+                CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT);
+                CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, size INTEGER, last_access REAL);
+            ''')
+
+    def __repr__(self):
+        return 'GuacDiskCache(%s)' % self.directory
+
+    def close(self):
+        self._db.close()
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock, self._db:
+            return self._db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _write(path: str, write: Callable):
+        """ Writes the file atomically (a concurrent reader never sees a partial file) """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.partial-')
+        try:
+            with os.fdopen(fd, 'wb') as file_obj:
+                write(file_obj)
+            os.replace(partial_path, path)
+        except BaseException:
+            os.remove(partial_path)
+            raise
+
+    @staticmethod
+    def artifact_key(**params) -> str:
+        """ The key of the artifacts derived from given parameters (trigger set, resolution, output format...) """
+        return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    # Content hashes
+
+    def content_hash(self, source: GuacRecordingSource) -> str:
+        """ Returns the content hash of the source if it can be known before it is read (None otherwise): The local and
+        in-memory recordings are hashed, the URLs are revalidated """
+        if isinstance(source, GuacCachingSource):
+            return source.content_hash
+        if isinstance(source, GuacURLSource):
+            return self.revalidate(source.name, session=source.session)
+        if isinstance(source, GuacFileSource):
+            return self.file_hash(source.name)
+        if isinstance(source, GuacBytesSource):
+            return hashlib.sha256(source.data).hexdigest()
+        return None
+
+    def file_hash(self, path: str) -> str:
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        rows = self._query('SELECT hash FROM files WHERE path = ? AND size = ? AND mtime = ?',
+                           (path, stat.st_size, stat.st_mtime_ns))
+        if rows:
+            return rows[0][0]
+
+        with open(path, 'rb') as file_obj:
+            content_hash = hashlib.file_digest(file_obj, 'sha256').hexdigest()
+        self._query('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns, content_hash))
+        return content_hash
+
+    def revalidate(self, url: str, session: requests.Session = None) -> str:
+        """ Returns the content hash of the stored raw stream of the URL if it is still valid (the server answers a
+        conditional request with 304 Not Modified), None if it must be downloaded (again) """
+        rows = self._query('SELECT hash, etag, last_modified FROM urls WHERE url = ?', (url,))
+        if not rows or self.object_path(rows[0][0]) is None:
+            return None
+
+        content_hash, etag, last_modified = rows[0]
+        conditions = {}
+        if etag: conditions['If-None-Match'] = etag
+        if last_modified: conditions['If-Modified-Since'] = last_modified
+        if not conditions:
+            return None
+
+        session = session if session is not None else requests.Session()
+        try:
+            with session.get(url, headers=conditions, stream=True, verify=False, timeout=120) as response:
+                if response.status_code == 304:
+                    self.touch('objects/%s' % content_hash)
+                    return content_hash
+        except requests.RequestException as msg:
+            logging.warning(' [-] Unable to revalidate the cached recording: %s. Exception: %s' % (url, str(msg)))
+        return None
+
+    # Raw streams
+
+    def object_path(self, content_hash: str) -> str:
+        """ Returns the path of the stored raw stream, None if not stored """
+        path = os.path.join(self.objects_dir, content_hash)
+        return path if os.path.isfile(path) else None
+
+    def store_object(self, partial_path: str, content_hash: str, url: str = None, headers: dict = None) -> str:
+        """ Moves the (completely written) raw stream into the cache, and maps the URL to it """
+        path = os.path.join(self.objects_dir, content_hash)
+        if os.path.exists(path):
+            # Stored once
+            os.remove(partial_path)
+        else:
+            os.replace(partial_path, path)
+
+        if url is not None:
+            headers = headers if headers is not None else {}
+            self._query('INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)',
+                        (url, content_hash, headers.get('ETag'), headers.get('Last-Modified')))
+        self._account('objects/%s' % content_hash)
+        return content_hash
+
+    # Derived artifacts
+
+    def artifact_path(self, content_hash: str, *names) -> str:
+        return os.path.join(self.artifacts_dir, content_hash, *names)
+
+    def load_index(self, content_hash: str) -> GuacTimestampIndex:
+        path = self.artifact_path(content_hash, self.INDEX_NAME)
+        if not os.path.isfile(path):
+            return None
+
+        index = GuacTimestampIndex()
+        with np.load(path) as arrays:
+            index.timestamps = array('q', arrays['timestamps'].astype(np.int64).tobytes())
+            index.offsets = array('q', arrays['offsets'].astype(np.int64).tobytes())
+        self.touch('artifacts/%s' % content_hash)
+        return index
+
+    def store_index(self, content_hash: str, index: GuacTimestampIndex):
+        self._write(self.artifact_path(content_hash, self.INDEX_NAME),
+                    lambda file_obj: np.savez(file_obj, timestamps=np.array(index.timestamps, dtype=np.int64),
+                                              offsets=np.array(index.offsets, dtype=np.int64)))
+        self._account('artifacts/%s' % content_hash)
+
+    def load_metadata(self, content_hash: str) -> dict:
+        try:
+            with open(self.artifact_path(content_hash, self.METADATA_NAME), 'rb') as file_obj:
+                return json.load(file_obj)
+        except (OSError, ValueError):
+            return None
+
+    def store_metadata(self, content_hash: str, metadata: dict):
+        self._write(self.artifact_path(content_hash, self.METADATA_NAME),
+                    lambda file_obj: file_obj.write(json.dumps(metadata, default=str).encode()))
+        self._account('artifacts/%s' % content_hash)
+
+    def load_keyframes(self, content_hash: str) -> GuacKeyframeIndex:
+        directory = self.artifact_path(content_hash, 'keyframes')
+        try:
+            with open(os.path.join(directory, self.MANIFEST_NAME), 'rb') as file_obj:
+                manifest = json.load(file_obj)
+            keyframes = GuacKeyframeIndex(interval=manifest['interval'])
+            for name in manifest['keyframes']:
+                with open(os.path.join(directory, name), 'rb') as file_obj:
+                    keyframes.add(GuacKeyframe.from_bytes(file_obj.read()))
+        except (OSError, ValueError, KeyError):
+            return None
+        self.touch('artifacts/%s' % content_hash)
+        return keyframes
+
+    def store_keyframes(self, content_hash: str, keyframes: GuacKeyframeIndex):
+        directory = self.artifact_path(content_hash, 'keyframes')
+        names = []
+        for keyframe in keyframes:
+            names.append('%s.kf' % keyframe.frame_number)
+            self._write(os.path.join(directory, names[-1]), lambda file_obj: file_obj.write(keyframe.to_bytes()))
+
+        # The manifest is written last, it commits the keyframes
+        self._write(os.path.join(directory, self.MANIFEST_NAME),
+                    lambda file_obj: file_obj.write(json.dumps({'interval': keyframes.interval, 'keyframes': names}).encode()))
+        self._account('artifacts/%s' % content_hash)
+
+    def load_screenshots(self, content_hash: str, key: str) -> list:
+        """ Returns the stored screenshots [(frame number, path)] of given artifact key, None if not stored """
+        directory = self.artifact_path(content_hash, 'screenshots-%s' % key)
+        try:
+            with open(os.path.join(directory, self.MANIFEST_NAME), 'rb') as file_obj:
+                manifest = json.load(file_obj)
+        except (OSError, ValueError):
+            return None
+
+        screenshots = [(entry['frame_number'], os.path.join(directory, entry['file'])) for entry in manifest['screenshots']]
+        if not all(os.path.isfile(path) for _, path in screenshots):
+            return None
+        self.touch('artifacts/%s' % content_hash)
+        return screenshots
+
+    def store_screenshots(self, content_hash: str, key: str, screenshots: list, params: dict = None):
+        """ Copies the (dumped) screenshots [(frame number, path)] into the cache, under given artifact key """
+        directory = self.artifact_path(content_hash, 'screenshots-%s' % key)
+        manifest = {'params': params, 'screenshots': []}
+        for position, (frame_number, path) in enumerate(screenshots):
+            name = '%s_%s%s' % (position, frame_number, os.path.splitext(path)[1])
+            with open(path, 'rb') as screenshot:
+                self._write(os.path.join(directory, name), lambda file_obj: shutil.copyfileobj(screenshot, file_obj))
+            manifest['screenshots'].append({'frame_number': frame_number, 'file': name})
+
+        # The manifest is written last, it commits the screenshots
+        self._write(os.path.join(directory, self.MANIFEST_NAME),
+                    lambda file_obj: file_obj.write(json.dumps(manifest, default=str).encode()))
+        self._account('artifacts/%s' % content_hash)
+
+    # LRU eviction
+
+    def touch(self, name: str):
+        self._query('UPDATE entries SET last_access = ? WHERE name = ?', (time.time(), name))
+
+    def _account(self, name: str):
+        """ Updates the size of the entry (a raw stream or an artifacts directory), then evicts if needed """
+        path = os.path.join(self.directory, name)
+        if os.path.isdir(path):
+            size = sum(os.path.getsize(os.path.join(root, file_name))
+                       for root, _, file_names in os.walk(path) for file_name in file_names)
+        else:
+            size = os.path.getsize(path)
+        self._query('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (name, size, time.time()))
+        self.evict(keep=name)
+
+    def size(self) -> int:
+        return self._query('SELECT COALESCE(SUM(size), 0) FROM entries')[0][0]
+
+    def evict(self, keep: str = None):
+        """ Removes the least recently used entries (but the given one) until the cache fits into max_size """
+        total = self.size()
+        if total <= self.max_size:
+            return
+        for name, size in self._query('SELECT name, size FROM entries ORDER BY last_access'):
+            if total <= self.max_size:
+                break
+            if name == keep:
+                continue
+            self.remove(name)
+            total -= size
+
+    def remove(self, name: str):
+        path = os.path.join(self.directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+        self._query('DELETE FROM entries WHERE name = ?', (name,))
+        if name.startswith('objects/'):
+            self._query('DELETE FROM urls WHERE hash = ?', (name.split('/', 1)[1],))
+        logging.info(' [-] Evicted from the cache: %s' % name)
+
+class GuacProfiler(object):
+    """ Instrumentation of a rebuild: Per-stage wall and CPU time, per-opcode counters, the instructions queue depth
+    over time and the peak memory
+
+    - The stages are timed by the threads running them (thread CPU time), per chunk (download, tokenize, enqueue),
+    batch (dequeue, build), frame (composite), image (decode) and screenshot (screenshot, encode, write). The times are
+    exclusive: A stage timed within another one (like decode within composite) is deducted from the outer one.
+    - The opcodes are counted by the tokenizer (count, bytes) and timed by the compositor (replay time).
+    - The queue depth is sampled by the rebuild thread every sample_interval seconds at most, the peak memory is the
+    maximum resident set size of the process.
+
+    The components check for a profiler once per chunk, batch, frame or image only, hence it costs nothing when
+    disabled. The statistics are emitted as a JSON line or as Prometheus text (exposition format) to the output: A path
+    (appended), a file-like object or '-' (stdout).
+    """
+    FORMATS = ('json', 'prometheus')
+
+    def __init__(self, output=None, format: str = 'json', sample_interval: float = 0.1, labels: dict = None):
+        if format not in self.FORMATS:
+            raise ValueError('Unsupported profile format: %s' % format)
+        self.output = output
+        self.format = format
+        self.sample_interval = sample_interval
+        self.labels = dict(labels or {})
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.stages = {}       # stage -> [wall, cpu, count]
+        self.opcodes = {}      # opcode -> [count, bytes, replay time]
+        self.queue_depth = []  # (seconds since the start, depth)
+        self.peak_depth = 0
+        self.started = time.perf_counter()
+        self.wall_time = None
+        self._next_sample = 0.0
+
+    def _nested(self) -> list:
+        nested = getattr(self._local, 'nested', None)
+        if nested is None:
+            nested = self._local.nested = [0.0, 0.0]
+        return nested
+
+    def clock(self) -> tuple:
+        """ Starts timing a stage (in the current thread) """
+        nested = self._nested()
+        return time.perf_counter(), time.thread_time(), nested[0], nested[1]
+
+    def add(self, stage: str, started: tuple, count: int = 1):
+        """ Accounts the time elapsed since clock() to the stage, minus the stages timed in between """
+        wall, cpu = time.perf_counter() - started[0], time.thread_time() - started[1]
+        nested = self._nested()
+        exclusive_wall = wall - (nested[0] - started[2])
+        exclusive_cpu = cpu - (nested[1] - started[3])
+        nested[0], nested[1] = started[2] + wall, started[3] + cpu
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                self.stages[stage] = [exclusive_wall, exclusive_cpu, count]
+            else:
+                entry[0] += exclusive_wall
+                entry[1] += exclusive_cpu
+                entry[2] += count
+
+    def iterate(self, stage: str, iterable):
+        """ Iterates over the iterable, timing each step as the stage """
+        iterator = iter(iterable)
+        while True:
+            started = self.clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add(stage, started)
+            yield item
+
+    def count(self, instructions: list, offsets: list, start: int):
+        """ Counts the instructions (and their bytes) per opcode, offsets are their (absolute) end offsets in the stream,
+        start the one of the first instruction """
+        opcodes = self.opcodes
+        for inst, offset in zip(instructions, offsets):
+            entry = opcodes.get(inst.name)
+            if entry is None:
+                entry = opcodes.setdefault(inst.name, [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += offset - start
+            start = offset
+
+    def time_opcode(self, name: str, elapsed: float):
+        entry = self.opcodes.get(name)
+        if entry is None:
+            entry = self.opcodes.setdefault(name, [0, 0, 0.0])
+        entry[2] += elapsed
+
+    def sample(self, depth: int):
+        """ Samples the instructions queue depth """
+        self.peak_depth = max(self.peak_depth, depth)
+        elapsed = time.perf_counter() - self.started
+        if elapsed >= self._next_sample:
+            self.queue_depth.append((round(elapsed, 3), depth))
+            self._next_sample = elapsed + self.sample_interval
+
+    def finish(self):
+        self.wall_time = time.perf_counter() - self.started
+
+    @staticmethod
+    def peak_memory() -> int:
+        """ The maximum resident set size of the process (bytes), None if unknown """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {stage: {'wall': round(wall, 6), 'cpu': round(cpu, 6), 'count': count}
+                      for stage, (wall, cpu, count) in self.stages.items()}
+        return {
+            'labels': self.labels,
+            'wall_time': round(self.wall_time if self.wall_time is not None else time.perf_counter() - self.started, 6),
+            'stages': stages,
+            'opcodes': {name: {'count': count, 'bytes': size, 'time': round(elapsed, 6)}
+                        for name, (count, size, elapsed) in sorted(self.opcodes.items())},
+            'queue_depth': {'peak': self.peak_depth, 'samples': self.queue_depth},
+            'peak_memory': self.peak_memory(),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.stats(), separators=(',', ':'))
+
+    def to_prometheus(self) -> str:
+        stats = self.stats()
+
+        def metric(name: str, kind: str, samples: list) -> list:
+            lines = ['# TYPE %s %s' % (name, kind)]
+            for labels, value in samples:
+                labels = dict(self.labels, **labels)
+                text = ','.join('%s="%s"' % (key, str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                                for key, label in labels.items())
+                lines.append('%s{%s} %s' % (name, text, value) if text else '%s %s' % (name, value))
+            return lines
+
+        stages, opcodes = stats['stages'], stats['opcodes']
+        lines = metric('guac_rebuild_seconds', 'gauge', [({}, stats['wall_time'])])
+        lines += metric('guac_stage_seconds_total', 'counter',
+                        [({'stage': stage, 'clock': clock}, values[clock])
+                         for stage, values in stages.items() for clock in ('wall', 'cpu')])
+        lines += metric('guac_stage_calls_total', 'counter', [({'stage': stage}, values['count'])
+                                                             for stage, values in stages.items()])
+        for field, name in (('count', 'guac_instructions_total'), ('bytes', 'guac_instruction_bytes_total'),
+                            ('time', 'guac_instruction_seconds_total')):
+            lines += metric(name, 'counter', [({'opcode': opcode}, values[field]) for opcode, values in opcodes.items()])
+        lines += metric('guac_queue_depth_peak', 'gauge', [({}, stats['queue_depth']['peak'])])
+        if stats['peak_memory'] is not None:
+            lines += metric('guac_peak_memory_bytes', 'gauge', [({}, stats['peak_memory'])])
+        return '\n'.join(lines) + '\n'
+
+    def emit(self, output=None):
+        """ Writes the statistics (JSON line or Prometheus text) to the output """
+        output = output if output is not None else self.output
+        if output is None:
+            return
+        text = self.to_json() + '\n' if self.format == 'json' else self.to_prometheus()
+        if output == '-':
+            sys.stdout.write(text)
+        elif isinstance(output, (str, os.PathLike)):
+            with self._lock, open(output, 'a', encoding='utf-8') as file_obj:
+                file_obj.write(text)
+        else:
+            output.write(text)
+
+class GuacInstructionChannel(object):
+    """ A bounded producer/consumer channel handing the instructions over in batches (one list per parsed chunk)
+
+    Both sides block with a timeout instead of spinning: The producer (stream thread) waits while the channel is full
+    (backpressure, so a fast network cannot balloon the memory), the consumer (rebuild thread) waits while it is empty.
+    Either side can give up: close() marks the end of the stream (the consumer gets None once drained), cancel() tells
+    the producer that nobody consumes anymore.
+    """
+    POLL_INTERVAL = 0.1  # seconds
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._queue = Queue(maxsize=maxsize)
+        self._cancelled = threading.Event()
+        self.batches = 0
+        self.instructions = 0
+        self.peak_depth = 0
+        self.producer_wait = 0.0  # Time spent blocked on a full channel (seconds)
+        self.consumer_wait = 0.0  # Time spent blocked on an empty channel (seconds)
+
+    def __len__(self):
+        """ The current depth (batches) """
+        return self._queue.qsize()
+
+    def _put(self, item) -> bool:
+        started = time.perf_counter()
+        try:
+            while not self._cancelled.is_set():
+                try:
+                    self._queue.put(item, timeout=self.POLL_INTERVAL)
+                    return True
+                except Full:
+                    continue
+            return False
+        finally:
+            self.producer_wait += time.perf_counter() - started
+
+    def put(self, batch: list) -> bool:
+        """ Hands the batch over (blocks while the channel is full), returns False if the channel was cancelled """
+        if not batch:
+            return not self._cancelled.is_set()
+        if not self._put(batch):
+            return False
+        self.batches += 1
+        self.instructions += len(batch)
+        self.peak_depth = max(self.peak_depth, self._queue.qsize())
+        return True
+
+    def close(self):
+        """ Marks the end of the stream """
+        self._put(None)
+
+    def cancel(self):
+        """ The consumer is gone, unblocks (and stops) the producer """
+        self._cancelled.set()
+
+    def get(self, timeout: float = None) -> list:
+        """ Returns the next batch, or None once the channel is closed and drained (raises Empty on timeout) """
+        started = time.perf_counter()
+        try:
+            return self._queue.get(timeout=timeout if timeout is not None else self.POLL_INTERVAL)
+        finally:
+            self.consumer_wait += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {
+            'maxsize': self.maxsize,
+            'depth': len(self),
+            'peak_depth': self.peak_depth,
+            'batches': self.batches,
+            'instructions': self.instructions,
+            'producer_wait': round(self.producer_wait, 3),
+            'consumer_wait': round(self.consumer_wait, 3),
+        }
+
 class GuacRecordingRebuilder:
 
     cache = None
 
     def __init__(self, StreamURL: str, CreateScreenshots=True, ScreenCaptureProgressTriggers=[4, 50, 99],
                  ScreenCapturePrefix=None, ReplayRecording=False, debug_mode: bool = False,
-                 SessionObj=None, logger=None):
+                 SessionObj=None, logger=None, RecordingDuration: int = None, TriggerResolution: str = None,
+                 SnapshotBudget: int = 32, QueueSize: int = 256, ReadSize: int = None, Cache=None,
+                 KeyframeInterval: int = None, ScreenshotWriter=None, ExportVideo=None, ScreenCaptureOnChange=None,
+                 DecodeCache=64 << 20, DecodeWorkers: int = None, Profile=None,
+                 ScreenCaptureTimeTriggers: list = None, EarlyTermination: bool = False, Follow=False,
+                 ScreenCaptureInterval: int = None):
         """
             :param StreamURL:
-                A URL pointing to a Guacamole (.guac) recording stream containing the session recording.
+                A URL pointing to a Guacamole (.guac) recording stream containing the session recording. A local path
+                (memory-mapped), a file-like object ('-' for stdin), bytes or a GuacRecordingSource are accepted too.
             :param ScreenCaptureProgressTriggers:
                 A list of percentages representing the progress points of the current recording at which to take screen captures.
             :param debug_mode:
@@ -315,6 +2867,68 @@ class GuacRecordingRebuilder:
                 HTTP Requests session object to use (possibly with initialized headers, cookies etc.)
             :param SessionObj:
                 A logger object
+            :param RecordingDuration:
+                The recording duration (in seconds) if known up front (e.g. from metadata), allows to take the screen
+                captures while the stream is being processed.
+            :param TriggerResolution:
+                How the progress triggers are resolved, since the frames are not buffered:
+                 - 'duration': From the RecordingDuration (default when it is given)
+                 - 'tail': From the last sync timestamp, read from the tail of the recording (a Range request for
+                   URLs), default otherwise. Falls back to 'prepass' if the tail cannot be read, to 'snapshots' if
+                   the stream cannot be read twice either (e.g. stdin, Follow) or is a URL (not downloaded twice)
+                 - 'prepass': From a cheap pre-pass over the sync timestamps of the stream (the stream is read twice)
+                 - 'snapshots': From a bounded set of canvas snapshots, resolved at the end (opt-in, approximate: The
+                   screenshots are the snapshots taken about duration/SnapshotBudget apart)
+                The screenshots are the exact frames, except with 'snapshots'.
+            :param SnapshotBudget:
+                The maximum number of canvas snapshots retained by the 'snapshots' trigger resolution.
+            :param QueueSize:
+                The maximum number of instruction batches (one per stream chunk) handed over to the rebuild thread,
+                the stream is not read further while the queue is full.
+            :param ReadSize:
+                The size of the chunks read from the source (4096 bytes for URLs, 64 KiB otherwise by default).
+            :param Cache:
+                A GuacDiskCache, or its directory (opened by the rebuilder, e.g. in the batch workers). The downloaded
+                recordings and the derived artifacts (timestamp index, metadata, screenshots) are cached: A later run
+                over the same recording and triggers restores the screenshots without parsing the stream again.
+            :param KeyframeInterval:
+                The interval (in seconds of the recording) between the keyframes (display snapshots) taken while
+                rebuilding, 60 seconds with a Cache and disabled otherwise by default (0 disables them). The screenshots
+                of new triggers are rendered from the nearest keyframes (see render_frames), without a full replay.
+            :param ScreenshotWriter:
+                A GuacScreenshotWriter (output directory or sink, JPEG/PNG/WebP, quality...), or the output directory.
+                The screenshots are encoded and written by its workers, off the render thread ('screenshots', JPEG by
+                default).
+            :param ExportVideo:
+                A GuacVideoExporter (frame rate, speed-up, downscaling...), or the output video path (.mp4 or .webm,
+                25 fps, real time). The composited frames are piped into ffmpeg while rebuilding (headless).
+            :param ScreenCaptureOnChange:
+                A ScreenChangeTrigger (threshold, minimum interval, maximum count...), or True for the defaults. The
+                screenshots are taken as well whenever the screen content has changed significantly since the last one.
+            :param DecodeCache:
+                The size (bytes of decoded pixels) of the decoded images cache, 64 MiB by default (0 disables it), or
+                a GuacImageCache (e.g. shared across the rebuilders). The repeated tiles are decoded once only.
+            :param DecodeWorkers:
+                The number of threads decoding the image streams ahead of the compositor (GuacImageDecoder), up to 4
+                by default (one core is left to the rebuild thread, 0 decodes them inline).
+            :param Profile:
+                A GuacProfiler (output, JSON lines or Prometheus text), True, or the output path (Prometheus text for
+                a .prom path, JSON lines otherwise). The per-stage timings, per-opcode counters, queue depth and peak
+                memory of each run are collected (see profiler.stats()) and emitted to the output, if any.
+            :param ScreenCaptureTimeTriggers:
+                A list of times (in seconds from the start of the recording) at which to take screen captures as well,
+                they do not depend on the recording duration.
+            :param EarlyTermination:
+                Stops reading the stream once all the screen captures are taken (the duration, tail or time triggers
+                only, not with the snapshots, the change triggers, the video export nor the replay). The recording is
+                not read completely, hence nothing is stored in the cache.
+            :param Follow:
+                Follows a recording which is still being written (live session): True, or the idle timeout (seconds
+                without new data, 60 by default) after which the recording is considered complete. The source is
+                polled from the last offset once its end is reached (see GuacFollowSource), the new frames are
+                composited as they come, source.close() stops the following.
+            :param ScreenCaptureInterval:
+                Takes a screen capture every given number of seconds of the recording as well (rolling screenshots).
         """
         self._is_running = False
         self.debug_mode = debug_mode
@@ -332,18 +2946,83 @@ class GuacRecordingRebuilder:
 
         self.logger = logging
         self.url = StreamURL
-        self.instructions = Queue()
-        self.lock = threading.Lock()
+        self.QueueSize = QueueSize
+        self.instructions = GuacInstructionChannel(maxsize=QueueSize)
+        self.tokenizer = guac_instruction_tokenizer()
         self.ScreenCaptureProgressTriggers = ScreenCaptureProgressTriggers
         self.ReplayRecording = ReplayRecording
         self.CreateScreenshots = CreateScreenshots
         self.ScreenCapturePrefix = ScreenCapturePrefix
+        self.RecordingDuration = RecordingDuration
+        self.SnapshotBudget = SnapshotBudget
+        self.ScreenCaptureTimeTriggers = sorted(set(ScreenCaptureTimeTriggers or [])) or None
+        self.EarlyTermination = EarlyTermination
+        self.ScreenCaptureInterval = ScreenCaptureInterval or None
+        self.index = GuacTimestampIndex()
+        self.prepass_index = None
+        self.tail_end_time = None  # The last sync timestamp, read from the tail of the recording ('tail' resolution)
+
+        if TriggerResolution is None:
+            TriggerResolution = 'duration' if RecordingDuration is not None else 'tail'
+        if TriggerResolution not in ['duration', 'prepass', 'snapshots', 'tail']:
+            raise ValueError('Unsupported trigger resolution: %s' % TriggerResolution)
+        if TriggerResolution == 'duration' and RecordingDuration is None:
+            raise ValueError('The duration trigger resolution requires RecordingDuration')
+        self.TriggerResolution = TriggerResolution
 
         if SessionObj is None:
             self.SessionObj = requests.Session()
         else:
             self.SessionObj = SessionObj
 
+        self.ReadSize = ReadSize
+        self.stream_error = None  # The exception which stopped the stream (if any)
+        self.source = GuacRecordingSource.open(StreamURL, read_size=ReadSize, session=self.SessionObj) \
+            if StreamURL is not None else None
+        if self.source is not None and Follow is not False and Follow is not None:
+            self.source = GuacFollowSource(self.source) if Follow is True else GuacFollowSource(self.source, idle_timeout=Follow)
+        if self.source is not None: self.url = self.source.name
+        if self.TriggerResolution == 'prepass' and self.source is not None and not self.source.rereadable():
+            raise ValueError('The prepass trigger resolution requires a source which can be read twice: %s' % self.source)
+
+        self.Cache = GuacDiskCache(Cache) if isinstance(Cache, (str, os.PathLike)) else Cache
+        self.content_hash = None     # The content hash of the recording (if known, with a cache only)
+        self.cache_status = None     # 'hit' (restored), 'keyframes' (rendered from the cached keyframes) or 'miss'
+        self.metadata = None         # The frame metadata of the recording, once rebuilt (or restored)
+        self.display_size = None
+        self.stream_complete = False
+        self.stopped_early = False   # The rebuild stopped once all the screen captures were taken (EarlyTermination)
+        self.bytes_read = 0
+        self._active_source = None
+
+        self._owns_writer = not isinstance(ScreenshotWriter, GuacScreenshotWriter)
+        if ScreenshotWriter is None:
+            ScreenshotWriter = GuacScreenshotWriter()
+        elif self._owns_writer:
+            ScreenshotWriter = GuacScreenshotWriter(directory=ScreenshotWriter)
+        self.writer = ScreenshotWriter
+
+        self.video = GuacVideoExporter(ExportVideo) if isinstance(ExportVideo, (str, os.PathLike)) else ExportVideo
+        self.ScreenCaptureOnChange = ScreenChangeTrigger() if ScreenCaptureOnChange is True else ScreenCaptureOnChange or None
+        self.image_cache = GuacImageCache(DecodeCache) if isinstance(DecodeCache, int) and DecodeCache > 0 \
+            else DecodeCache or None
+        if DecodeWorkers is None:
+            DecodeWorkers = max(min(4, (os.cpu_count() or 1) - 1), 0)
+        self.DecodeWorkers = DecodeWorkers
+
+        if Profile is True:
+            Profile = GuacProfiler()
+        elif isinstance(Profile, (str, os.PathLike)):
+            Profile = GuacProfiler(output=Profile, format='prometheus' if str(Profile).endswith('.prom') else 'json')
+        self.profiler = Profile or None
+        if self.profiler is not None:
+            self.profiler.labels.setdefault('recording', str(self.url))
+
+        if KeyframeInterval is None:
+            KeyframeInterval = 60 if self.Cache is not None else 0
+        self.KeyframeInterval = KeyframeInterval
+        self.keyframes = None  # GuacKeyframeIndex, once rebuilt (or loaded from the cache)
+
         self._stop_processing_event = threading.Event()
         self._stop_rebuild_event = threading.Event()
 
@@ -365,156 +3044,230 @@ class GuacRecordingRebuilder:
         Example:
 
         4.size,1.0,4.1024,3.768; -> LENGTH.<OPCODE>,LENGTH.<VALUE_OF_LAYER_INDEX>,LENGTH.<VALUE_OF_WIDTH>,LENGTH.<VALUE_OF_HEIGHT>;
+
+        Remark: The chunk may end in the middle of an instruction, in such case the incomplete instruction is kept by the
+        tokenizer and completed by the following chunk(s)
         """
         instructions = []
-
-        try:
-            # Pull all instructions (as they are separated by semicolon)
-            raw_instructions = chunk.split(b';')
-
-            incomplete_inst_index = None
-            inst_index = -1
-
-            # Determine incomplete instruction (if any)
-            # - Proper instruction ends on semicolon, hence if last instruction is complete,
-            #   the raw_instructions should end on '', else the last instruction is incomplete
-            if b'' != raw_instructions[-1]:
-                incomplete_inst_index = len(raw_instructions) - 1
+        decoders = Instruction_Decoders
+        offsets = []
+        consumed = self.tokenizer.consumed
+
+        kept_offsets = offsets  # The end offsets of the instructions returned (the malformed ones are skipped)
+        for elements, offset in zip(self.tokenizer.feed(chunk, offsets), offsets):
+            decoder = decoders.get(elements[0])
+            if decoder is None:
+                # Unsupported instruction (kept as a bare opcode)
+                instructions.append(guac_unsupported_instruction(elements[0].decode(errors='replace'), tuple(elements[1:])))
             else:
-                if len(raw_instructions) == 1 and b';' not in chunk:
-                    incomplete_inst_index = 0
-                else:
-                    # Remove last empty string (indicating completeness of the last instruction)
-                    raw_instructions = raw_instructions[:-1]
-
-            # Parse complete instructions
-            for inst_bytes in raw_instructions:
-                inst_index += 1
-
-                # Handle incomplete instruction
-                if incomplete_inst_index is not None:
-                    if inst_index == incomplete_inst_index:
-                        return instructions, inst_bytes
-
-                # Create empty instruction object
-                inst_obj = guac_instruction()
-
-                # Get instruction arguments
-                args = inst_bytes.split(b',')
-                # WORKAROUND: The custom's data may contain multiple comma characters, hence breaking the parsing, we need to fix it
-                if b'custom' in inst_bytes:
-                    # The first argument (at index 0) is the opcode len and opcode name, the rest is JSON data
-                    args = [args[0], b','.join(args[1:])]
-
-                i = -1
-                opcode_parsed = None
-                # Iterate over all arguments for given instruction buffer (the first arg indicates the opcode)
-                for arg in args:
-                    arg_params = arg.split(b'.')
-                    if opcode_parsed is None:  # Get the opcode
-                        inst_obj.opcode = arg_params[1]
-                        inst_obj.opcode_len = to_int(arg_params[0])
-                        opcode_parsed = True
-                        continue
-
-                    i += 1
-
-                    # Pull instruction details according to given instruction names and pass them via handlers (if any)
-                    if inst_obj.opcode.decode() in Instruction_Handlers.keys():
-                        try:
-                            opcode_arguments = list(
-                                Instruction_Handlers[inst_obj.opcode.decode()].get('arguments', {}).keys())
-                            arg_name = opcode_arguments[i] if len(opcode_arguments) >= i else None
-                        except Exception:
-                            raise Exception(
-                                "Exception: Unsupported Instruction: %s. Review instruction's handlers, the mapping at index: %s is missing..." % (
-                                inst_obj.opcode.decode(), i))
-
-                        handlers = Instruction_Handlers[inst_obj.opcode.decode()].get('arguments', {}).get(arg_name,
-                                                                                                           None)
-                        value = arg_params[1]
-
-                        if handlers is not None:
-                            for handler in handlers:
-                                value = handler(value)
-                                pass
-
-                        # Dynamically update instruction object attributes
-                        setattr(inst_obj, arg_name, value)
-
+                try:
+                    inst_obj = decoder(elements)
+                except Exception as msg:
+                    # The instruction is consumed already, only this one is lost
+                    self.logger.error(' [-] Unable to decode the instruction: %s. Exception: %s' % (elements[0], str(msg)))
+                    if kept_offsets is offsets:
+                        kept_offsets = offsets[:len(instructions)]
+                    continue
+                if inst_obj.opcode == guac_opcode.sync:
+                    self.index.add(inst_obj.timestamp, offset)
                 instructions.append(inst_obj)
+            if kept_offsets is not offsets:
+                kept_offsets.append(offset)
 
-            # Return complete instructions, no need to lookup the stream anymore
-            return instructions, b''
+        if self.profiler is not None:
+            self.profiler.count(instructions, kept_offsets, consumed)
+        return instructions
 
-        except Exception as msg:
-            self.logger.error('Exception: %s' % msg)
-            return instructions, b''
+    def open_source(self, url=None) -> GuacRecordingSource:
+        """ Returns the recording's source, or the one of given url (path, file-like object, bytes...) """
+        if url is None: return self.source
+        return GuacRecordingSource.open(url, read_size=self.ReadSize, session=self.SessionObj)
 
-    def parse_stream_instructions(self, url: str = None, dump_raw_stream: bool = False):
+    def parse_stream_instructions(self, url=None, dump_raw_stream: bool = False):
+        """ Parses the recording's source and hands the instructions over to the rebuild thread
 
-        inst_count = 0
+        :param dump_raw_stream: The raw stream is written to raw_stream.bin as well
+        """
+        inst_count = -1
 
-        if url is None: url = self.url
-        self.logger.info('[+] Process instructions from stream: %s' % url)
+        source = self.open_source(url)
+        self.logger.info('[+] Process instructions from stream: %s' % source)
         raw_stream_fobj = None
 
         if dump_raw_stream:
             raw_stream_fobj = open(r'raw_stream.bin', 'wb')
 
-        # req = urllib.request.Request(url)
-        # req.add_header('Authorization', headers['Authorization'])
-        # req.add_header('User-agent', headers['User-agent'])
-        # with urllib.request.urlopen(req, timeout=120) as response:
-        with self.SessionObj.get(url, stream=True, verify=False, timeout=120) as response:
-            response.raise_for_status()
-            if response.status_code == 200:
-                chunk_size = 4096
-                unprocessed_chunk = b''
-                inst_count = -1
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    if chunk:
-                        if dump_raw_stream:
-                            raw_stream_fobj.write(chunk)
-                            continue
-                        try:
-                            instructions, unprocessed_chunk = self.parse_stream_chunk(
-                                chunk=chunk if unprocessed_chunk == b'' else unprocessed_chunk + chunk)
+        self.stream_complete = False
+        self.bytes_read = 0
+        self._active_source = source
+        profiler = self.profiler
+        try:
+            self.tokenizer.reset()
+            self.index = GuacTimestampIndex()
+            for chunk in source if profiler is None else profiler.iterate('download', source):
+                self.bytes_read += len(chunk)
+                if dump_raw_stream:
+                    raw_stream_fobj.write(chunk)
+                try:
+                    started = profiler.clock() if profiler is not None else None
+                    batch = self.parse_stream_chunk(chunk=chunk)
+                    for inst in batch:
+                        inst_count += 1
+                        inst.id = inst_count
+                    if started is not None:
+                        profiler.add('tokenize', started)
+                        started = profiler.clock()
+
+                    enqueued = self.enqueue_instructions(batch)
+                    if started is not None:
+                        profiler.add('enqueue', started)
+                    if not enqueued:
+                        if self.stopped_early:
+                            self.logger.info(' [-] All the screen captures are taken, exiting stream...')
+                        else:
+                            self.logger.warning(' [-] The instructions are not consumed anymore, exiting stream...')
+                        break
 
-                            for inst in instructions:
-                                inst_count += 1
-                                inst.id = inst_count
-                                self.enqueue_instruction(inst)
+                except Exception as msg:
+                    # The chunk is lost, the stream goes on (the run is reported as failed)
+                    self.stream_error = msg
+                    self.logger.error(' [-] Unable to hand the instructions over: %s. Exception: %s' % (source, str(msg)))
+            else:
+                self.stream_complete = True
 
-                        except Exception as msg:
-                            print('Failed to extend instructions queue: Error: ', str(msg))
-                    else:
-                        self.logger.info('The chunk is empty, exiting stream...')
-                        break
+        except Exception as msg:
+            if self.stopped_early:
+                # The source was closed by the rebuild thread
+                self.logger.info(' [-] The stream was closed early: %s' % source)
             else:
-                print(f"Failed to retrieve stream: {response.status_code}")
+                self.stream_error = msg
+                self.logger.error(' [-] Unable to read the stream: %s. Exception: %s' % (source, str(msg)))
+
+        finally:
+            self._active_source = None
+            if raw_stream_fobj is not None:
+                raw_stream_fobj.close()
 
-        if raw_stream_fobj is not None:
-            raw_stream_fobj.close()
+            # The rebuild thread stops once the remaining batches are processed
+            self.instructions.close()
+            self.logger.info(' [-] Event (_stop_processing_event) -> No more instructions in the stream...')
+            self.logger.info(' [-] %s instructions enqueued...' % inst_count)
+            self._stop_processing_event.set()
 
-        self.logger.info(' [-] Event (_stop_processing_event) -> No more instructions in the stream...')
-        self.logger.info(' [-] %s instructions enqueued...' % inst_count)
-        self._stop_processing_event.set()
+    def enqueue_instructions(self, batch: List[guac_instruction]) -> bool:
+        """ Hands the batch over to the rebuild thread (blocks while the queue is full), False if not consumed anymore """
+        return self.instructions.put(batch)
 
-    def enqueue_instruction(self, inst: guac_instruction):
+    def enqueue_instruction(self, inst: guac_instruction) -> bool:
         if inst is None:
             raise ValueError("Cannot insert None element")
 
+        return self.enqueue_instructions([inst])
+
+    def create_screen_capture_triggers(self, index: GuacTimestampIndex, trigger_screenshot_on_progress: list):
+        """ Maps the percentages of progress indicated in trigger_screenshot_on_progress to the frames (by binary search
+        over the timestamp index), returns the list of screen capture triggers ordered by time """
+        if len(index) <= 2:
+            return None
+
+        duration = index.duration
+        self.logger.info(' [-] The recording duration: %s seconds' % duration)
+        self.logger.info(' [-] Processing on-progress triggers...')
+
+        screen_capture_triggers = []
+        frame_numbers = set()
+        for _progress_percentage in sorted(trigger_screenshot_on_progress):
+            frame_number = index.frame_at_progress(_progress_percentage)
+            if frame_number is None or frame_number in frame_numbers:
+                continue
+
+            frame_numbers.add(frame_number)
+            time_s = index.timestamps[frame_number]
+            screen_capture_triggers.append(
+                ScreenCaptureTrigger(_progress_percentage, duration, time_s - index.start_time, time_s, frame_number))
+
+        return screen_capture_triggers
+
+    def create_duration_triggers(self, start_time: int, duration: int, trigger_screenshot_on_progress: list):
+        """ Creates the screen capture triggers from the known recording duration (no need to see all the frames first) """
+        self.logger.info(' [-] The recording duration (known up front): %s seconds' % duration)
+        return [ScreenCaptureTrigger(_progress_percentage, duration, duration * _progress_percentage / 100,
+                                     start_time + duration * _progress_percentage / 100)
+                for _progress_percentage in sorted(trigger_screenshot_on_progress)]
+
+    def create_time_triggers(self, start_time: int, time_triggers: list):
+        """ Creates the screen capture triggers at given times (in seconds from the start of the recording) """
+        return [ScreenCaptureTrigger(None, None, elapsed_seconds, start_time + elapsed_seconds)
+                for elapsed_seconds in sorted(time_triggers)]
+
+    def scan_tail(self, url=None):
+        """ Reads the last sync timestamp (seconds) from the tail of the stream, None if unknown
+
+        Remark: Only the tail is read (a suffix Range request for URLs), it is extended once if it holds no sync
+        """
+        source = self.open_source(url)
+        for size in (TAIL_SIZE, TAIL_SIZE << 4):
+            try:
+                data = source.tail(size)
+            except Exception as msg:
+                self.logger.error(' [-] Unable to read the tail of the stream: %s. Exception: %s' % (source, str(msg)))
+                return None
+            if data is None:
+                return None
+
+            # The elements are length prefixed, a match within an argument (e.g. a blob) is discarded
+            timestamp = None
+            for match in SYNC_PATTERN.finditer(data):
+                if int(match.group(1)) == len(match.group(2)):
+                    timestamp = int(match.group(2))
+            if timestamp is not None:
+                return to_seconds(timestamp)
+            if len(data) < size:
+                return None
+        return None
+
+    def scan_timestamp_index(self, url=None) -> GuacTimestampIndex:
+        """ Cheap pre-pass over the stream, building the timestamp index (sync instructions only) """
+        source = self.open_source(url)
+        self.logger.info('[+] Pre-pass: Building the timestamp index from stream: %s' % source)
+
+        sync_decoder = Instruction_Decoders[b'sync']
+        tokenizer = guac_instruction_tokenizer()
+        index = GuacTimestampIndex()
+        for chunk in source:
+            offsets = []
+            for elements, offset in zip(tokenizer.feed(chunk, offsets), offsets):
+                if elements[0] == b'sync':
+                    index.add(sync_decoder(elements).timestamp, offset)
+
+        self.logger.info(' [-] Pre-pass: %s sync timestamps indexed' % len(index))
+        return index
+
+    def screenshot_name(self, name_prefix) -> str:
+        if self.ScreenCapturePrefix:
+            return '%s_%s_screen%s' % (self.ScreenCapturePrefix, name_prefix, self.writer.extension)
+        return '%s_screen%s' % (name_prefix, self.writer.extension)
+
+    def add_screenshot(self, image_name: str, image: Image.Image, name_prefix):
+        self.cache.get('screenshots', []).append({image_name: image, 'ScreenCapturePrefix': self.ScreenCapturePrefix, 'session_url': self.url.replace('behavioral1/logs/vnc.guac', ''), 'path': self.writer.path(image_name), 'frame_number': name_prefix})
+
+    def save_screenshot(self, base_image: Image.Image, name_prefix) -> Image.Image:
+        """ Hands the screenshot over to the writer (encoded and written by its workers) and stores it in the cache,
+        returns the screenshot
+
+        Remark: The image is stored as is, hence it must not be the (live) canvas, see GuacCompositor.screenshot()
+        """
         try:
-            with self.lock:
-                # self.logger.debug(' [-] Adding instruction -> inst.id: %s' % inst.id)
-                self.instructions.put(inst)
-        except Exception as e:
-            if self.debug_mode:
-                print(f"Error inserting element: {e}")
-            raise
+            image_name = self.screenshot_name(name_prefix)
+            self.writer.submit(base_image, image_name)
+            self.add_screenshot(image_name, base_image, name_prefix)
 
-    def rebuild_instructions(self, create_screenshots=True, trigger_screenshot_on_progress=None, replay_recording=None):
+        except Exception as msg:
+            self.logger.error(' [-] Unable to save the image. Exception: %s' % str(msg))
+
+        return base_image
+
+    def rebuild_instructions(self, create_screenshots=None, trigger_screenshot_on_progress=None, replay_recording=None):
         """
         # Reference: https://guacamole.apache.org/doc/gug/guacamole-protocol.html
         # Documentation:
@@ -538,9 +3291,13 @@ class GuacRecordingRebuilder:
          * by the "sync" instruction terminating the frame. Optionally, a frame may
          * also be associated with a snapshot of Guacamole client state, such that the
          * frame can be rendered without replaying all previous frames.
+
+        Remark: The frames (drawing instructions up to a sync) are replayed onto the display (GuacDisplay) as soon as
+        they are complete, and released right after, hence the memory usage is bounded by the display size (not by the
+        recording size). The frame numbers match the ones of the timestamp index. The progress triggers are resolved
+        according to TriggerResolution (known duration, tail of the recording, pre-pass over sync timestamps or bounded
+        canvas snapshots).
         """
-        default_layer_obj = default_layer()
-        frames = []
 
         if trigger_screenshot_on_progress is None: trigger_screenshot_on_progress = self.ScreenCaptureProgressTriggers
         if replay_recording is None: replay_recording = self.ReplayRecording
@@ -548,179 +3305,504 @@ class GuacRecordingRebuilder:
 
         self._is_running = True
         self.logger.info('[+] Start rebuilding instructions...')
-        g_frame = None
+        g_frame = guac_recording_frame()
+        streams = {}  # The open image streams
+
+        self.logger.info(' [-] Start processing frames (trigger resolution: %s)...' % self.TriggerResolution)
+        start_time, end_time, screen_capture_triggers, snapshots = None, None, None, None
 
-        # Stops when GuacStreamProcessingThread is complete (no more instructions in the stream), and queue is empty and the rebuilding stop event has been set
-        while self._is_running:
+        # The headless compositor, the viewer is attached only when the replay is requested
+        compositor = GuacCompositor(image_cache=self.image_cache, profiler=self.profiler)
+        if replay_recording:
             try:
-                inst_obj = self.instructions.get(block=False)
+                compositor.attach(GuacViewer())
+            except Exception as msg:
+                self.logger.error(' [-] Unable to open the viewer (continuing headless). Exception: %s' % str(msg))
+        if self.video is not None:
+            compositor.attach(self.video)
+        change_trigger = self.ScreenCaptureOnChange if create_screenshots else None
+        if change_trigger is not None:
+            change_trigger.reset()
+            compositor.attach(change_trigger)
+        last_screenshot = None
+
+        # The image streams are decoded ahead of the compositor, the frames are composited in order
+        decoder = GuacImageDecoder(max_workers=self.DecodeWorkers, image_cache=self.image_cache,
+                                   profiler=self.profiler) if self.DecodeWorkers else None
+        profiler = self.profiler
+
+        keyframes = GuacKeyframeIndex(interval=self.KeyframeInterval) if self.KeyframeInterval else None
+        self.keyframes = keyframes
+        # The keyframes are compressed off the rebuild thread
+        keyframe_compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='GuacKeyframeCompressor') \
+            if keyframes is not None else None
+
+        # The 'tail' resolution falls back to the pre-pass (or the snapshots) if the end of the recording is unknown
+        resolution = self.TriggerResolution
+        if resolution == 'tail' and self.tail_end_time is None:
+            resolution = 'prepass' if self.prepass_index is not None else 'snapshots'
+
+        triggers_enabled = isinstance(trigger_screenshot_on_progress, list) and len(trigger_screenshot_on_progress) > 0
+        if triggers_enabled:
+            if resolution == 'prepass':
+                screen_capture_triggers = self.create_screen_capture_triggers(self.prepass_index, trigger_screenshot_on_progress)
+            elif resolution == 'snapshots':
+                snapshots = ScreenCaptureSnapshots(budget=self.SnapshotBudget)
+        time_triggers = self.ScreenCaptureTimeTriggers if create_screenshots else None
+        interval = self.ScreenCaptureInterval if create_screenshots else None
+        next_interval = None
+
+        # The rebuild stops once the last trigger is satisfied, if nothing else needs the rest of the recording
+        early_termination = self.EarlyTermination and create_screenshots and snapshots is None \
+            and change_trigger is None and interval is None and self.video is None and not replay_recording
+        self.stopped_early = False
 
-                if self.debug_mode:
-                    self.logger.error(inst_obj)
+        name_prefix = -1
+        stop_capturing_screenshots = False
+        canvas_changed = True
+        next_trigger = 0
 
-                if g_frame is None: g_frame = guac_recording_frame(layer=default_layer_obj)
+        def composite_frame(frame: guac_recording_frame, streams_open: bool):
+            nonlocal name_prefix, stop_capturing_screenshots, screen_capture_triggers
+            nonlocal start_time, end_time, canvas_changed, next_trigger, last_screenshot, next_interval
 
-                if g_frame.is_complete():
-                    if inst_obj.opcode not in g_frame.elements:
-                        g_frame.build(inst_obj=inst_obj)
-                    else:
-                        self.logger.debug(g_frame)
-                        frames.append(g_frame)
+            name_prefix += 1
+            if compositor.draw(frame):
+                canvas_changed = True
 
-                        # Start fresh
-                        g_frame = guac_recording_frame(layer=default_layer_obj)
-                        g_frame.build(inst_obj=inst_obj)
-                else:
-                    g_frame.build(inst_obj=inst_obj)
+            # Recording replay |& screenshot creation
+            if frame.is_synced():
+                if start_time is None:
+                    start_time = frame.timestamp
+                    if interval is not None:
+                        next_interval = start_time + interval
+                    if triggers_enabled and resolution in ('duration', 'tail'):
+                        duration = self.RecordingDuration if resolution == 'duration' else self.tail_end_time - start_time
+                        screen_capture_triggers = self.create_duration_triggers(start_time, duration, trigger_screenshot_on_progress)
+                    if time_triggers:
+                        screen_capture_triggers = sorted((screen_capture_triggers or []) +
+                                                         self.create_time_triggers(start_time, time_triggers),
+                                                         key=attrgetter('time_s'))
+                end_time = frame.timestamp
+
+                compositor.present(frame.timestamp_ms)
+
+                if change_trigger is not None and change_trigger.take() and last_screenshot != name_prefix:
+                    last_screenshot = name_prefix
+                    self.save_screenshot(compositor.screenshot(), name_prefix)
+
+                if next_interval is not None and frame.timestamp >= next_interval:
+                    # The rolling screenshots, on the grid of the interval (the idle periods are skipped)
+                    next_interval += interval * ((frame.timestamp - next_interval) // interval + 1)
+                    if last_screenshot != name_prefix:
+                        last_screenshot = name_prefix
+                        self.save_screenshot(compositor.screenshot(), name_prefix)
+
+                # The keyframes are taken between the image streams only (the parsing resumes right after the sync)
+                if keyframes is not None and not streams_open and keyframes.is_due(frame.timestamp) \
+                        and name_prefix < len(self.index):
+                    keyframe = GuacKeyframe.capture(compositor.display, name_prefix, frame.timestamp,
+                                                    self.index.offsets[name_prefix], compress=False)
+                    keyframes.add(keyframe)
+                    keyframe_compressor.submit(keyframe.compress)
 
-                self.instructions.task_done()
+                if create_screenshots:
+                    if snapshots is not None:
+                        # The triggers get resolved once the duration is known (at the end of the recording)
+                        if snapshots.is_due(frame.timestamp):
+                            snapshots.add(frame.timestamp, name_prefix, compositor.base_image, changed=canvas_changed)
+                            canvas_changed = False
+
+                    if stop_capturing_screenshots or (snapshots is not None and screen_capture_triggers is None):
+                        # The time triggers (if any) are checked along with the snapshots
+                        pass
+                    else:
+                        dump_screenshot = False
+                        if screen_capture_triggers is not None:
+                            # The triggers are ordered by time, hence only the next one needs to be checked
+                            if next_trigger < len(screen_capture_triggers):
+                                if frame.timestamp >= screen_capture_triggers[next_trigger].time_s:
+                                    dump_screenshot = True
+                                    # The trigger was satisfied
+                                    next_trigger += 1
+
+                            if next_trigger >= len(screen_capture_triggers): stop_capturing_screenshots = True
+                        else:
+                            # Every frame, unless only the rolling or the change screenshots are requested
+                            dump_screenshot = interval is None and change_trigger is None
+
+                        if dump_screenshot and last_screenshot != name_prefix:
+                            last_screenshot = name_prefix
+                            self.save_screenshot(compositor.screenshot(), name_prefix)
+
+                        if stop_capturing_screenshots and early_termination:
+                            self.stopped_early = True
+
+        def composite_frames(ready: list):
+            for frame, streams_open in ready:
+                started = profiler.clock() if profiler is not None else None
+                try:
+                    composite_frame(frame, streams_open)
+                except Exception as msg:
+                    self.logger.error(' [-] Unable to composite the frame: %s. Exception: %s' % (frame, str(msg)))
+                if started is not None:
+                    profiler.add('composite', started)
+
+        def release_frame(frame: guac_recording_frame):
+            # The open image streams are recorded at the time of the sync (the decoder delays the compositing)
+            if decoder is None:
+                composite_frames([(frame, bool(streams))])
+            else:
+                composite_frames(decoder.put(frame, bool(streams)))
 
-            except Empty:
-                # When GuacStreamProcessingThread is complete (no more instructions in the stream), and the queue was processed / is empty
-                # - Assume the operation is complete, and the _stop_rebuild_event can be set, so the loop can exit
-                if self._stop_processing_event.is_set():
+        # Stops when GuacStreamProcessingThread is complete (no more instructions in the stream), and the queue is drained
+        try:
+            while self._is_running:
+                started = profiler.clock() if profiler is not None else None
+                try:
+                    # Blocks (with a timeout) while waiting on the stream
+                    batch = self.instructions.get()
+                except Empty:
+                    # The stream is idle (e.g. a live recording), the frames held by the decoder are composited
+                    if decoder is not None:
+                        composite_frames(decoder.drain())
+                    continue
+                finally:
+                    if started is not None:
+                        profiler.add('dequeue', started)
+                        profiler.sample(len(self.instructions))
+                        started = profiler.clock()
+
+                if batch is None:
                     self.logger.warning('Event (_stop_rebuild_event) -> No more instructions to process...')
                     self._stop_rebuild_event.set()
                     self._is_running = False
-                else:
-                    # logger.debug(' [-] Waiting for new instructions to process...')
-                    pass
+                    break
 
-            except Exception as e:
-                self.logger.error(f"Exception: Unexpected error in rebuild thread: {e}")
-                if len(self.instructions.queue) == 0:
-                    self._is_running = False
+                for inst_obj in batch:
+                    try:
+                        if self.debug_mode:
+                            self.logger.error(inst_obj)
 
-        def create_screenshot_trigger(total_duration, elapsed_seconds, time_s):
-            if elapsed_seconds == 0:
-                return ScreenCaptureTrigger(0, elapsed_seconds, total_duration, time_s)
+                        if g_frame.build(inst_obj=inst_obj, streams=streams):
+                            self.logger.debug(g_frame)
+                            release_frame(g_frame)
 
-            return ScreenCaptureTrigger(floor((elapsed_seconds / total_duration) * 100), elapsed_seconds,
-                                        total_duration, time_s)
+                            # Start fresh
+                            g_frame = guac_recording_frame()
 
-        self.logger.info(' [-] Start processing frames...')
-        canvas, root, start_time, end_time, duration, screen_capture_triggers = None, None, None, None, None, None
+                    except Exception as e:
+                        self.logger.error(f"Exception: Unexpected error in rebuild thread: {e}")
 
-        # Create a canvas to display images
-        root = tk.Tk()  # Create the main window
-        root.title("GUAC Stream Player")
-        canvas = tk.Canvas(root, width=default_layer_obj.DEFAULT_LAYER_WIDTH,
-                               height=default_layer_obj.DEFAULT_LAYER_HEIGHT)
-        canvas.pack()
-        canvas.delete("all")
-        root.state("zoomed")  # Maximize the window
-
-        # Get timestamps from all frames that have it
-        frames_timestamps = [f.timestamp for f in frames if f.timestamp is not None]
-
-        # Create a list of screen capture triggers corresponding to percentage of progress indicated in trigger_screenshot_on_progress
-        if len(frames_timestamps) > 2:
-            start_time = frames_timestamps[0]  # First frame
-            end_time = frames_timestamps[-1]  # Last frame
-            duration = end_time - start_time  # Duration (in seconds)
-
-            self.logger.info(' [-] The recording duration: %s seconds' % duration)
-            if isinstance(trigger_screenshot_on_progress, list):
-                self.logger.info(' [-] Processing on-progress triggers...')
-                if len(trigger_screenshot_on_progress) > 0:
-                    screen_capture_triggers = []
-                    # triggers = []
-                    for ft in frames_timestamps:
-                        screen_capture_triggers.append(
-                            create_screenshot_trigger(duration, duration - (end_time - ft), ft))
-
-                    # Not effective, must be a better way, but i am tired
-                    new = []
-                    screen_capture_triggers = ulist(screen_capture_triggers)
-                    processed_triggers = []
-                    end_processing_triggers = False
-                    for _progress_percentage in trigger_screenshot_on_progress:
-                        if end_processing_triggers: break
-                        for _cur_progress in screen_capture_triggers:
-                            if _progress_percentage not in processed_triggers:
-                                if _cur_progress.on_percent_of_progress >= _progress_percentage:
-                                    new.append(_cur_progress)
-                                    processed_triggers.append(_progress_percentage)
-                                    if len(processed_triggers) == len(trigger_screenshot_on_progress):
-                                        end_processing_triggers = True
-                                        break
-
-                    # Keep only those triggers that are as close as possible to user indicated trigger on progress percentage
-                    screen_capture_triggers = new
+                    if self.stopped_early:
+                        break
 
-        name_prefix = -1
-        base_image = None
-        create_new_base = True
-        stop_capturing_screenshots = False
-        for frame in frames:
-            name_prefix += 1
-            if create_new_base:
-                base_image = Image.new('RGBA', (frame.width, frame.height))
-                canvas.config(width=frame.width, height=frame.height)
-                create_new_base = False
+                if started is not None:
+                    # The compositing (timed within) is deducted
+                    profiler.add('build', started, len(batch))
 
-            # Resize the base image (if necessary)
-            base_image_width, base_image_height = base_image.size
-            if frame.width != base_image_width or frame.height != base_image_height:
-                base_image = base_image.resize((frame.width, frame.height))
-                canvas.config(width=frame.width, height=frame.height)
+                if self.stopped_early:
+                    self.logger.info(' [-] All the screen captures are taken, stopping early...')
+                    self._stop_rebuild_event.set()
+                    self._is_running = False
+                    break
+        finally:
+            # Unblocks the stream thread, if the rebuild stops early
+            self.instructions.cancel()
+            if self.stopped_early:
+                # Stops the reading in progress (e.g. the download)
+                source = self._active_source
+                if source is not None:
+                    source.close()
+
+        self.logger.info(' [-] Instructions queue: %s' % self.instructions.stats())
+
+        # The trailing operations (not synced), drawn onto the final canvas
+        if g_frame.operations and not self.stopped_early:
+            release_frame(g_frame)
+        if decoder is not None:
+            if not self.stopped_early:
+                composite_frames(decoder.drain())
+            decoder.close()
+            self.logger.info(' [-] Image decoder: %s' % decoder.stats())
+
+        # Resolve the progress triggers against the retained snapshots (the duration is known now)
+        if snapshots is not None and start_time is not None:
+            self.logger.info(' [-] The recording duration: %s seconds' % (end_time - start_time))
+            for _progress_percentage, snapshot in snapshots.resolve(trigger_screenshot_on_progress, end_time):
+                if snapshot is None:
+                    # Not covered by any snapshot (the very end of the recording), the final canvas is used instead
+                    self.save_screenshot(compositor.screenshot(), name_prefix)
+                else:
+                    self.save_screenshot(snapshot.image(), snapshot.frame_number)
+
+        self.display_size = compositor.size
+        if self.image_cache is not None:
+            self.logger.info(' [-] Decode cache: %s' % self.image_cache.stats())
+        if keyframes is not None:
+            keyframe_compressor.shutdown(wait=True)
+            self.logger.info(' [-] %s keyframes (%s bytes)' % (len(keyframes), keyframes.size()))
+        try:
+            compositor.close()
+        except Exception as msg:
+            self.logger.error(' [-] Unable to close the compositor sinks. Exception: %s' % str(msg))
+        if self.video is not None and self.video.error is not None and self.stream_error is None:
+            # The video export failed, so did the run
+            self.stream_error = self.video.error
 
-            # Insert frame/image into x, y position
-            base_image.paste(frame.img(), (frame.x, frame.y))
+        # End
+        self.stop()
 
-            # Recording replay |& screenshot creation
-            if frame.is_synced() and frame.is_complete():
-                if replay_recording:
-                    photo = ImageTk.PhotoImage(base_image)
-                    canvas.create_image(0, 0, anchor=tk.NW, image=photo)
-                    canvas.image = photo  # Keep a reference to prevent garbage collection
-                    canvas.update()
+    def artifact_key(self) -> str:
+        """ The cache key of the screenshots, the parameters they depend on """
+        return GuacDiskCache.artifact_key(**self.artifact_params())
+
+    def artifact_params(self) -> dict:
+        return {
+            'triggers': sorted(set(self.ScreenCaptureProgressTriggers or [])),
+            'resolution': self.TriggerResolution,
+            'duration': self.RecordingDuration if self.TriggerResolution == 'duration' else None,
+            'time_triggers': self.ScreenCaptureTimeTriggers,
+            'budget': self.SnapshotBudget if self.TriggerResolution == 'snapshots' else None,
+            'format': self.writer.format,
+            'save_options': self.writer.save_options,
+            'on_change': self.ScreenCaptureOnChange.params() if self.ScreenCaptureOnChange is not None else None,
+            'interval': self.ScreenCaptureInterval,
+        }
 
-                if create_screenshots:
-                    dump_screenshot = False
-                    if not stop_capturing_screenshots:
-                        if screen_capture_triggers is not None:
-                            if len(screen_capture_triggers) > 0:
-                                for _trigger in screen_capture_triggers:
-                                    if frame.timestamp >= _trigger.time_s:
-                                        dump_screenshot = True
-                                        try:
-                                            # Remove a trigger from the list, since it was satisfied
-                                            screen_capture_triggers = screen_capture_triggers[1:]
-                                        except Exception:
-                                            # Just in case set it to empty list on error
-                                            screen_capture_triggers = []
-
-                                        if len(screen_capture_triggers) == 0: stop_capturing_screenshots = True
-                                        break
-                        else:
-                            dump_screenshot = True
+    def restore_from_cache(self) -> bool:
+        """ Restores the screenshots and the timestamp index of a previous run over the same recording (and triggers)
+        from the cache, without parsing the stream. Returns False if they are not cached """
+        if self.Cache is None or self.content_hash is None or self.ReplayRecording or self.video is not None:
+            return False
 
-                        if dump_screenshot:
-                            try:
-                                if self.ScreenCapturePrefix:
-                                    image_name = '%s_%s_screen.jpg' % (self.ScreenCapturePrefix, name_prefix)
-                                else:
-                                    image_name = '%s_screen.jpg' % name_prefix
+        metadata = self.Cache.load_metadata(self.content_hash)
+        screenshots = self.Cache.load_screenshots(self.content_hash, self.artifact_key()) if self.CreateScreenshots else []
+        if metadata is None or screenshots is None:
+            return False
 
-                                base_image = base_image.convert("RGB")
-                                base_image.save('screenshots/%s' % image_name)
-                                self.cache.get('screenshots', []).append({image_name: base_image, 'ScreenCapturePrefix': self.ScreenCapturePrefix, 'session_url': self.url.replace('behavioral1/logs/vnc.guac', '')})
+        index = self.Cache.load_index(self.content_hash)
+        if index is not None:
+            self.index = index
+        self.metadata = metadata
+        self.display_size = (metadata.get('width'), metadata.get('height'))
 
-                            except Exception as msg:
-                                self.logger.error(' [-] Unable to save the image. Exception: %s' % str(msg))
+        for frame_number, path in screenshots:
+            image_name = self.screenshot_name(frame_number)
+            try:
+                with open(path, 'rb') as file_obj:
+                    self.writer.write(image_name, file_obj.read())
+                image = Image.open(path)
+                image.load()  # Closes the file
+                self.add_screenshot(image_name, image, frame_number)
+            except Exception as msg:
+                self.logger.error(' [-] Unable to restore the cached image: %s. Exception: %s' % (path, str(msg)))
+        return True
 
-                create_new_base = False
-                if replay_recording: time.sleep(0.02)
+    def store_in_cache(self, source: GuacRecordingSource):
+        """ Stores the artifacts derived from the recording (the stream was read completely) """
+        content_hash = self.content_hash or getattr(source, 'content_hash', None)
+        if self.Cache is None or content_hash is None or not self.stream_complete or self.stream_error is not None:
+            return
 
-        # End
-        self.stop()
+        width, height = self.display_size or (None, None)
+        self.metadata = {
+            'frames': len(self.index),
+            'instructions': self.instructions.instructions,
+            'start_time': self.index.start_time,
+            'end_time': self.index.end_time,
+            'duration': self.index.duration,
+            'width': width,
+            'height': height,
+        }
+        try:
+            self.Cache.store_index(content_hash, self.index)
+            self.Cache.store_metadata(content_hash, self.metadata)
+            if self.keyframes is not None:
+                self.Cache.store_keyframes(content_hash, self.keyframes)
+        except Exception as msg:
+            self.logger.error(' [-] Unable to store the artifacts in the cache: %s. Exception: %s' % (self.Cache, str(msg)))
+        self.store_screenshots_in_cache(content_hash)
+
+    def store_screenshots_in_cache(self, content_hash: str):
+        if not self.CreateScreenshots:
+            return
+        if self.writer.directory is None:
+            self.logger.info(' [-] The screenshots are passed to a sink, they are not cached')
+            return
+        self.writer.flush()
+        try:
+            self.Cache.store_screenshots(content_hash, self.artifact_key(),
+                                         [(entry['frame_number'], entry['path']) for entry in self.cache['screenshots']],
+                                         params=self.artifact_params())
+        except Exception as msg:
+            self.logger.error(' [-] Unable to store the screenshots in the cache: %s. Exception: %s' % (self.Cache, str(msg)))
+
+    def iter_frames(self, source=None, offset: int = 0):
+        """ Parses the source from given offset (0 or right after a sync) and yields the frames, in the calling thread """
+        source = self.open_source(source)
+        tokenizer = guac_instruction_tokenizer()
+        decoders = Instruction_Decoders
+        frame, streams = guac_recording_frame(), {}
+        for chunk in source.chunks(offset):
+            for elements in tokenizer.feed(chunk):
+                decoder = decoders.get(elements[0])
+                if decoder is None:
+                    continue
+                try:
+                    synced = frame.build(decoder(elements), streams)
+                except Exception as msg:
+                    self.logger.error(' [-] Unable to decode the instruction: %s. Exception: %s' % (elements[0], str(msg)))
+                    continue
+                if synced:
+                    yield frame
+                    frame = guac_recording_frame()
+        if frame.operations:
+            yield frame
+
+    def resolve_frames(self, trigger_screenshot_on_progress: list, index: GuacTimestampIndex = None) -> list:
+        """ Maps the progress percentages to the frame numbers, by binary search over the timestamp index """
+        index = index if index is not None else self.index
+        if not len(index):
+            return []
+
+        frame_numbers = []
+        for _progress_percentage in sorted(trigger_screenshot_on_progress):
+            if self.TriggerResolution == 'duration':
+                time_s = index.start_time + self.RecordingDuration * _progress_percentage / 100
+            else:
+                time_s = index.time_at_progress(_progress_percentage)
+            frame_number = index.frame_at_time(time_s)
+            frame_numbers.append(len(index) - 1 if frame_number is None else frame_number)
+        return frame_numbers
+
+    def render_frames(self, frame_numbers: list, source=None) -> list:
+        """ Renders the frames (random access), returns the list of (frame number, RGB image) ordered by frame
+
+        Each frame is replayed from the nearest keyframe at/before it (from the start of the recording without any),
+        the consecutive requested frames continue from the previous one. The source must be seekable to resume from
+        the keyframes (local path, bytes or the cached raw stream), a URL is requested from the keyframe's offset.
+        """
+        keyframes = self.keyframes if self.keyframes is not None else GuacKeyframeIndex()
+        rendered = []
+        compositor, frames, position = None, None, None
+        try:
+            for frame_number in sorted(set(frame_numbers)):
+                keyframe = keyframes.before(frame_number)
+                start = keyframe.frame_number if keyframe is not None else -1
+                if compositor is None or not start <= position <= frame_number:
+                    if frames is not None:
+                        frames.close()
+                    compositor = GuacCompositor(image_cache=self.image_cache, profiler=self.profiler)
+                    if keyframe is not None:
+                        keyframe.restore(compositor.display)
+                    frames = self.iter_frames(source, keyframe.offset if keyframe is not None else 0)
+                    position = start
+
+                while position < frame_number:
+                    frame = next(frames, None)
+                    if frame is None:
+                        break
+                    compositor.draw(frame)
+                    if frame.is_synced():
+                        position += 1
+                rendered.append((frame_number, compositor.screenshot()))
+        finally:
+            if frames is not None:
+                frames.close()
+        return rendered
+
+    def render_from_cache(self, source: GuacRecordingSource) -> bool:
+        """ Renders the screenshots from the cached keyframes and timestamp index (new triggers over a recording already
+        processed), only the frames following the nearest keyframes are replayed. Returns False if they are not cached """
+        if self.Cache is None or self.content_hash is None or self.ReplayRecording or not self.CreateScreenshots \
+                or self.video is not None or self.ScreenCaptureOnChange is not None \
+                or self.ScreenCaptureInterval is not None:
+            return False
+        if not isinstance(source, (GuacFileSource, GuacBytesSource)):
+            return False
+
+        metadata = self.Cache.load_metadata(self.content_hash)
+        index = self.Cache.load_index(self.content_hash)
+        keyframes = self.Cache.load_keyframes(self.content_hash)
+        if metadata is None or index is None or keyframes is None:
+            return False
+
+        self.index, self.metadata, self.keyframes = index, metadata, keyframes
+        self.display_size = (metadata.get('width'), metadata.get('height'))
+        frame_numbers = self.resolve_frames(self.ScreenCaptureProgressTriggers or [])
+        for elapsed_seconds in self.ScreenCaptureTimeTriggers or []:
+            # The time triggers beyond the end of the recording are not satisfied
+            frame_number = index.frame_at_time(index.start_time + elapsed_seconds) if len(index) else None
+            if frame_number is not None:
+                frame_numbers.append(frame_number)
+        for frame_number, image in self.render_frames(frame_numbers, source):
+            self.save_screenshot(image, frame_number)
+        self.store_screenshots_in_cache(self.content_hash)
+        return True
 
     def start(self):
         if self._is_running:
             raise RuntimeError("Rebuilding thread is already running")
+        if self.profiler is not None:
+            self.profiler.reset()
+            self.writer.profiler = self.profiler
+        try:
+            return self._start()
+        finally:
+            # The screenshots are all written once start() returns
+            if self._owns_writer:
+                self.writer.close()
+            else:
+                self.writer.flush()
+
+            if self.profiler is not None:
+                self.writer.profiler = None
+                self.profiler.finish()
+                try:
+                    self.profiler.emit()
+                except Exception as msg:
+                    self.logger.error(' [-] Unable to emit the profile. Exception: %s' % str(msg))
+
+    def _start(self):
         self._stop_rebuild_event.clear()
         self._stop_processing_event.clear()
+        self.instructions = GuacInstructionChannel(maxsize=self.QueueSize)
+
+        source = self.source
+        if self.Cache is not None and source is not None:
+            self.content_hash = self.Cache.content_hash(source)
+            if self.restore_from_cache():
+                self.cache_status = 'hit'
+                self.logger.info('[+] Restored from the cache: %s (%s)' % (self.url, self.content_hash))
+                return self.cache
+
+            if isinstance(source, GuacURLSource):
+                # Read from the stored raw stream if still valid, teed into the cache otherwise
+                stored = self.Cache.object_path(self.content_hash) if self.content_hash is not None else None
+                source = GuacFileSource(stored, read_size=self.ReadSize) if stored else GuacCachingSource(source, self.Cache)
+
+            if self.render_from_cache(source):
+                self.cache_status = 'keyframes'
+                self.logger.info('[+] Rendered from the cached keyframes: %s (%s)' % (self.url, self.content_hash))
+                return self.cache
+            self.cache_status = 'miss'
+
+        prepass = self.TriggerResolution == 'prepass'
+        self.prepass_index, self.tail_end_time = None, None
+        if self.TriggerResolution == 'tail' and self.CreateScreenshots:
+            self.tail_end_time = self.scan_tail(source)
+            if self.tail_end_time is None:
+                # A URL would be downloaded twice (its server ignores the ranges), unless it is served from the cache
+                prepass = source.rereadable() and not isinstance(source, GuacURLSource)
+                self.logger.warning(' [-] The end of the recording is unknown (tail not readable), using %s...' % (
+                    'a pre-pass' if prepass else 'the snapshots (approximate)'))
+
+        if prepass and self.CreateScreenshots:
+            if self.Cache is not None and self.content_hash is not None:
+                self.prepass_index = self.Cache.load_index(self.content_hash)
+            if self.prepass_index is None:
+                self.prepass_index = self.scan_timestamp_index(source)
 
         self.rebuild_thread = threading.Thread(
             target=self.rebuild_instructions,
@@ -729,6 +3811,7 @@ class GuacRecordingRebuilder:
 
         self.stream_processing_thread = threading.Thread(
             target=self.parse_stream_instructions,
+            args=(source,),
             name="GuacStreamProcessingThread"
         )
 
@@ -741,6 +3824,11 @@ class GuacRecordingRebuilder:
         # Make sure it exits after the rebuilt only
         self.rebuild_thread.join()
 
+        if self.Cache is not None or self.stopped_early:
+            self.stream_processing_thread.join()
+        if self.Cache is not None:
+            self.store_in_cache(source)
+
         return self.cache
 
     def stop(self):
@@ -758,45 +3846,7 @@ class GuacRecordingRebuilder:
 
 """ Helper Classes """
 class ImageCollage(object):
-    def __init__(self, images, logger=None):
-        self.logger = logging
-        self.images = images
-
-    def create_self_contained_image_collage_html(self, images=None, output_file: str = "collage.html", thumbnails_size: tuple = (200, 200)) -> str:
-        """
-        Creates a self-contained HTML file with an image collage from a list of PIL images.
-
-        Remark: Genrated with copilot (I've made few modifications)... Rememeber it's non producion/PoC code
-        """
-        self.logger.info('[+] Creating a self-contained HTML image collage...')
-        if images is None: images = self.images
-
-        def create_sharp_thumbnail(img: Image.Image, size: tuple) -> Image.Image:
-            """
-            Creates a sharp thumbnail while maintaining aspect ratio
-            """
-            # Convert to RGB if image is in RGBA mode
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-
-            # Calculate aspect ratio
-            aspect = img.width / img.height
-
-            if aspect > 1:
-                # Width is greater than height
-                new_width = size[0]
-                new_height = int(size[0] / aspect)
-            else:
-                # Height is greater than width
-                new_height = size[1]
-                new_width = int(size[1] * aspect)
-
-            # Resize with high-quality settings
-            return img.resize((new_width, new_height),
-                              resample=Image.Resampling.LANCZOS,
-                              reducing_gap=3.0)
-
-        css = """
+    CSS = """
         <style>
             body {
                 font-family: Arial, sans-serif;
@@ -901,115 +3951,329 @@ class ImageCollage(object):
         </style>
         """
 
-        javascript = """
+    PAGE_CSS = """
+        <style>
+            .pages {
+                display: flex;
+                flex-wrap: wrap;
+                gap: 6px;
+                padding: 0 20px;
+            }
+            .pages a, .pages span {
+                padding: 4px 8px;
+                border-radius: 4px;
+                background: white;
+                color: #007bff;
+                text-decoration: none;
+                font-size: 12px;
+            }
+            .pages span {
+                background: #007bff;
+                color: white;
+            }
+        </style>
+        """
+
+    JAVASCRIPT = """
         <script>
-            function showModal(imgData) {
-                const modal = document.getElementById('imageModal');
-                const modalImg = document.getElementById('modalImage');
-                modal.style.display = "block";
-                modalImg.src = imgData;
+            // The full images are either files (URL) or embedded once (base64 within a script element, by id)
+            function imageSource(ref) {
+                const data = document.getElementById(ref);
+                return data ? 'data:' + data.dataset.type + ';base64,' + data.textContent.trim() : ref;
+            }
+
+            function showModal(ref) {
+                document.getElementById('imageModal').style.display = "block";
+                document.getElementById('modalImage').src = imageSource(ref);
             }
-    
+
             function closeModal() {
                 document.getElementById('imageModal').style.display = "none";
+                document.getElementById('modalImage').removeAttribute('src');
             }
+
             function OpenPage(url) {
-                window.open(url, '_blank');;
+                window.open(url, '_blank');
             }
-            
-            
-            
-            function downloadImage(imgData, index, name_prefix) {
+
+            function downloadImage(ref, name) {
                 const link = document.createElement('a');
-                link.href = imgData;
-                // link.download = `image_${index}.png`;
-                link.download = `image_${name_prefix}_${index}.png`;
+                link.href = imageSource(ref);
+                link.download = name;
                 document.body.appendChild(link);
                 link.click();
                 document.body.removeChild(link);
             }
-    
+
             window.onclick = function(event) {
-                const modal = document.getElementById('imageModal');
-                if (event.target == modal) {
-                    modal.style.display = "none";
+                if (event.target == document.getElementById('imageModal')) {
+                    closeModal();
                 }
             }
         </script>
         """
 
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Image Collage (by wit0k)</title>
-            {css}
-        </head>
-        <body>
-            <div class="collage">
+    MIME_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp'}
+
+    def __init__(self, images, logger=None):
+        self.logger = logging
+        self.images = images
+
+    @staticmethod
+    def create_sharp_thumbnail(img: Image.Image, size: tuple) -> Image.Image:
+        """
+        Creates a sharp thumbnail while maintaining aspect ratio
         """
+        # Convert to RGB if image is in RGBA mode
+        if img.mode == 'RGBA':
+            img = img.convert('RGB')
 
-        idx = 0
-        for img_dict in images:
-            idx += 1
-            # idx = list(img_dict.keys())[0]
-            img = list(img_dict.values())[0]
-            ScreenCapturePrefix = list(img_dict.values())[1]
-            session_url = list(img_dict.values())[2]
+        # Calculate aspect ratio
+        aspect = img.width / img.height
 
-            # Create sharp thumbnail
-            thumb = create_sharp_thumbnail(img, thumbnails_size)
+        if aspect > 1:
+            # Width is greater than height
+            new_width = size[0]
+            new_height = int(size[0] / aspect)
+        else:
+            # Height is greater than width
+            new_height = size[1]
+            new_width = int(size[1] * aspect)
+
+        # Resize with high-quality settings
+        return img.resize((new_width, new_height),
+                          resample=Image.Resampling.LANCZOS,
+                          reducing_gap=3.0)
 
-            # Get image dimensions
-            original_size = f"{img.width}x{img.height}"
-            thumb_size = f"{thumb.width}x{thumb.height}"
+    def create_self_contained_image_collage_html(self, images=None, output_file: str = "collage.html", thumbnails_size: tuple = (200, 200)) -> str:
+        """
+        Creates a self-contained HTML file with an image collage from a list of PIL images.
 
-            # Convert both original and thumbnail to base64
+        Remark: A single page with the full images embedded, see create_image_collage_html(embed=True)
+        """
+        self.logger.info('[+] Creating a self-contained HTML image collage...')
+        return self.create_image_collage_html(images, output_file=output_file, thumbnails_size=thumbnails_size, embed=True)
+
+    @staticmethod
+    def screenshot_fields(entry: dict) -> tuple:
+        """ Returns (name, image, ScreenCapturePrefix, session_url, path) of a screenshot entry (see add_screenshot),
+        the image may be missing if the path is given """
+        name, image = None, None
+        for key, value in entry.items():
+            if isinstance(value, Image.Image):
+                name, image = key, value
+                break
+        path = entry.get('path')
+        if name is None and path is not None:
+            name = os.path.basename(path)
+        return name, image, entry.get('ScreenCapturePrefix'), entry.get('session_url'), path
+
+    def render_card(self, idx: int, entry: dict, files_dir: str, base_dir: str, embed: bool, thumbnails_size: tuple,
+                    image_format: str) -> dict:
+        """ Creates the thumbnail of a screenshot and its full image (written once, or read to be embedded), executed
+        by the workers of create_image_collage_html """
+        name, image, prefix, session_url, path = self.screenshot_fields(entry)
+        card = {'idx': idx, 'name': name, 'prefix': prefix, 'session_url': session_url}
+
+        full, extension = None, None
+        if path is not None and os.path.isfile(path):
+            # The screenshot file is referenced (or embedded) as is, not encoded again
+            extension = os.path.splitext(path)[1].lower()
+            if embed:
+                with open(path, 'rb') as file_obj:
+                    full = file_obj.read()
+            else:
+                card['full'] = os.path.relpath(path, base_dir).replace(os.sep, '/')
+            source = Image.open(path)
+            card['size'] = source.size
+            # JPEG only: Decoded at a reduced scale (still larger than the thumbnail)
+            source.draft('RGB', (thumbnails_size[0] * 2, thumbnails_size[1] * 2))
+        elif image is not None:
+            source = image
+            card['size'] = image.size
+            # The format of the decoded screenshot by default (e.g. JPEG from the writer), not inflated to PNG
+            image_format = image_format or {'JPEG': 'jpeg', 'WEBP': 'webp'}.get(image.format, 'png')
+            extension = {'jpeg': '.jpg'}.get(image_format, '.' + image_format)
             buffered = BytesIO()
-            img.save(buffered, format="PNG", quality=100)
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            if image_format == 'png':
+                # Lossless, the compression level matters little for the screenshots but costs a lot of time
+                image.save(buffered, format='PNG', compress_level=1)
+            else:
+                image.convert('RGB').save(buffered, format=image_format.upper(), quality=90)
+            full = buffered.getvalue()
+        else:
+            raise ValueError('The screenshot has no image nor file: %s' % name)
 
-            thumb_buffered = BytesIO()
-            thumb.save(thumb_buffered, format="PNG", quality=100)
-            thumb_str = base64.b64encode(thumb_buffered.getvalue()).decode()
+        thumb = self.create_sharp_thumbnail(source.convert('RGB'), thumbnails_size)
+        thumb_buffered = BytesIO()
+        thumb.save(thumb_buffered, format='JPEG', quality=85)
+        card['thumb_size'] = thumb.size
+
+        if embed:
+            card['thumb'] = 'data:image/jpeg;base64,' + base64.b64encode(thumb_buffered.getvalue()).decode()
+            card['data'] = (self.MIME_TYPES.get(extension, 'image/png'), base64.b64encode(full).decode())
+            card['full'] = 'image-%d' % idx
+        else:
+            thumb_path = os.path.join(files_dir, 'thumbs', '%d.jpg' % idx)
+            with open(thumb_path, 'wb') as file_obj:
+                file_obj.write(thumb_buffered.getvalue())
+            card['thumb'] = os.path.relpath(thumb_path, base_dir).replace(os.sep, '/')
+            if full is not None:
+                full_path = os.path.join(files_dir, '%d%s' % (idx, extension))
+                with open(full_path, 'wb') as file_obj:
+                    file_obj.write(full)
+                card['full'] = os.path.relpath(full_path, base_dir).replace(os.sep, '/')
+        card['download'] = '%s_%s%s' % (prefix, idx, extension)
+        return card
+
+    @classmethod
+    def error_card_html(cls, idx: int, entry, error: Exception) -> str:
+        """ The placeholder card of a screenshot which could not be rendered """
+        escape = html.escape
+        name = cls.screenshot_fields(entry)[0] if isinstance(entry, dict) else None
+        return f"""
+                <div class="image-card">
+                    <div class="thumbnail-container">
+                        <div class="image-info">Screenshot {idx} is not available</div>
+                    </div>
+                    <div class="image-info">{escape(str(name))} ({escape(str(error))})</div>
+                </div>
+            """
 
-            html_content += f"""
+    @staticmethod
+    def card_html(card: dict) -> str:
+        escape = html.escape
+        data = ''
+        if 'data' in card:
+            data = '<script type="text/plain" id="%s" data-type="%s">%s</script>' % (card['full'], card['data'][0],
+                                                                                   card['data'][1])
+        return f"""
                 <div class="image-card">
                     <div class="thumbnail-container">
-                        <img src="data:image/png;base64,{thumb_str}" 
-                             class="thumbnail"
-                             onclick="showModal('data:image/png;base64,{img_str}')"
-                             alt="Image {idx}">
+                        <img src="{escape(card['thumb'])}" width="{card['thumb_size'][0]}" height="{card['thumb_size'][1]}"
+                             class="thumbnail" loading="lazy" decoding="async"
+                             data-full="{escape(card['full'])}" onclick="showModal(this.dataset.full)"
+                             alt="{escape(str(card['name']))}">
                     </div>
+                    <div class="image-info">{escape(str(card['name']))} ({card['size'][0]}x{card['size'][1]})</div>
                     <div class="buttons">
-                        <button class="btn" onclick="OpenPage('{session_url}')">
+                        <button class="btn" data-url="{escape(str(card['session_url']))}" onclick="OpenPage(this.dataset.url)">
                             Session
                         </button>
-                        <button class="btn" onclick="downloadImage('data:image/png;base64,{img_str}', {idx}, '{ScreenCapturePrefix}')">
+                        <button class="btn" data-full="{escape(card['full'])}" data-name="{escape(card['download'])}"
+                                onclick="downloadImage(this.dataset.full, this.dataset.name)">
                             Download
                         </button>
                     </div>
+                    {data}
                 </div>
             """
 
-        html_content += f"""
+    def create_image_collage_html(self, images=None, output_file: str = "collage.html", thumbnails_size: tuple = (200, 200),
+                                  embed: bool = False, page_size: int = None, max_workers: int = None,
+                                  image_format: str = None) -> str:
+        """
+        Creates an HTML image collage which scales to hundreds of screenshots, returns the path of the (first) page
+
+        - The thumbnails (and the full images to encode) are created in parallel by a thread pool, the cards are
+        written to the page as they come (in order), hence neither the page nor the images are held in memory.
+        - The full images are written once as files (<output>_files/), the screenshots already dumped (path) are
+        referenced as is. With embed, they are embedded once in the page instead (base64, referenced by id) and
+        decoded on demand only.
+        - The thumbnails are lazily loaded, and the collage is split in pages of page_size screenshots, if given.
+
+        :param image_format: The format of the full images to encode ('png', 'jpeg' or 'webp'), if not dumped already,
+        the one of the (decoded) images by default, PNG otherwise
+        """
+        if images is None: images = self.images
+        if not isinstance(images, (list, tuple)): images = list(images)
+        self.logger.info('[+] Creating an HTML image collage (%s screenshots)...' % len(images))
+
+        base_dir = os.path.dirname(os.path.abspath(output_file))
+        stem, extension = os.path.splitext(output_file)
+        files_dir = stem + '_files'
+        if not embed:
+            os.makedirs(os.path.join(files_dir, 'thumbs'), exist_ok=True)
+
+        page_size = page_size or max(len(images), 1)
+        pages = max(-(-len(images) // page_size), 1)
+        page_names = [output_file] + ['%s_%d%s' % (stem, page, extension) for page in range(2, pages + 1)]
+
+        def navigation(page: int) -> str:
+            if pages == 1:
+                return ''
+            links = [f'<span>{number}</span>' if number == page else
+                     f'<a href="{html.escape(os.path.basename(page_names[number - 1]))}">{number}</a>'
+                     for number in range(1, pages + 1)]
+            return '<div class="pages">%s</div>' % ''.join(links)
+
+        def open_page(page: int):
+            page_file = open(page_names[page - 1], 'w', encoding='utf-8')
+            page_file.write(f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <title>Image Collage (by wit0k){' - %d/%d' % (page, pages) if pages > 1 else ''}</title>
+            {self.CSS}
+            {self.PAGE_CSS}
+        </head>
+        <body>
+            {navigation(page)}
+            <div class="collage">
+        """)
+            return page_file
+
+        def close_page(page_file, page: int):
+            page_file.write(f"""
             </div>
-    
+            {navigation(page)}
+
             <!-- Modal -->
             <div id="imageModal" class="modal">
                 <span class="close" onclick="closeModal()">&times;</span>
                 <img id="modalImage" class="modal-content">
             </div>
-    
-            {javascript}
+
+            {self.JAVASCRIPT}
         </body>
         </html>
-        """
+        """)
+            page_file.close()
+
+        max_workers = max_workers or min(8, os.cpu_count() or 1)
+        page, page_file, written = 1, open_page(1), 0
+
+        def write_card(idx: int, entry: dict, future: Future):
+            nonlocal page, page_file, written
+            try:
+                card_html = self.card_html(future.result())
+            except Exception as msg:
+                # A placeholder card, hence the pages (and their navigation) match the screenshots
+                self.logger.error(' [-] Unable to add the screenshot to the collage. Exception: %s' % str(msg))
+                card_html = self.error_card_html(idx, entry, msg)
+            if written == page_size:
+                close_page(page_file, page)
+                page, written = page + 1, 0
+                page_file = open_page(page)
+            page_file.write(card_html)
+            written += 1
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        try:
+            # The cards are written in order, the pending ones are bounded (the embedded images are held until written)
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ImageCollage') as executor:
+                pending = deque()
+                for idx, entry in enumerate(images, 1):
+                    pending.append((idx, entry, executor.submit(self.render_card, idx, entry, files_dir, base_dir,
+                                                                embed, thumbnails_size, image_format)))
+                    if len(pending) > 2 * max_workers:
+                        write_card(*pending.popleft())
+                while pending:
+                    write_card(*pending.popleft())
+        finally:
+            close_page(page_file, page)
 
+        self.logger.info(' [-] The collage was written: %s (%s pages)' % (output_file, page))
         return output_file
 
 @dataclass
@@ -1081,8 +4345,778 @@ class ThreadManager:
         """Get only failed executions"""
         return [r for r in self.results if r.error is not None]
 
+@dataclass
+class RecordingResult(ThreadResult):
+    """ The (picklable) result of a recording rebuilt by a BatchManager worker
+
+    The result is the rebuilder's cache, where the screenshots are given as encoded bytes ('data') or file paths
+    ('path') instead of PIL images.
+    """
+    name: str = None    # The recording (URL, path...)
+    stats: dict = None  # The instructions queue, decode cache (and profile) statistics
+
+def rebuild_recording(params: dict, screenshot_output: str = 'bytes') -> RecordingResult:
+    """ Rebuilds the recording (GuacRecordingRebuilder parameters), executed by the BatchManager workers
+
+    :param screenshot_output: 'bytes' (the encoded image) or 'path' (the dumped screenshot file)
+    """
+    recording_result = RecordingResult(result=None, name=str(params.get('StreamURL')))
+    recording_result.start_time = datetime.fromtimestamp(datetime.now().timestamp(), UTC)
+
+    try:
+        rebuilder = GuacRecordingRebuilder(**params)
+        cache = rebuilder.start()
+        recording_result.stats = dict(rebuilder.instructions.stats(), cache=rebuilder.cache_status,
+                                      stopped_early=rebuilder.stopped_early, bytes_read=rebuilder.bytes_read)
+        if rebuilder.image_cache is not None:
+            recording_result.stats['decode_cache'] = rebuilder.image_cache.stats()
+        if rebuilder.profiler is not None:
+            recording_result.stats['profile'] = rebuilder.profiler.stats()
+        recording_result.error = rebuilder.stream_error
+
+        screenshots = []
+        for entry in cache.get('screenshots', []):
+            screenshot = {key: value for key, value in entry.items() if not isinstance(value, Image.Image)}
+            for image_name, image in entry.items():
+                if isinstance(image, Image.Image):
+                    screenshot['image_name'] = image_name
+                    if screenshot_output == 'bytes':
+                        path = entry.get('path')
+                        if path and os.path.isfile(path):
+                            # Already encoded by save_screenshot
+                            with open(path, 'rb') as file_obj:
+                                screenshot['data'] = file_obj.read()
+                        else:
+                            buffered = BytesIO()
+                            image.save(buffered, format='JPEG')
+                            screenshot['data'] = buffered.getvalue()
+            screenshots.append(screenshot)
+
+        recording_result.result = dict(cache, screenshots=screenshots)
+
+    except Exception as e:
+        recording_result.error = e
+
+    finally:
+        recording_result.end_time = datetime.fromtimestamp(datetime.now().timestamp(), UTC)
+
+    return recording_result
+
+class BatchManager:
+    """ Rebuilds many recordings in a process pool (or a thread pool), the results are streamed as they complete
+
+    Each process runs its own rebuilder (stream and rebuild threads), hence the parsing and the PIL/NumPy work of the
+    recordings do not contend on a single GIL. The tasks are the GuacRecordingRebuilder parameters (dict), since the
+    rebuilder itself (HTTP session, threads) cannot be sent to another process.
+    """
+
+    def __init__(self, max_workers: int = None, executor: str = 'process', screenshot_output: str = 'bytes'):
+        if executor not in ['process', 'thread']:
+            raise ValueError('Unsupported executor: %s' % executor)
+        if screenshot_output not in ['bytes', 'path']:
+            raise ValueError('Unsupported screenshot output: %s' % screenshot_output)
+        self.max_workers = max_workers or os.cpu_count()
+        self.executor = executor
+        self.screenshot_output = screenshot_output
+        self.results: List[RecordingResult] = []
+
+    def _create_executor(self):
+        if self.executor == 'process':
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit_batch(self, tasks: List[dict]):
+        """ Yields the RecordingResult of each task as soon as it completes """
+        self.results.clear()
+
+        with self._create_executor() as executor:
+            futures = {executor.submit(rebuild_recording, params, self.screenshot_output): params for params in tasks}
+            for future in as_completed(futures):
+                try:
+                    recording_result = future.result()
+                except Exception as e:
+                    # The worker itself failed (e.g. a crashed process)
+                    recording_result = RecordingResult(result=None, error=e, name=str(futures[future].get('StreamURL')))
+                self.results.append(recording_result)
+                yield recording_result
+
+    def execute_batch(self, tasks: List[dict]) -> List[RecordingResult]:
+        """ Rebuilds all the recordings, the results are sorted by start time """
+        for _ in self.submit_batch(tasks):
+            pass
+
+        self.results.sort(key=lambda x: x.start_time or datetime.max.replace(tzinfo=UTC))
+        return self.results
+
+    def get_successful_results(self) -> List[RecordingResult]:
+        return [r for r in self.results if r.error is None]
+
+    def get_failed_results(self) -> List[RecordingResult]:
+        return [r for r in self.results if r.error is not None]
+
+@dataclass
+class FetchResult:
+    """ The result of a recording downloaded by GuacAsyncFetcher (data in memory, or the path it was written to) """
+    url: str
+    data: bytearray = None
+    path: str = None
+    size: int = 0
+    segments: int = 1
+    retries: int = 0
+    elapsed: float = 0.0
+    error: Exception = None
+
+    @property
+    def throughput(self) -> float:
+        """ Download throughput in bytes per second """
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+@dataclass
+class FetchSegment:
+    """ A byte range [start, end] of a recording fetched by GuacAsyncFetcher (end None: up to the end) """
+    start: int
+    end: int = None
+    position: int = None  # The next byte to receive
+    retries: int = 0
+
+    def __post_init__(self):
+        if self.position is None:
+            self.position = self.start
+
+class GuacAsyncFetcher(object):
+    """ asyncio download front-end: Fetches many recordings concurrently over a shared pool of connections
+
+    - The connections (a requests.Session with a pooled HTTPAdapter) are shared by all the recordings, the concurrency
+    is bounded globally (max_connections) and per host (max_per_host).
+    - The recordings served with range support and larger than segment_size are fetched in parallel segments (HTTP
+    Range), written in place, hence the result is in order for the parser.
+    - Transient failures (connection errors, timeouts, 429/5xx) are retried, resuming from the last received byte.
+
+    Remark: The blocking requests calls run on a dedicated thread pool (one thread per connection), driven by asyncio
+    """
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, session: requests.Session = None, max_connections: int = 16, max_per_host: int = 4,
+                 segment_size: int = 8 << 20, retries: int = 3, backoff: float = 0.5, read_size: int = 1 << 16,
+                 timeout: int = 120):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.segment_size = segment_size
+        self.retries = retries
+        self.backoff = backoff
+        self.read_size = read_size
+        self.timeout = timeout
+
+        if session is None:
+            session = requests.Session()
+            session.headers.update(headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.session = session
+
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='GuacAsyncFetcher')
+        self._loop = None
+        self._global_limit = None
+        self._host_limits = {}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _limits(self, url: str) -> tuple:
+        """ Returns the (per host, global) semaphores, bound to the running loop """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._global_limit = asyncio.Semaphore(self.max_connections)
+            self._host_limits = {}
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_limits[host], self._global_limit
+
+    async def _run(self, url: str, func: Callable, *args):
+        # The host slot is taken first, so the tasks waiting on a busy host do not hold the global slots
+        host_limit, global_limit = self._limits(url)
+        async with host_limit, global_limit:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    def _request(self, url: str, start: int = 0, end: int = None) -> requests.Response:
+        request_headers = {}
+        if start or end is not None:
+            request_headers['Range'] = 'bytes=%d-%s' % (start, '' if end is None else end)
+        return self.session.get(url, headers=request_headers, stream=True, verify=False, timeout=self.timeout)
+
+    def _probe(self, url: str) -> tuple:
+        """ Returns (size, range support) of the recording, the size is None if unknown """
+        with self._request(url, 0, 0) as response:
+            if response.status_code == 206:
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                return (int(total) if total.isdigit() else None), True
+            response.raise_for_status()
+            length = response.headers.get('Content-Length', '')
+            return (int(length) if length.isdigit() else None), False
+
+    def _fetch_range(self, url: str, segment: FetchSegment, write: Callable):
+        """ One attempt at fetching the rest of the segment via write(offset, chunk), from segment.position (advanced as
+        the bytes are received). A segment received short is a transient failure """
+        with self._request(url, segment.position, segment.end) as response:
+            if response.status_code in self.RETRY_STATUS:
+                raise requests.ConnectionError('HTTP %s' % response.status_code)
+            response.raise_for_status()
+            if segment.position and response.status_code != 206:
+                # The server ignored the range, the whole recording is received again
+                if segment.start:
+                    raise ValueError('The server does not support range requests: %s' % url)
+                segment.position = 0
+            for chunk in response.iter_content(chunk_size=self.read_size):
+                write(segment.position, chunk)
+                segment.position += len(chunk)
+        if segment.end is not None and segment.position <= segment.end:
+            raise requests.ConnectionError('Incomplete segment: %s of %s bytes' % (
+                segment.position - segment.start, segment.end + 1 - segment.start))
+
+    async def _fetch_segment(self, url: str, segment: FetchSegment, write: Callable) -> FetchSegment:
+        """ Fetches the segment, the transient failures are retried from the last received byte. The connection slots
+        are released during the backoff, so the other downloads are not blocked """
+        while True:
+            try:
+                await self._run(url, self._fetch_range, url, segment, write)
+                return segment
+            except self.RETRY_EXCEPTIONS as msg:
+                segment.retries += 1
+                if segment.retries > self.retries:
+                    raise
+                logging.warning(' [-] Transient failure (%s), resuming %s at byte %s (attempt %s)...' % (
+                    str(msg), url, segment.position, segment.retries))
+            await asyncio.sleep(self.backoff * 2 ** (segment.retries - 1))
+
+    async def fetch(self, url: str, destination: str = None) -> FetchResult:
+        """ Downloads the recording into memory (FetchResult.data), or into the destination file """
+        fetch_result = FetchResult(url=url, path=destination)
+        started = time.perf_counter()
+        file_obj, lock = None, threading.Lock()
+        try:
+            size, ranges = await self._run(url, self._probe, url)
+
+            if destination is not None:
+                file_obj = open(destination, 'wb+')
+                if size: file_obj.truncate(size)
+
+                def write(offset, chunk):
+                    with lock:
+                        file_obj.seek(offset)
+                        file_obj.write(chunk)
+            else:
+                buffer = bytearray(size or 0)
+
+                def write(offset, chunk):
+                    end = offset + len(chunk)
+                    if end > len(buffer):
+                        with lock:
+                            buffer.extend(bytes(end - len(buffer)))
+                    buffer[offset:end] = chunk
+
+            if ranges and size and self.segment_size and size > self.segment_size:
+                segments = [FetchSegment(start, min(start + self.segment_size, size) - 1)
+                            for start in range(0, size, self.segment_size)]
+            else:
+                segments = [FetchSegment(0, size - 1 if size else None)]
+            fetch_result.segments = len(segments)
+
+            # The retries are counted per segment (each on its own thread), summed once gathered
+            try:
+                await asyncio.gather(*[self._fetch_segment(url, segment, write) for segment in segments])
+            finally:
+                fetch_result.retries = sum(segment.retries for segment in segments)
+
+            # Each segment must hold exactly its bytes, a short one would leave a hole in the recording
+            for segment in segments:
+                expected = segment.end + 1 if segment.end is not None else size
+                if expected is not None and segment.position != expected:
+                    raise ValueError('Incomplete download: Bytes %s-%s, %s of %s received' % (
+                        segment.start, expected - 1, segment.position - segment.start, expected - segment.start))
+            fetch_result.size = segments[-1].position
+
+            if file_obj is not None:
+                file_obj.truncate(fetch_result.size)
+            else:
+                del buffer[fetch_result.size:]
+                fetch_result.data = buffer
+
+        except Exception as msg:
+            fetch_result.error = msg
+            logging.error(' [-] Unable to download: %s. Exception: %s' % (url, str(msg)))
+
+        finally:
+            if file_obj is not None:
+                file_obj.close()
+            fetch_result.elapsed = time.perf_counter() - started
+
+        return fetch_result
+
+    @staticmethod
+    def destination(url: str, directory: str = None) -> str:
+        """ The file a recording is downloaded to (the URLs usually share the file name, hence it is hashed) """
+        if directory is None:
+            return None
+        return os.path.join(directory, '%s.guac' % hashlib.sha1(url.encode()).hexdigest()[:16])
+
+    async def fetch_many(self, urls: List[str], directory: str = None):
+        """ Yields the FetchResult of each recording as soon as it is downloaded """
+        tasks = [asyncio.ensure_future(self.fetch(url, self.destination(url, directory))) for url in urls]
+        for task in asyncio.as_completed(tasks):
+            yield await task
+
+    def download(self, urls: List[str], directory: str = None) -> List[FetchResult]:
+        """ Downloads the recordings (blocking), the results are in the order of the URLs """
+        async def download_all():
+            return await asyncio.gather(*[self.fetch(url, self.destination(url, directory)) for url in urls])
+
+        return list(asyncio.run(download_all()))
+
+""" Benchmarks """
+class SyntheticRecordingGenerator(object):
+    """ Generates synthetic Guacamole (.guac) recordings with controllable properties (for benchmarking purposes)
+
+    - The image tiles (PNG or JPEG, filled with random noise) are drawn from a pool of 8 tiles with the probability
+    repeated_tiles, a new (unique) tile is generated otherwise.
+    - The copy (within the default layer) and rect/cfill instructions are added per sync, the custom instructions carry
+    a JSON payload of about custom_size bytes (including separators and non-ASCII characters) every custom_interval syncs.
+    - The duration (seconds) overrides the interval between the syncs.
+    The recordings are reproducible: The same parameters (and seed) generate the same bytes.
+    """
+    FORMATS = ('png', 'jpeg')
+
+    def __init__(self, width: int = 1024, height: int = 768, syncs: int = 1000, tiles_per_sync: int = 1,
+                 tile_size: int = 64, blob_size: int = 4096, sync_interval_ms: int = 100, seed: int = 0,
+                 duration: float = None, image_format: str = 'png', repeated_tiles: float = 1.0, custom_size: int = 0,
+                 custom_interval: int = 10, copies_per_sync: int = 0, rects_per_sync: int = 0):
+        if image_format not in self.FORMATS:
+            raise ValueError('Unsupported image format: %s' % image_format)
+        self.width = width
+        self.height = height
+        self.syncs = syncs
+        self.tiles_per_sync = tiles_per_sync
+        self.tile_size = tile_size
+        self.blob_size = blob_size
+        self.sync_interval_ms = duration * 1000 / max(syncs, 1) if duration is not None else sync_interval_ms
+        self.seed = seed
+        self.image_format = image_format
+        self.repeated_tiles = repeated_tiles
+        self.custom_size = custom_size
+        self.custom_interval = max(custom_interval, 1)
+        self.copies_per_sync = copies_per_sync
+        self.rects_per_sync = rects_per_sync
+
+    @property
+    def duration(self) -> float:
+        """ The duration of the recording (seconds) """
+        return self.syncs * self.sync_interval_ms / 1000
+
+    def params(self) -> dict:
+        return {
+            'width': self.width, 'height': self.height, 'syncs': self.syncs, 'tiles_per_sync': self.tiles_per_sync,
+            'tile_size': self.tile_size, 'blob_size': self.blob_size, 'sync_interval_ms': self.sync_interval_ms,
+            'seed': self.seed, 'image_format': self.image_format, 'repeated_tiles': self.repeated_tiles,
+            'custom_size': self.custom_size, 'custom_interval': self.custom_interval,
+            'copies_per_sync': self.copies_per_sync, 'rects_per_sync': self.rects_per_sync,
+        }
+
+    @staticmethod
+    def instruction(opcode: str, *args) -> bytes:
+        """ Encodes the instruction (LENGTH.VALUE elements, where LENGTH is the number of characters) """
+        elements = []
+        for value in (opcode,) + args:
+            if isinstance(value, bytes):
+                value = value.decode()
+            value = str(value)
+            elements.append('%s.%s' % (len(value), value))
+
+        return (','.join(elements) + ';').encode()
+
+    def create_tile(self, rnd: random.Random) -> bytes:
+        """ Returns the base64 encoded tile (PNG or JPEG) filled with random noise """
+        noise = rnd.randbytes(self.tile_size * self.tile_size * 3)
+        buffered = BytesIO()
+        Image.frombytes('RGB', (self.tile_size, self.tile_size), noise).save(buffered, format=self.image_format.upper())
+        return base64.b64encode(buffered.getvalue())
+
+    def create_custom(self, rnd: random.Random) -> str:
+        """ Returns a JSON document of about custom_size bytes """
+        events, size = [], 2
+        while size < self.custom_size:
+            event = {'id': len(events), 'time': rnd.randrange(1 << 32), 'text': 'a,b;c.d \u017c\u00f3\u0142w',
+                     'value': rnd.getrandbits(64)}
+            events.append(event)
+            size += len(json.dumps(event, ensure_ascii=False).encode()) + 1
+        return json.dumps({'events': events}, ensure_ascii=False)
+
+    def generate(self) -> bytes:
+        rnd = random.Random(self.seed)
+        tiles = [self.create_tile(rnd) for _ in range(8)]
+        mimetype = 'image/%s' % self.image_format
+        custom = self.create_custom(rnd) if self.custom_size else None
+        start_timestamp = 1733830000000
+        stream_index = 1
+        width, height = self.width, self.height
+
+        recording = bytearray(self.instruction('size', 0, width, height))
+        for sync in range(self.syncs):
+            for _ in range(self.tiles_per_sync):
+                tile = rnd.choice(tiles) if rnd.random() < self.repeated_tiles else self.create_tile(rnd)
+                recording += self.instruction('img', stream_index, 14, 0, mimetype,
+                                              rnd.randrange(max(width - self.tile_size, 1)),
+                                              rnd.randrange(max(height - self.tile_size, 1)))
+                for offset in range(0, len(tile), self.blob_size):
+                    recording += self.instruction('blob', stream_index, tile[offset:offset + self.blob_size])
+                recording += self.instruction('end', stream_index)
+
+            for _ in range(self.copies_per_sync):
+                region_width, region_height = rnd.randrange(1, width // 2), rnd.randrange(1, height // 2)
+                recording += self.instruction('copy', 0, rnd.randrange(width - region_width),
+                                              rnd.randrange(height - region_height), region_width, region_height, 14,
+                                              0, rnd.randrange(width - region_width), rnd.randrange(height - region_height))
+
+            for _ in range(self.rects_per_sync):
+                region_width, region_height = rnd.randrange(1, width // 4), rnd.randrange(1, height // 4)
+                recording += self.instruction('rect', 0, rnd.randrange(width - region_width),
+                                              rnd.randrange(height - region_height), region_width, region_height)
+                recording += self.instruction('cfill', 14, 0, rnd.randrange(256), rnd.randrange(256),
+                                              rnd.randrange(256), 255)
+
+            if custom is not None and sync % self.custom_interval == 0:
+                recording += self.instruction('custom', custom)
+
+            recording += self.instruction('sync', start_timestamp + round((sync + 1) * self.sync_interval_ms))
+
+        return bytes(recording)
+
+def benchmark_instruction_memory(recording: bytes, chunk_size: int = 4096) -> dict:
+    """ Measures (tracemalloc) the memory held by the parsed instructions and frames of given recording
+
+    Remark: The instruction overhead excludes the blob payloads (which have to be kept regardless of the record types)
+    """
+    rebuilder = GuacRecordingRebuilder(StreamURL=None)
+
+    tracemalloc.start()
+    try:
+        instructions = []
+        for offset in range(0, len(recording), chunk_size):
+            instructions.extend(rebuilder.parse_stream_chunk(recording[offset:offset + chunk_size]))
+        instructions_memory = tracemalloc.get_traced_memory()[0]
+
+        frames, streams = [], {}
+        g_frame = guac_recording_frame()
+        for inst_obj in instructions:
+            if g_frame.build(inst_obj=inst_obj, streams=streams):
+                frames.append(g_frame)
+                g_frame = guac_recording_frame()
+        frames.append(g_frame)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    payload = sum(len(inst_obj.data) for inst_obj in instructions if inst_obj.opcode == guac_opcode.blob)
+    return {
+        'recording_bytes': len(recording),
+        'instructions': len(instructions),
+        'frames': len(frames),
+        'instructions_memory': instructions_memory,
+        'frames_memory': current - instructions_memory,
+        'peak_memory': peak,
+        'payload_bytes': payload,
+        'overhead_per_instruction': (instructions_memory - payload) / max(len(instructions), 1),
+        'memory_per_frame': (current - instructions_memory) / max(len(frames), 1),
+    }
+
+# The benchmark scenarios (SyntheticRecordingGenerator parameters), the number of syncs is scaled by --scale
+BENCHMARK_SCENARIOS = {
+    'png-tiles': {'width': 1024, 'height': 768, 'syncs': 2000, 'tile_size': 64},
+    'png-unique-tiles': {'width': 1024, 'height': 768, 'syncs': 2000, 'tile_size': 64, 'repeated_tiles': 0.0},
+    'jpeg-large': {'width': 1280, 'height': 720, 'syncs': 300, 'tile_size': 512, 'image_format': 'jpeg',
+                   'repeated_tiles': 0.5},
+    'custom-json': {'width': 1024, 'height': 768, 'syncs': 2000, 'tile_size': 32, 'custom_size': 64 << 10},
+    'copy-rect': {'width': 1280, 'height': 720, 'syncs': 2000, 'tiles_per_sync': 0, 'copies_per_sync': 8,
+                  'rects_per_sync': 8},
+    'fullhd-long': {'width': 1920, 'height': 1080, 'syncs': 10000, 'tile_size': 64, 'duration': 3600},
+}
+
+BENCHMARK_KINDS = ('parse', 'rebuild', 'batch', 'collage')
+
+def benchmark_parse(path: str, chunk_size: int = 1 << 16) -> dict:
+    """ Measures the throughput of parse_stream_chunk (tokenizer and instruction decoders) over the recording """
+    with open(path, 'rb') as file_obj:
+        recording = file_obj.read()
+
+    rebuilder = GuacRecordingRebuilder(StreamURL=None)
+    instructions = 0
+    started, cpu = time.perf_counter(), time.process_time()
+    for offset in range(0, len(recording), chunk_size):
+        instructions += len(rebuilder.parse_stream_chunk(recording[offset:offset + chunk_size]))
+
+    return {'seconds': time.perf_counter() - started, 'cpu_seconds': time.process_time() - cpu,
+            'bytes': len(recording), 'instructions': instructions}
+
+def benchmark_rebuild(path: str, duration: float = None, triggers: list = None, **params) -> dict:
+    """ Measures the rebuild of the recording (stream and rebuild threads), the screenshots are encoded but not written
+
+    The progress triggers are resolved from the known duration, hence the latency to the first screenshot is the one of
+    a (streamed) rebuild, rather than the one of the whole recording.
+    """
+    first_screenshot = []
+
+    def sink(image_name: str, data: bytes):
+        if not first_screenshot:
+            first_screenshot.append(time.perf_counter())
+
+    writer = GuacScreenshotWriter(sink=sink)
+    rebuilder = GuacRecordingRebuilder(StreamURL=path, ScreenCaptureProgressTriggers=triggers or [4, 50, 99],
+                                       RecordingDuration=duration, ScreenshotWriter=writer, **params)
+    started, cpu = time.perf_counter(), time.process_time()
+    try:
+        rebuilder.start()
+    finally:
+        writer.close()
+
+    return {'seconds': time.perf_counter() - started, 'cpu_seconds': time.process_time() - cpu,
+            'bytes': os.path.getsize(path), 'instructions': rebuilder.instructions.instructions,
+            'frames': len(rebuilder.index), 'screenshots': writer.written,
+            'first_screenshot': first_screenshot[0] - started if first_screenshot else None}
+
+def benchmark_batch(path: str, duration: float = None, copies: int = 4, max_workers: int = None) -> dict:
+    """ Measures the batch path (BatchManager, process pool) over copies of the recording """
+    directory = tempfile.mkdtemp(prefix='guac-benchmark-')
+    try:
+        tasks = [{'StreamURL': path, 'ScreenCaptureProgressTriggers': [4, 50, 99], 'RecordingDuration': duration,
+                  'ScreenCapturePrefix': str(copy), 'ScreenshotWriter': directory} for copy in range(copies)]
+        manager = BatchManager(max_workers=max_workers, executor='process', screenshot_output='path')
+        first_result, errors = None, 0
+        started = time.perf_counter()
+        for result in manager.submit_batch(tasks):
+            if first_result is None:
+                first_result = time.perf_counter() - started
+            errors += result.error is not None
+        seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {'seconds': seconds, 'bytes': os.path.getsize(path) * copies, 'recordings': copies, 'errors': errors,
+            'workers': manager.max_workers, 'first_result': first_result}
+
+def benchmark_collage(path: str, duration: float = None, count: int = 500) -> dict:
+    """ Measures the creation of the image collage (ImageCollage) of count screenshots, taken from the recording
+
+    The screenshots are held in memory as in the batch path (screenshot_output='bytes'), repeated if the recording
+    has fewer frames. The collage is created with the full images as files (paged), then embedded once.
+    """
+    screenshots = []
+    writer = GuacScreenshotWriter(sink=lambda image_name, data: screenshots.append((image_name, data)))
+    rebuilder = GuacRecordingRebuilder(StreamURL=path, ScreenCaptureProgressTriggers=[], RecordingDuration=duration,
+                                       ScreenCaptureInterval=max((duration or count) / count, 1e-3),
+                                       ScreenshotWriter=writer)
+    try:
+        rebuilder.start()
+    finally:
+        writer.close()
+    if not screenshots:
+        raise ValueError('The recording has no screenshots: %s' % path)
+
+    images = [{image_name: Image.open(BytesIO(data)), 'ScreenCapturePrefix': 'benchmark', 'session_url': path}
+              for image_name, data in (screenshots[index % len(screenshots)] for index in range(count))]
+    directory = tempfile.mkdtemp(prefix='guac-benchmark-')
+    try:
+        def output_size() -> int:
+            return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+        started, cpu = time.perf_counter(), time.process_time()
+        ImageCollage(images).create_image_collage_html(output_file=os.path.join(directory, 'collage.html'), page_size=100)
+        seconds, cpu_seconds, output_bytes = time.perf_counter() - started, time.process_time() - cpu, output_size()
+
+        shutil.rmtree(directory)
+        os.makedirs(directory)
+        started = time.perf_counter()
+        ImageCollage(images).create_image_collage_html(output_file=os.path.join(directory, 'collage.html'), embed=True)
+        embed_seconds, embed_bytes = time.perf_counter() - started, output_size()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {'seconds': seconds, 'cpu_seconds': cpu_seconds,
+            'bytes': sum(len(screenshots[index % len(screenshots)][1]) for index in range(count)),
+            'screenshots': count, 'unique_screenshots': len(screenshots), 'output_bytes': output_bytes,
+            'embed_seconds': embed_seconds, 'embed_bytes': embed_bytes}
+
+def run_benchmark_case(kind: str, path: str, duration: float = None) -> dict:
+    """ Runs a single benchmark (executed in a fresh process, hence the peak memory is the one of the case) """
+    logging.disable(logging.CRITICAL)
+    if kind == 'parse':
+        result = benchmark_parse(path)
+    elif kind == 'rebuild':
+        result = benchmark_rebuild(path, duration=duration)
+    elif kind == 'batch':
+        result = benchmark_batch(path, duration=duration)
+    elif kind == 'collage':
+        result = benchmark_collage(path, duration=duration)
+    else:
+        raise ValueError('Unsupported benchmark: %s' % kind)
+
+    result['peak_memory'] = GuacProfiler.peak_memory()
+    if resource is not None and kind == 'batch':
+        # The workers' peak (the largest one)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        result['peak_memory_workers'] = children if sys.platform == 'darwin' else children * 1024
+    return result
+
+def benchmark_environment() -> dict:
+    """ The environment the results are comparable within (same machine, interpreter and libraries) """
+    import platform
+    import PIL
+    with open(__file__, 'rb') as file_obj:
+        script_sha1 = hashlib.file_digest(file_obj, 'sha1').hexdigest()
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'gil_disabled': not getattr(sys, '_is_gil_enabled', lambda: True)(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'script_sha1': script_sha1,
+    }
+
+def run_benchmarks(scenarios: list = None, kinds: list = None, repeat: int = 3, scale: float = 1.0,
+                   output=None, directory: str = None, label: str = None) -> List[dict]:
+    """ Runs the benchmark suite: Each scenario's recording is generated (reproducible), then each benchmark kind is run
+    repeat times, every run in a fresh process
+
+    The results are one record per scenario and kind: The environment, the scenario parameters and recording digest,
+    the runs and the best run's metrics (MB/s, instructions/s, latency to the first screenshot, peak memory). They are
+    appended to the output (path) as JSON lines, if given.
+    """
+    import multiprocessing
+
+    scenarios = scenarios or list(BENCHMARK_SCENARIOS)
+    kinds = kinds or list(BENCHMARK_KINDS)
+    environment = benchmark_environment()
+    owns_directory = directory is None
+    directory = directory or tempfile.mkdtemp(prefix='guac-benchmark-')
+    os.makedirs(directory, exist_ok=True)
+
+    records = []
+    try:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, max_tasks_per_child=1) as executor:
+            for scenario in scenarios:
+                params = dict(BENCHMARK_SCENARIOS[scenario])
+                params['syncs'] = max(int(params.get('syncs', 1000) * scale), 1)
+                generator = SyntheticRecordingGenerator(**params)
+                recording = generator.generate()
+                path = os.path.join(directory, '%s.guac' % scenario)
+                with open(path, 'wb') as file_obj:
+                    file_obj.write(recording)
+
+                for kind in kinds:
+                    runs = [executor.submit(run_benchmark_case, kind, path, generator.duration).result()
+                            for _ in range(repeat)]
+                    best = min(runs, key=lambda run: run['seconds'])
+                    megabytes = best['bytes'] / (1 << 20)
+                    record = {
+                        'label': label,
+                        'time': datetime.now(UTC).isoformat(),
+                        'scenario': scenario,
+                        'kind': kind,
+                        'params': generator.params(),
+                        'recording_bytes': len(recording),
+                        'recording_sha1': hashlib.sha1(recording).hexdigest(),
+                        'environment': environment,
+                        'runs': runs,
+                        'seconds': best['seconds'],
+                        'mb_per_second': megabytes / best['seconds'] if best['seconds'] else None,
+                        'instructions_per_second': best['instructions'] / best['seconds']
+                            if 'instructions' in best and best['seconds'] else None,
+                        'first_screenshot': best.get('first_screenshot', best.get('first_result')),
+                        'output_bytes': best.get('output_bytes'),
+                        'peak_memory': max(run['peak_memory'] or 0 for run in runs) or None,
+                    }
+                    records.append(record)
+                    logging.info(' [-] %s/%s: %.3fs, %.1f MB/s' % (scenario, kind, record['seconds'],
+                                                                   record['mb_per_second'] or 0))
+                    if output is not None:
+                        with open(output, 'a', encoding='utf-8') as file_obj:
+                            file_obj.write(json.dumps(record) + '\n')
+    finally:
+        if owns_directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return records
+
+def compare_benchmarks(baseline: str, current: str) -> List[dict]:
+    """ Compares the results (JSON lines) of two versions, the latest record per scenario and kind is used
+
+    A ratio above 1 is a regression (slower, or more memory).
+    """
+    def load(path: str) -> dict:
+        records = {}
+        with open(path, encoding='utf-8') as file_obj:
+            for line in file_obj:
+                if line.strip():
+                    record = json.loads(line)
+                    records[(record['scenario'], record['kind'])] = record
+        return records
+
+    baseline_records, current_records = load(baseline), load(current)
+    comparison = []
+    for key in sorted(baseline_records.keys() & current_records.keys()):
+        before, after = baseline_records[key], current_records[key]
+        if before['recording_sha1'] != after['recording_sha1']:
+            logging.warning(' [-] The recordings of %s/%s differ (not comparable)' % key)
+            continue
+        for metric in ('seconds', 'first_screenshot', 'peak_memory'):
+            if before.get(metric) and after.get(metric) is not None:
+                comparison.append({'scenario': key[0], 'kind': key[1], 'metric': metric, 'baseline': before[metric],
+                                   'current': after[metric], 'ratio': after[metric] / before[metric]})
+    return comparison
+
+def benchmark_main(arguments: list) -> int:
+    """ python guac-parser.py benchmark [--output results.jsonl] [--scenarios ...] [--compare baseline.jsonl] """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='guac-parser.py benchmark', description='Runs the benchmark suite')
+    parser.add_argument('--scenarios', nargs='+', choices=list(BENCHMARK_SCENARIOS), help='All by default')
+    parser.add_argument('--kinds', nargs='+', choices=list(BENCHMARK_KINDS), help='All by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=1.0, help='Scales the number of syncs of the scenarios')
+    parser.add_argument('--output', help='Appends the results (JSON lines)')
+    parser.add_argument('--label', help='A label of the results (e.g. the version)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compares two result files')
+    args = parser.parse_args(arguments)
+
+    if args.compare:
+        for row in compare_benchmarks(*args.compare):
+            print('%(scenario)-18s %(kind)-8s %(metric)-17s %(baseline)12.4g %(current)12.4g %(ratio)7.2fx' % row)
+        return 0
+
+    records = run_benchmarks(scenarios=args.scenarios, kinds=args.kinds, repeat=args.repeat, scale=args.scale,
+                             output=args.output, label=args.label)
+    if args.output is None:
+        for record in records:
+            print(json.dumps(record))
+    return 0
+
 if __name__ == "__main__":
 
+    if sys.argv[1:2] == ['benchmark']:
+        sys.exit(benchmark_main(sys.argv[2:]))
+
     screenshots = []
     max_threads = 7
 
@@ -1103,7 +5137,7 @@ if __name__ == "__main__":
         'https://tria.ge/250119-njhjxawkdk'
     ]
 
-    logging.info('[+] Initiating multi-threaded processing (max_threads: %s)...' % max_threads)
+    logging.info('[+] Initiating multi-process processing (max_workers: %s)...' % max_threads)
     logging.info(' [-] Populating tasks to execute...')
 
     guac_uri = 'behavioral1/logs/vnc.guac'
@@ -1114,29 +5148,33 @@ if __name__ == "__main__":
         session_id = overview_url[api_base_end+1:]
         guac_url = '%s/%s/%s' % (api_base, session_id, guac_uri)
 
-        tasks.append(
-            GuacRecordingRebuilder(**{
-                'debug_mode': False,
-                'StreamURL': guac_url,
-                'CreateScreenshots': True,
-                'ScreenCaptureProgressTriggers': [99],
-                'ScreenCapturePrefix': session_id,
-                'ReplayRecording': False,  # Do not use it when more than 1 URL (Some issues with Thinter to fix
-            })
-        )
+        tasks.append({
+            'debug_mode': False,
+            'StreamURL': guac_url,
+            'CreateScreenshots': True,
+            'ScreenCaptureProgressTriggers': [99],
+            'ScreenCapturePrefix': session_id,
+            'ReplayRecording': False,  # Do not use it when more than 1 URL (Some issues with Thinter to fix
+        })
 
-    manager = ThreadManager(max_threads=max_threads)
+    manager = BatchManager(max_workers=max_threads, executor='process', screenshot_output='bytes')
 
     logging.info(' [-] Going to process %s recording URLs...' % len(tasks))
-    results = manager.execute_batch(tasks)
-
-    logging.info('[+] Retrieving screenshots from workers...')
-    for result in manager.get_successful_results():
-        if result.result:
-            if isinstance(result.result, dict):
-                screenshots.extend(result.result.get('screenshots', []))
+    for result in manager.submit_batch(tasks):
+        # The results are streamed as the recordings complete
+        if result.error is not None:
+            logging.error(' [-] Failed: %s (%.2fs). Exception: %s' % (result.name, result.duration, result.error))
+            continue
+
+        logging.info(' [-] Completed: %s (%.2fs)' % (result.name, result.duration))
+        for screenshot in result.result.get('screenshots', []):
+            screenshots.append({
+                screenshot['image_name']: Image.open(BytesIO(screenshot['data'])),
+                'ScreenCapturePrefix': screenshot['ScreenCapturePrefix'],
+                'session_url': screenshot['session_url'],
+            })
 
     logging.info('[+] Crafting the collage...')
-    output_path = ImageCollage(screenshots).create_self_contained_image_collage_html()
+    output_path = ImageCollage(screenshots).create_image_collage_html(page_size=100)
 
 
@@ -0,0 +1,106 @@
+import http.server
+import importlib.util
+import logging
+import os
+import re
+import sys
+import threading
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'guac-parser.py')
+
+
+def load_script():
+    """ The script is not a package (guac-parser.py), it is loaded as the guac_parser module """
+    if 'guac_parser' in sys.modules:
+        return sys.modules['guac_parser']
+    spec = importlib.util.spec_from_file_location('guac_parser', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['guac_parser'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def guac():
+    module = load_script()
+    logging.disable(logging.WARNING)
+    yield module
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture(scope='session')
+def recording(guac) -> bytes:
+    """ A small synthetic recording: PNG tiles, copies, rects and custom JSON payloads (non-ASCII characters) """
+    return guac.SyntheticRecordingGenerator(width=128, height=96, syncs=60, tile_size=16, blob_size=512, seed=1,
+                                            repeated_tiles=0.5, custom_size=2048, custom_interval=7,
+                                            copies_per_sync=1, rects_per_sync=1).generate()
+
+
+@pytest.fixture
+def recording_path(recording, tmp_path) -> str:
+    path = tmp_path / 'recording.guac'
+    path.write_bytes(recording)
+    return str(path)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves the files of the server (Range requests, unless disabled), the connection can be dropped after some
+    bytes (once, for any request of the path or for the range starting at given byte). The requests are recorded """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        data = self.server.files.get(self.path)
+        if data is None or self.path in self.server.statuses:
+            self.send_response(self.server.statuses.get(self.path, 404))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = 0, len(data) - 1
+        match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and self.server.ranges:
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), end) if match.group(2) else end
+            else:
+                start = max(len(data) - int(match.group(2)), 0)  # Suffix range (the last bytes)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        body = data[start:end + 1]
+        key = (self.path, start) if (self.path, start) in self.server.drops else self.path
+        drop_after = self.server.drops.get(key)
+        if drop_after is not None and drop_after < len(body):
+            del self.server.drops[key]
+            self.wfile.write(body[:drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(recording):
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.files = {'/recording.guac': recording}
+    httpd.drops = {}
+    httpd.requests = []
+    httpd.statuses = {}  # The status served instead of the file
+    httpd.ranges = True  # False: The Range requests are ignored (200)
+    httpd.handle_error = lambda request, client_address: None  # The dropped connections
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, 'http://127.0.0.1:%d' % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
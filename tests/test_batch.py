@@ -0,0 +1,46 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+
+def tasks(recording_path, directory) -> list:
+    return [dict(StreamURL=recording_path, ScreenCaptureProgressTriggers=[10, 90], DecodeWorkers=0,
+                 ScreenCapturePrefix='task%d' % index, ScreenshotWriter=os.path.join(str(directory), str(index)))
+            for index in range(3)]
+
+
+@pytest.mark.parametrize('executor', ['process', 'thread'])
+def test_batch(guac, recording_path, tmp_path, executor):
+    batch = tasks(recording_path, tmp_path) + [dict(StreamURL=str(tmp_path / 'missing.guac'))]
+    manager = guac.BatchManager(max_workers=2, executor=executor)
+    streamed = list(manager.submit_batch(batch))
+
+    assert len(streamed) == 4
+    successful, failed = manager.get_successful_results(), manager.get_failed_results()
+    assert len(successful) == 3
+    assert [result.name for result in failed] == [str(tmp_path / 'missing.guac')]
+    for result in successful:
+        screenshots = result.result['screenshots']
+        assert len(screenshots) == 2
+        assert Image.open(BytesIO(screenshots[0]['data'])).size == (128, 96)
+        assert result.stats['instructions'] > 0
+
+
+def test_paths(guac, recording_path, tmp_path):
+    manager = guac.BatchManager(max_workers=2, executor='thread', screenshot_output='path')
+    results = manager.execute_batch(tasks(recording_path, tmp_path))
+
+    assert [result.start_time <= result.end_time for result in results] == [True] * 3
+    for result in results:
+        for screenshot in result.result['screenshots']:
+            assert 'data' not in screenshot
+            assert os.path.isfile(screenshot['path'])
+
+
+def test_unsupported_options(guac):
+    with pytest.raises(ValueError):
+        guac.BatchManager(executor='cluster')
+    with pytest.raises(ValueError):
+        guac.BatchManager(screenshot_output='base64')
@@ -0,0 +1,43 @@
+def rebuild(guac, path, cache, directory, triggers=(4, 50, 99)):
+    rebuilder = guac.GuacRecordingRebuilder(StreamURL=path, Cache=cache, ScreenCaptureProgressTriggers=list(triggers),
+                                            ScreenshotWriter=str(directory))
+    rebuilder.cache = {'screenshots': []}
+    rebuilder.start()
+    return rebuilder
+
+
+def screenshots(rebuilder) -> dict:
+    return {entry['frame_number']: open(entry['path'], 'rb').read() for entry in rebuilder.cache['screenshots']}
+
+
+def test_miss_then_hit(guac, recording_path, tmp_path):
+    cache = guac.GuacDiskCache(str(tmp_path / 'cache'))
+
+    first = rebuild(guac, recording_path, cache, tmp_path / 'first')
+    assert first.cache_status == 'miss'
+    assert first.stream_complete
+
+    second = rebuild(guac, recording_path, cache, tmp_path / 'second')
+    assert second.cache_status == 'hit'
+    assert second.instructions.instructions == 0  # Not parsed again
+    assert screenshots(second) == screenshots(first)
+    assert len(second.index) == len(first.index)
+
+
+def test_new_triggers_miss_the_screenshots(guac, recording_path, tmp_path):
+    cache = guac.GuacDiskCache(str(tmp_path / 'cache'))
+    rebuild(guac, recording_path, cache, tmp_path / 'first')
+
+    # The same recording, other triggers: Rendered from the cached keyframes
+    other = rebuild(guac, recording_path, cache, tmp_path / 'other', triggers=(25,))
+    assert other.cache_status == 'keyframes'
+    assert len(other.cache['screenshots']) == 1
+
+
+def test_changed_recording_misses(guac, recording, recording_path, tmp_path):
+    cache = guac.GuacDiskCache(str(tmp_path / 'cache'))
+    rebuild(guac, recording_path, cache, tmp_path / 'first')
+
+    with open(recording_path, 'wb') as file_obj:
+        file_obj.write(recording + b'4.sync,13.1733830099000;')
+    assert rebuild(guac, recording_path, cache, tmp_path / 'second').cache_status == 'miss'
@@ -0,0 +1,56 @@
+from PIL import Image, ImageDraw
+
+
+def screen(boxes=(), size=(64, 64)) -> Image.Image:
+    """ A black screen with the white boxes """
+    image = Image.new('RGB', size)
+    draw = ImageDraw.Draw(image)
+    for box in boxes:
+        draw.rectangle(box, fill=(255, 255, 255))
+    return image
+
+
+def present(trigger, image, seconds: float, regions=None) -> bool:
+    trigger.present(image, regions, timestamp_ms=int(seconds * 1000))
+    return trigger.take()
+
+
+def test_significant_change(guac):
+    trigger = guac.ScreenChangeTrigger(threshold=0.1, min_interval=0, block=8)
+    assert not present(trigger, screen(), 0)
+
+    # A single block (1/64 of the screen): Below the threshold
+    assert not present(trigger, screen([(0, 0, 7, 7)]), 1, [(0, 0, 8, 8)])
+    # A quarter of the screen
+    assert present(trigger, screen([(0, 0, 7, 7), (32, 32, 63, 63)]), 2, [(32, 32, 64, 64)])
+    assert trigger.count == 1 and trigger.scores == [0.266]
+    # Taken once, compared with the last capture from then on
+    assert not trigger.take()
+    assert not present(trigger, screen([(0, 0, 7, 7), (32, 32, 63, 63)]), 3, [(32, 32, 64, 64)])
+
+
+def test_min_interval_and_max_count(guac):
+    trigger = guac.ScreenChangeTrigger(threshold=0.1, min_interval=5, max_count=2, block=8)
+    present(trigger, screen(), 0)
+
+    captures = []
+    for second in range(1, 30):
+        # The screen alternates between black and white
+        image = screen([(0, 0, 63, 63)] if second % 2 else [])
+        if present(trigger, image, second):
+            captures.append(second)
+    assert captures == [1, 6]
+    assert trigger.count == 2
+
+
+def test_rebuild_on_change(guac, recording, tmp_path):
+    trigger = guac.ScreenChangeTrigger(threshold=0.05, min_interval=1, max_count=4)
+    rebuilder = guac.GuacRecordingRebuilder(recording, ScreenCaptureProgressTriggers=[], ScreenCaptureOnChange=trigger,
+                                            ScreenshotWriter=str(tmp_path / 'out'))
+    rebuilder.cache = {'screenshots': []}
+    rebuilder.start()
+
+    frame_numbers = sorted(entry['frame_number'] for entry in rebuilder.cache['screenshots'])
+    assert 0 < len(frame_numbers) == trigger.count <= 4
+    # A sync every 100 ms: At least 1 second apart
+    assert all(b - a >= 10 for a, b in zip(frame_numbers, frame_numbers[1:]))
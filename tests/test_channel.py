@@ -0,0 +1,82 @@
+import queue
+import threading
+import time
+
+
+def test_backpressure(guac):
+    channel = guac.GuacInstructionChannel(maxsize=2)
+    results = []
+    producer = threading.Thread(target=lambda: results.extend(channel.put([index]) for index in range(5)))
+    producer.start()
+
+    # The producer blocks once the channel is full
+    time.sleep(0.3)
+    assert producer.is_alive()
+    assert len(channel) == 2 and channel.batches == 2
+
+    received = [channel.get(timeout=1) for _ in range(5)]
+    producer.join(timeout=1)
+    assert received == [[0], [1], [2], [3], [4]]
+    assert results == [True] * 5
+    assert channel.peak_depth == 2
+    assert channel.producer_wait > 0.2
+
+
+def test_close_and_drain(guac):
+    channel = guac.GuacInstructionChannel(maxsize=4)
+    channel.put([1, 2])
+    channel.put([])  # Not handed over
+    channel.close()
+
+    assert channel.get() == [1, 2]
+    assert channel.get() is None
+    assert channel.instructions == 2
+    try:
+        channel.get(timeout=0.05)
+        assert False, 'Empty expected'
+    except queue.Empty:
+        pass
+
+
+def test_cancel_unblocks_the_producer(guac):
+    channel = guac.GuacInstructionChannel(maxsize=1)
+    channel.put([0])
+    results = []
+    producer = threading.Thread(target=lambda: results.append(channel.put([1])))
+    producer.start()
+    time.sleep(0.2)
+
+    channel.cancel()
+    producer.join(timeout=1)
+    assert not producer.is_alive()
+    assert results == [False]
+
+
+def test_rebuilder_stops_reading_once_cancelled(guac, recording):
+    # Nobody consumes the instructions: The stream thread gives up instead of reading the whole recording
+    rebuilder = guac.GuacRecordingRebuilder(recording, CreateScreenshots=False, QueueSize=1, ReadSize=256)
+    rebuilder.instructions = guac.GuacInstructionChannel(maxsize=1)
+    reader = threading.Thread(target=rebuilder.parse_stream_instructions)
+    reader.start()
+    time.sleep(0.2)
+    assert reader.is_alive()
+
+    rebuilder.instructions.cancel()
+    reader.join(timeout=2)
+    assert not reader.is_alive()
+    assert not rebuilder.stream_complete
+    assert rebuilder.bytes_read < len(recording)
+
+
+def test_chunk_failure_is_reported(guac, recording):
+    rebuilder = guac.GuacRecordingRebuilder(recording, CreateScreenshots=False, ReadSize=4096)
+    parse_stream_chunk = rebuilder.parse_stream_chunk
+
+    def failing(chunk):
+        if rebuilder.bytes_read == 4096 * 3:
+            raise MemoryError('chunk 3')
+        return parse_stream_chunk(chunk)
+
+    rebuilder.parse_stream_chunk = failing
+    rebuilder.start()
+    assert isinstance(rebuilder.stream_error, MemoryError)
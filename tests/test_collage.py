@@ -0,0 +1,62 @@
+import os
+import re
+
+from PIL import Image
+
+
+def entries(count: int, directory=None, broken: set = ()) -> list:
+    """ Screenshot entries (see GuacRecordingRebuilder.add_screenshot), dumped into directory if given """
+    screenshots = []
+    for index in range(count):
+        name = '%d_screen.jpg' % index
+        entry = {name: Image.new('RGB', (64, 48), (index * 20 % 256, 0, 0)), 'ScreenCapturePrefix': 'rec',
+                 'session_url': 'https://example.com/%d' % index, 'frame_number': index}
+        if index in broken:
+            # Neither an image nor a file
+            entry = {'ScreenCapturePrefix': 'rec', 'path': '/nonexistent/%s' % name}
+        elif directory is not None:
+            entry['path'] = os.path.join(str(directory), name)
+            entry[name].save(entry['path'], format='JPEG')
+        screenshots.append(entry)
+    return screenshots
+
+
+def test_files_are_referenced(guac, tmp_path):
+    screenshots = entries(5, tmp_path)
+    output = str(tmp_path / 'collage.html')
+    guac.ImageCollage(screenshots).create_image_collage_html(output_file=output)
+
+    page = open(output, encoding='utf-8').read()
+    # The dumped screenshots are referenced as is, the thumbnails are files
+    assert page.count('class="image-card"') == 5
+    assert 'data-full="0_screen.jpg"' in page
+    assert sorted(os.listdir(tmp_path / 'collage_files' / 'thumbs')) == ['%d.jpg' % index for index in range(1, 6)]
+    assert 'data:image' not in page and 'text/plain' not in page
+
+
+def test_self_contained(guac, tmp_path):
+    output = str(tmp_path / 'collage.html')
+    assert guac.ImageCollage(entries(3)).create_self_contained_image_collage_html(output_file=output) == output
+
+    page = open(output, encoding='utf-8').read()
+    assert not os.path.exists(tmp_path / 'collage_files')
+    assert page.count('class="image-card"') == 3
+    # The full images are embedded once each, referenced by id, with the shared script
+    assert re.findall(r'<script type="text/plain" id="(image-\d+)"', page) == ['image-1', 'image-2', 'image-3']
+    assert page.count('function imageSource') == 1
+
+
+def test_pages_with_broken_screenshots(guac, tmp_path):
+    output = str(tmp_path / 'collage.html')
+    guac.ImageCollage(entries(10, broken={1, 4, 5})).create_image_collage_html(output_file=output, page_size=4)
+
+    pages = ['collage.html', 'collage_2.html', 'collage_3.html']
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.html')) == pages
+    cards = []
+    for name in pages:
+        page = open(tmp_path / name, encoding='utf-8').read()
+        cards.append(page.count('class="image-card"'))
+        # The navigation links point at the pages written
+        assert set(re.findall(r'<a href="([^"]+)"', page)) == set(pages) - {name}
+    assert cards == [4, 4, 2]
+    assert open(output, encoding='utf-8').read().count('is not available') == 1
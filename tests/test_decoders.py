@@ -0,0 +1,44 @@
+import pytest
+
+
+def test_decode(guac):
+    inst_obj = guac.Instruction_Decoders[b'sync']([b'sync', b'1733830000500'])
+
+    assert inst_obj.opcode == guac.guac_opcode.sync
+    assert (inst_obj.timestamp_ms, inst_obj.timestamp) == (1733830000500, 1733830000)
+
+
+def test_missing_arguments_default_to_none(guac):
+    inst_obj = guac.Instruction_Decoders[b'size']([b'size', b'0'])
+    assert (inst_obj.layer_index, inst_obj.width, inst_obj.height) == (0, None, None)
+
+
+def test_undecodable_instruction_is_skipped(guac):
+    # Tokenized fine, but the argument is not a number: Only this instruction is lost
+    rebuilder = guac.GuacRecordingRebuilder(None)
+    instructions = rebuilder.parse_stream_chunk(b'4.sync,3.100;4.sync,3.abc;4.size,1.0,3.640,3.480;4.sync,3.200;')
+
+    assert [inst.opcode.name for inst in instructions] == ['sync', 'size', 'sync']
+    assert [inst.timestamp_ms for inst in instructions if inst.opcode.name == 'sync'] == [100, 200]
+
+
+def test_register_instruction_handler(guac):
+    guac.register_instruction_handler('key', arguments={'keysym': [guac.to_int], 'pressed': [guac.to_int]})
+    try:
+        rebuilder = guac.GuacRecordingRebuilder(None)
+        key, sync = rebuilder.parse_stream_chunk(b'3.key,5.65307,1.1;4.sync,3.100;')
+        assert (key.name, key.keysym, key.pressed) == ('key', 65307, 1)
+        # Decoded only, not replayed
+        frame = guac.guac_recording_frame()
+        assert not frame.build(key, {}) and not frame.operations
+        assert sync.opcode == guac.guac_opcode.sync
+    finally:
+        del guac.Instruction_Handlers['key']
+        guac.Instruction_Decoders = guac.compile_instruction_handlers(guac.Instruction_Handlers)
+
+
+def test_replayed_instructions_cannot_be_registered(guac):
+    for opcode in ('rect', 'img', 'sync'):
+        with pytest.raises(ValueError):
+            guac.register_instruction_handler(opcode, arguments={})
+    assert guac.Instruction_Decoders[b'rect']([b'rect', b'0', b'1', b'2', b'3', b'4']).height == 4
@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+
+RED, GREEN, BLUE = (255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255)
+
+
+def op(guac, opcode: str, *args):
+    """ The instruction record, decoded from its elements """
+    return guac.Instruction_Decoders[opcode.encode()]([opcode.encode()] + [str(arg).encode() for arg in args])
+
+
+def fill(guac, display, layer: int, x: int, y: int, width: int, height: int, color: tuple, mask: int = 0xC) -> bool:
+    display.apply(op(guac, 'rect', layer, x, y, width, height))
+    return display.apply(op(guac, 'cfill', mask, layer, *color))
+
+
+@pytest.fixture
+def display(guac):
+    display = guac.GuacDisplay()
+    display.apply(op(guac, 'size', 0, 32, 24))
+    display.take_damage()
+    return display
+
+
+def pattern(height: int, width: int) -> np.ndarray:
+    """ Distinct opaque pixels """
+    pixels = np.arange(height * width * 3, dtype=np.uint32).reshape(height, width, 3) % 251
+    return np.dstack([pixels.astype(np.uint8), np.full((height, width), 255, dtype=np.uint8)])
+
+
+def test_cfill(guac, display):
+    assert fill(guac, display, 0, 4, 2, 6, 3, RED)
+
+    surface = display.layers[0].surface
+    assert (surface[2:5, 4:10] == RED).all()
+    assert surface[:2].sum() == surface[5:].sum() == 0
+    assert display.take_damage() == [(4, 2, 10, 5)]
+    # The path is consumed by the fill
+    assert display.layers[0].path == []
+
+
+def test_cfill_over_blends(guac, display):
+    fill(guac, display, 0, 0, 0, 4, 4, BLUE)
+    fill(guac, display, 0, 0, 0, 4, 4, (255, 0, 0, 128), mask=0xE)
+
+    assert tuple(display.layers[0].surface[0, 0]) == (128, 0, 127, 255)
+
+
+def test_overlapping_copy(guac, display):
+    pixels = pattern(24, 32)
+    display.draw(0, 0, 0, pixels, 0xC)
+
+    # Shifted right by 3 pixels within the same layer
+    display.apply(op(guac, 'copy', 0, 0, 0, 20, 10, 0xC, 0, 3, 0))
+    expected = pixels.copy()
+    expected[0:10, 3:23] = pixels[0:10, 0:20]
+    assert np.array_equal(display.layers[0].surface, expected)
+
+
+def test_copy_from_buffer(guac, display):
+    # The buffers grow to fit their contents, and are not visible
+    assert not fill(guac, display, -1, 2, 2, 4, 4, GREEN)
+    assert display.layers[-1].surface.shape == (6, 6, 4)
+    assert display.take_damage() == []
+
+    assert display.apply(op(guac, 'copy', -1, 2, 2, 4, 4, 0xE, 0, 20, 10))
+    assert (display.layers[0].surface[10:14, 20:24] == GREEN).all()
+    assert display.take_damage() == [(20, 10, 24, 14)]
+
+
+def test_copy_is_clipped(guac, display):
+    fill(guac, display, 0, 0, 0, 8, 8, RED)
+    display.apply(op(guac, 'copy', 0, 0, 0, 8, 8, 0xC, 0, 28, 20))
+
+    surface = display.layers[0].surface
+    assert (surface[20:24, 28:32] == RED).all()
+    assert surface.shape == (24, 32, 4)
+
+
+@pytest.mark.parametrize('function, expected', [
+    (0x3, lambda src, dst: src),                # SRC
+    (0xC, lambda src, dst: ~src),               # NOT SRC
+    (0x1, lambda src, dst: src & dst),          # AND
+    (0x6, lambda src, dst: src ^ dst),          # XOR
+    (0x7, lambda src, dst: src | dst),          # OR
+])
+def test_transfer(guac, display, function, expected):
+    src, dst = pattern(6, 8), pattern(6, 8)[::-1].copy()
+    display.draw(-1, 0, 0, src, 0xC)
+    display.draw(0, 10, 10, dst, 0xC)
+
+    assert display.apply(op(guac, 'transfer', -1, 0, 0, 8, 6, function, 0, 10, 10))
+    target = display.layers[0].surface[10:16, 10:18]
+    assert np.array_equal(target[..., :3], expected(src[..., :3], dst[..., :3]))
+    assert (target[..., 3] == 255).all()
+
+
+def test_layer_parenting(guac, display):
+    # Layer 1 (10x10) at 4, 4 of the default layer, layer 2 at 6, 6 of layer 1: Clipped by its parent
+    display.apply(op(guac, 'size', 1, 10, 10))
+    display.apply(op(guac, 'size', 2, 10, 10))
+    fill(guac, display, 1, 0, 0, 10, 10, RED)
+    fill(guac, display, 2, 0, 0, 10, 10, GREEN)
+    display.apply(op(guac, 'move', 1, 0, 4, 4, 0))
+    display.apply(op(guac, 'move', 2, 1, 6, 6, 0))
+    assert display.position(display.layers[2]) == (10, 10)
+
+    flattened = display.flatten()
+    assert (flattened[4:10, 4:14] == RED).all()
+    assert (flattened[10:14, 10:14] == GREEN).all()
+    assert flattened[14:16, 10:14].sum() == 0  # Beyond layer 1
+    # The surfaces are not modified
+    assert (display.layers[0].surface == 0).all()
+
+
+def test_z_order_and_opacity(guac, display):
+    for index, color, z in ((1, RED, 2), (2, GREEN, 1)):
+        display.apply(op(guac, 'size', index, 8, 8))
+        fill(guac, display, index, 0, 0, 8, 8, color)
+        display.apply(op(guac, 'move', index, 0, 0, 0, z))
+    assert tuple(display.flatten()[0, 0]) == RED
+
+    display.apply(op(guac, 'shade', 1, 0))
+    assert tuple(display.flatten()[0, 0]) == GREEN
+
+    display.apply(op(guac, 'dispose', 2))
+    assert 2 not in display.layers
+    assert display.flatten()[0, 0].sum() == 0
+
+
+def test_flatten_region(guac, display):
+    display.draw(0, 0, 0, pattern(24, 32), 0xC)
+    display.apply(op(guac, 'size', 1, 8, 8))
+    fill(guac, display, 1, 0, 0, 8, 8, (0, 0, 255, 128), mask=0xE)
+    display.apply(op(guac, 'move', 1, 0, 12, 6, 0))
+
+    assert np.array_equal(display.flatten((10, 4, 22, 18)), display.flatten()[4:18, 10:22])
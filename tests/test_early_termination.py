@@ -0,0 +1,59 @@
+import os
+
+
+def rebuild(guac, source, directory, **params):
+    rebuilder = guac.GuacRecordingRebuilder(source, ScreenshotWriter=str(directory), ReadSize=1024, QueueSize=2,
+                                            **params)
+    rebuilder.cache = {'screenshots': []}
+    rebuilder.start()
+    return rebuilder
+
+
+def screenshots(rebuilder) -> dict:
+    return {entry['frame_number']: open(entry['path'], 'rb').read() for entry in rebuilder.cache['screenshots']}
+
+
+def test_stops_once_the_screenshots_are_taken(guac, recording, recording_path, tmp_path):
+    full = rebuild(guac, recording_path, tmp_path / 'full', ScreenCaptureProgressTriggers=[10, 20])
+    early = rebuild(guac, recording_path, tmp_path / 'early', ScreenCaptureProgressTriggers=[10, 20],
+                    EarlyTermination=True)
+
+    assert not full.stopped_early and full.bytes_read == len(recording)
+    assert early.stopped_early
+    assert early.bytes_read < len(recording) // 2
+    assert not early.stream_complete
+    assert screenshots(early) == screenshots(full)
+
+
+def test_time_triggers(guac, recording_path, tmp_path):
+    rebuilder = rebuild(guac, recording_path, tmp_path / 'out', ScreenCaptureProgressTriggers=[],
+                        ScreenCaptureTimeTriggers=[1, 2], EarlyTermination=True)
+    assert rebuilder.stopped_early
+    assert sorted(screenshots(rebuilder)) == [9, 19]
+
+
+def test_download_is_closed(guac, recording, server, tmp_path):
+    httpd, base = server
+    httpd.files['/large.guac'] = recording * 50  # Only the start of it is needed
+    rebuilder = rebuild(guac, base + '/large.guac', tmp_path / 'out', ScreenCaptureProgressTriggers=[],
+                        ScreenCaptureTimeTriggers=[1], EarlyTermination=True)
+
+    assert rebuilder.stopped_early
+    assert rebuilder.bytes_read < len(recording)
+
+
+def test_not_with_the_change_triggers(guac, recording, recording_path, tmp_path):
+    # The change triggers need the whole recording
+    rebuilder = rebuild(guac, recording_path, tmp_path / 'out', ScreenCaptureProgressTriggers=[10],
+                        ScreenCaptureOnChange=True, EarlyTermination=True)
+    assert not rebuilder.stopped_early
+    assert rebuilder.bytes_read == len(recording)
+
+
+def test_nothing_is_cached(guac, recording_path, tmp_path):
+    cache = guac.GuacDiskCache(str(tmp_path / 'cache'))
+    rebuild(guac, recording_path, tmp_path / 'early', ScreenCaptureProgressTriggers=[10], EarlyTermination=True,
+            Cache=cache)
+    assert rebuild(guac, recording_path, tmp_path / 'full', ScreenCaptureProgressTriggers=[10],
+                   Cache=cache).cache_status == 'miss'
+    assert os.listdir(tmp_path / 'full')
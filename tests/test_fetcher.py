@@ -0,0 +1,83 @@
+import asyncio
+
+import requests
+
+
+def test_segments_reassemble(guac, recording, server):
+    _, base = server
+    with guac.GuacAsyncFetcher(segment_size=len(recording) // 5) as fetcher:
+        result, = fetcher.download([base + '/recording.guac'])
+
+    assert result.error is None
+    assert result.segments >= 5
+    assert bytes(result.data) == recording
+
+
+def test_segments_to_file(guac, recording, server, tmp_path):
+    _, base = server
+    with guac.GuacAsyncFetcher(segment_size=len(recording) // 3) as fetcher:
+        result, = fetcher.download([base + '/recording.guac'], directory=str(tmp_path))
+
+    assert result.error is None
+    with open(result.path, 'rb') as file_obj:
+        assert file_obj.read() == recording
+
+
+def test_retry_resumes(guac, recording, server):
+    httpd, base = server
+    httpd.drops['/recording.guac'] = len(recording) // 2
+    with guac.GuacAsyncFetcher(segment_size=0, backoff=0.01) as fetcher:
+        result, = fetcher.download([base + '/recording.guac'])
+
+    assert result.error is None
+    assert result.retries == 1
+    assert bytes(result.data) == recording
+
+
+def test_short_segment_is_retried(guac, recording, server):
+    # The middle segment is cut short, the others complete
+    httpd, base = server
+    segment_size = len(recording) // 3
+    httpd.drops[('/recording.guac', segment_size)] = segment_size // 2
+    with guac.GuacAsyncFetcher(segment_size=segment_size, backoff=0.01) as fetcher:
+        result, = fetcher.download([base + '/recording.guac'])
+
+    assert result.error is None
+    assert result.retries == 1
+    assert bytes(result.data) == recording
+
+
+def test_short_segment_without_retries_fails(guac, recording, server, tmp_path):
+    httpd, base = server
+    segment_size = len(recording) // 3
+    httpd.drops[('/recording.guac', segment_size)] = segment_size // 2
+    with guac.GuacAsyncFetcher(segment_size=segment_size, retries=0) as fetcher:
+        result, = fetcher.download([base + '/recording.guac'], directory=str(tmp_path))
+
+    # Not a recording with a hole of zeros
+    assert result.error is not None
+    assert result.retries == 1
+
+
+def test_backoff_releases_the_connection(guac, recording, server):
+    # A single connection: The other recording is downloaded while the first one waits for its retry
+    httpd, base = server
+    httpd.files['/other.guac'] = recording
+    httpd.drops['/recording.guac'] = len(recording) // 2
+
+    async def completed(fetcher):
+        return [result.url async for result in fetcher.fetch_many([base + '/recording.guac', base + '/other.guac'])]
+
+    with guac.GuacAsyncFetcher(max_connections=1, segment_size=0, backoff=1) as fetcher:
+        urls = asyncio.run(completed(fetcher))
+    assert urls == [base + '/other.guac', base + '/recording.guac']
+
+
+def test_not_found(guac, server):
+    _, base = server
+    with guac.GuacAsyncFetcher() as fetcher:
+        found, missing = fetcher.download([base + '/recording.guac', base + '/missing.guac'])
+
+    assert found.error is None
+    assert isinstance(missing.error, requests.HTTPError)
+    assert missing.data is None
@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+def rebuild(guac, source, directory, **params):
+    params.setdefault('ScreenCaptureProgressTriggers', [])
+    rebuilder = guac.GuacRecordingRebuilder(StreamURL=source, ScreenshotWriter=str(directory), **params)
+    rebuilder.cache = {'screenshots': []}
+    rebuilder.start()
+    return rebuilder
+
+
+def frame_numbers(rebuilder) -> list:
+    return sorted(entry['frame_number'] for entry in rebuilder.cache['screenshots'])
+
+
+def test_rolling_screenshots(guac, recording_path, tmp_path):
+    rebuilder = rebuild(guac, recording_path, tmp_path / 'out', ScreenCaptureInterval=1)
+
+    # 6 seconds of recording (a sync every 100 ms): One screenshot per second
+    assert len(frame_numbers(rebuilder)) == 6
+    assert all(b - a == 10 for a, b in zip(frame_numbers(rebuilder), frame_numbers(rebuilder)[1:]))
+
+
+def test_interval_is_part_of_the_cache_key(guac, recording_path, tmp_path):
+    cache = guac.GuacDiskCache(str(tmp_path / 'cache'))
+    plain = rebuild(guac, recording_path, tmp_path / 'plain', Cache=cache, ScreenCaptureProgressTriggers=[55])
+    assert plain.cache_status == 'miss'
+    assert len(frame_numbers(plain)) == 1
+
+    # Neither restored nor rendered from the keyframes: The rolling screenshots need the full replay
+    rolling = rebuild(guac, recording_path, tmp_path / 'rolling', Cache=cache, ScreenCaptureProgressTriggers=[55],
+                      ScreenCaptureInterval=1)
+    assert rolling.cache_status == 'miss'
+    assert set(frame_numbers(plain)) <= set(frame_numbers(rolling))
+    assert len(frame_numbers(rolling)) == 6
+
+    # And the rolling screenshots are not restored without the interval
+    again = rebuild(guac, recording_path, tmp_path / 'again', Cache=cache, ScreenCaptureProgressTriggers=[55])
+    assert again.cache_status == 'hit'
+    assert frame_numbers(again) == frame_numbers(plain)
+    assert rebuild(guac, recording_path, tmp_path / 'rolling-again', Cache=cache, ScreenCaptureProgressTriggers=[55],
+                   ScreenCaptureInterval=1).cache_status == 'hit'
+
+
+def test_follow_growing_file(guac, recording, tmp_path):
+    # The recording is written in 3 parts while being followed
+    path = tmp_path / 'live.guac'
+    parts = [recording[:len(recording) // 3], recording[len(recording) // 3:len(recording) * 2 // 3],
+             recording[len(recording) * 2 // 3:]]
+    path.write_bytes(parts[0])
+
+    def append():
+        for part in parts[1:]:
+            time.sleep(0.2)
+            with open(path, 'ab') as file_obj:
+                file_obj.write(part)
+
+    writer = threading.Thread(target=append)
+    writer.start()
+    source = guac.GuacFollowSource(str(path), poll_interval=0.05, idle_timeout=1)
+    rebuilder = rebuild(guac, source, tmp_path / 'out', ScreenCaptureInterval=1)
+    writer.join()
+
+    assert source.polls > 2
+    assert rebuilder.stream_complete
+    assert len(rebuilder.index) == 60
+    assert len(frame_numbers(rebuilder)) == 6
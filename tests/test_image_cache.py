@@ -0,0 +1,72 @@
+import base64
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+
+def encode(color: tuple, size=(16, 16), mode='RGB') -> bytes:
+    buffered = BytesIO()
+    Image.new(mode, size, color).save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+def test_hit_and_miss(guac):
+    cache = guac.GuacImageCache()
+    red, blue = encode((255, 0, 0)), encode((0, 0, 255))
+
+    pixels, opaque = cache.get(red)
+    assert opaque and tuple(pixels[0, 0]) == (255, 0, 0, 255)
+    assert cache.get(red)[0] is pixels
+    cache.get(blue)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+    # Shared, hence read-only
+    with pytest.raises(ValueError):
+        pixels[0, 0] = 0
+
+
+def test_transparency(guac):
+    pixels, opaque = guac.GuacImageCache().get(encode((255, 0, 0, 128), mode='RGBA'))
+    assert not opaque
+    assert tuple(pixels[0, 0]) == (255, 0, 0, 128)
+
+
+def test_lru_eviction(guac):
+    # 16x16 RGBA: 1 KiB each, 8 fit (an eighth of the cache at most each)
+    cache = guac.GuacImageCache(max_size=8 << 10)
+    payloads = [encode((index, 0, 0)) for index in range(10)]
+    for payload in payloads[:8]:
+        cache.get(payload)
+    cache.get(payloads[0])  # The most recently used from now on
+    cache.get(payloads[8])
+
+    assert cache.evictions == 1 and cache.size == 8 << 10
+    assert cache.lookup(cache.key(payloads[1])) is None  # The least recently used
+    assert cache.lookup(cache.key(payloads[0])) is not None
+
+
+def test_large_images_are_not_cached(guac):
+    cache = guac.GuacImageCache(max_size=64 << 10)
+    cache.get(encode((1, 2, 3), size=(64, 64)))  # 16 KiB, more than an eighth
+    assert len(cache) == 0 and cache.size == 0
+
+
+def test_decoder(guac):
+    # Keyed by the base64 payload (inline images), decoded by the given decoder on a miss
+    cache = guac.GuacImageCache()
+    payload = base64.b64encode(encode((0, 255, 0)))
+    first = cache.get(payload, base64.b64decode)
+    assert cache.get(payload, base64.b64decode) is first
+    assert np.array_equal(first[0][..., 1], np.full((16, 16), 255))
+
+
+def test_repeated_tiles_are_decoded_once(guac, recording):
+    # The synthetic recording draws its tiles from a pool of 8 (half of them), the others are unique
+    rebuilder = guac.GuacRecordingRebuilder(recording, CreateScreenshots=False, DecodeWorkers=0)
+    rebuilder.start()
+
+    stats = rebuilder.image_cache.stats()
+    assert stats['hits'] > 0
+    assert stats['hits'] + stats['misses'] == 60
+    assert stats['entries'] == stats['misses']
@@ -0,0 +1,84 @@
+import os
+import time
+from io import BytesIO
+
+from PIL import Image
+
+
+def encode(color: tuple) -> bytes:
+    buffered = BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+def frame_of(guac, payload: bytes, number: int):
+    frame = guac.guac_recording_frame()
+    stream = guac.guac_image_stream()
+    stream.buffer = bytearray(payload)
+    frame.operations.append(stream)
+    frame.timestamp = number
+    return frame
+
+
+def test_frames_are_released_in_order(guac):
+    decoder = guac.GuacImageDecoder(max_workers=4)
+    decode = decoder.decode
+
+    def slow_first(payload):
+        # The image of the first frame is decoded last
+        if bytes(payload) == first:
+            time.sleep(0.3)
+        return decode(payload)
+
+    decoder.decode = slow_first
+    first = encode((1, 0, 0))
+    frames = [frame_of(guac, first, 0)] + [frame_of(guac, encode((index, 0, 0)), index) for index in range(2, 8)]
+
+    ready = []
+    for frame in frames:
+        ready += decoder.put(frame, frame.timestamp)
+    assert ready == []  # Held back by the first frame
+    ready += decoder.drain()
+    decoder.close()
+
+    assert [context for _, context in ready] == [frame.timestamp for frame in frames]
+    assert all(frame.operations[0].decoded is not None for frame, _ in ready)
+    assert tuple(ready[0][0].operations[0].decoded[0][0, 0]) == (1, 0, 0, 255)
+
+
+def test_repetitions_in_flight_are_decoded_once(guac):
+    cache = guac.GuacImageCache()
+    decoder = guac.GuacImageDecoder(max_workers=2, image_cache=cache)
+    payload = encode((9, 9, 9))
+    frames = [frame_of(guac, payload, index) for index in range(5)]
+    for frame in frames:
+        decoder.put(frame)
+    ready = decoder.drain()
+    decoder.close()
+
+    assert decoder.decodes == 1
+    assert len(ready) == 5
+    assert all(frame.operations[0].decoded is not None for frame in frames)
+    assert len(cache) == 1
+
+
+def test_undecodable_image_is_left_to_the_display(guac):
+    decoder = guac.GuacImageDecoder(max_workers=2)
+    frame = frame_of(guac, b'not an image', 0)
+    (released, _), = decoder.put(frame) + decoder.drain()
+    decoder.close()
+    assert released.operations[0].decoded is None
+
+
+def test_same_screenshots_as_inline_decoding(guac, recording_path, tmp_path):
+    screenshots = {}
+    for workers in (0, 4):
+        directory = tmp_path / str(workers)
+        rebuilder = guac.GuacRecordingRebuilder(recording_path, ScreenCaptureProgressTriggers=[10, 50, 99],
+                                                DecodeWorkers=workers, ScreenshotWriter=str(directory))
+        rebuilder.start()
+        screenshots[workers] = {name: open(os.path.join(directory, name), 'rb').read()
+                                for name in os.listdir(directory)}
+
+    assert len(screenshots[0]) == 3
+    assert screenshots[4] == screenshots[0]
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def sequential_replay(guac, recording: bytes, frame_numbers: set) -> dict:
+    """ The frames replayed from the start of the recording, without keyframes """
+    rebuilder = guac.GuacRecordingRebuilder(None)
+    compositor = guac.GuacCompositor()
+    rendered, frame_number = {}, -1
+    for frame in rebuilder.iter_frames(recording):
+        compositor.draw(frame)
+        if frame.is_synced():
+            frame_number += 1
+            if frame_number in frame_numbers:
+                rendered[frame_number] = np.asarray(compositor.screenshot())
+    return rendered
+
+
+def test_render_frames_match_sequential_replay(guac, recording):
+    rebuilder = guac.GuacRecordingRebuilder(recording, KeyframeInterval=1, CreateScreenshots=False)
+    rebuilder.start()
+    assert len(rebuilder.keyframes) > 2
+
+    frame_numbers = [0, 5, 11, 12, 30, 31, len(rebuilder.index) - 1]
+    expected = sequential_replay(guac, recording, set(frame_numbers))
+    rendered = rebuilder.render_frames(frame_numbers, recording)
+
+    assert [frame_number for frame_number, _ in rendered] == sorted(frame_numbers)
+    for frame_number, image in rendered:
+        assert np.array_equal(np.asarray(image), expected[frame_number]), frame_number
+
+
+def test_keyframe_round_trip(guac, recording):
+    rebuilder = guac.GuacRecordingRebuilder(recording, KeyframeInterval=1, CreateScreenshots=False)
+    rebuilder.start()
+    keyframe = rebuilder.keyframes.keyframes[-1]
+
+    restored = guac.GuacKeyframe.from_bytes(keyframe.to_bytes())
+    assert (restored.frame_number, restored.offset) == (keyframe.frame_number, keyframe.offset)
@@ -0,0 +1,101 @@
+import io
+
+import pytest
+
+
+def read(source, offset: int = 0) -> bytes:
+    return b''.join(bytes(chunk) for chunk in source.chunks(offset))
+
+
+def test_open(guac, recording, recording_path):
+    assert isinstance(guac.GuacRecordingSource.open(recording), guac.GuacBytesSource)
+    assert isinstance(guac.GuacRecordingSource.open(recording_path), guac.GuacFileSource)
+    assert isinstance(guac.GuacRecordingSource.open(io.BytesIO(recording)), guac.GuacFileObjectSource)
+    assert isinstance(guac.GuacRecordingSource.open('https://example.com/recording.guac'), guac.GuacURLSource)
+    with pytest.raises(ValueError):
+        guac.GuacRecordingSource.open(42)
+
+
+@pytest.mark.parametrize('kind', ['bytes', 'file', 'file object', 'url'])
+def test_chunks(guac, recording, recording_path, server, kind):
+    httpd, base = server
+    source = {
+        'bytes': lambda: guac.GuacBytesSource(recording, read_size=1000),
+        'file': lambda: guac.GuacFileSource(recording_path, read_size=1000),
+        'file object': lambda: guac.GuacFileObjectSource(io.BytesIO(recording), read_size=1000),
+        'url': lambda: guac.GuacURLSource(base + '/recording.guac', read_size=1000),
+    }[kind]()
+
+    assert read(source) == recording
+    assert read(source, 1234) == recording[1234:]
+    assert source.tail(100) == recording[-100:]
+
+
+def test_pipe_cannot_be_read_twice(guac, recording):
+    class Pipe(io.BytesIO):
+        def seekable(self):
+            return False
+
+    source = guac.GuacFileObjectSource(Pipe(recording))
+    assert not source.rereadable()
+    assert source.tail(100) is None
+    assert read(source) == recording
+    with pytest.raises(ValueError):
+        read(source)
+
+
+def test_url_failure_is_a_stream_error(guac, server):
+    # Not an error status, but no recording either
+    httpd, base = server
+    httpd.statuses['/recording.guac'] = 204
+    rebuilder = guac.GuacRecordingRebuilder(base + '/recording.guac', CreateScreenshots=False)
+    rebuilder.start()
+
+    assert not rebuilder.stream_complete
+    assert 'HTTP 204' in str(rebuilder.stream_error)
+
+
+def screenshots(rebuilder) -> list:
+    return sorted(entry['frame_number'] for entry in rebuilder.cache['screenshots'])
+
+
+def rebuild(guac, source, directory) -> object:
+    rebuilder = guac.GuacRecordingRebuilder(source, ScreenshotWriter=str(directory))
+    rebuilder.cache = {'screenshots': []}
+    rebuilder.start()
+    return rebuilder
+
+
+def test_url_tail_resolution(guac, recording_path, server, tmp_path):
+    # The exact frames, from the tail of the recording (one request for the tail, one for the stream)
+    httpd, base = server
+    expected = screenshots(rebuild(guac, recording_path, tmp_path / 'file'))
+    rebuilder = rebuild(guac, base + '/recording.guac', tmp_path / 'url')
+
+    assert rebuilder.tail_end_time is not None
+    assert screenshots(rebuilder) == expected
+    assert len(httpd.requests) == 2
+
+
+def test_url_without_ranges_is_downloaded_once(guac, server, tmp_path):
+    # The tail cannot be read: Resolved from the snapshots, rather than a pre-pass downloading the recording twice
+    httpd, base = server
+    httpd.ranges = False
+    rebuilder = rebuild(guac, base + '/recording.guac', tmp_path / 'url')
+
+    assert rebuilder.prepass_index is None
+    assert rebuilder.stream_complete
+    assert len(screenshots(rebuilder)) == 3
+    assert [headers for _, headers in httpd.requests].count(None) == 1
+
+
+def test_cached_url_without_ranges_is_downloaded_once(guac, server, tmp_path):
+    # Teed into the cache by the pre-pass, the stream is read from the stored copy
+    httpd, base = server
+    httpd.ranges = False
+    rebuilder = guac.GuacRecordingRebuilder(base + '/recording.guac', ScreenshotWriter=str(tmp_path / 'url'),
+                                            Cache=str(tmp_path / 'cache'))
+    rebuilder.start()
+
+    assert rebuilder.prepass_index is not None
+    assert [headers for _, headers in httpd.requests].count(None) == 1
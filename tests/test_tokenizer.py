@@ -0,0 +1,40 @@
+import pytest
+
+
+def tokenize(guac, data: bytes, chunk_size: int) -> tuple:
+    tokenizer = guac.guac_instruction_tokenizer()
+    instructions, offsets = [], []
+    for start in range(0, len(data), chunk_size):
+        instructions += [[bytes(element) for element in elements]
+                         for elements in tokenizer.feed(data[start:start + chunk_size], offsets)]
+    return instructions, offsets, tokenizer
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64, 4096])
+def test_chunk_boundaries(guac, recording, chunk_size):
+    expected, expected_offsets, _ = tokenize(guac, recording, len(recording))
+    instructions, offsets, tokenizer = tokenize(guac, recording, chunk_size)
+
+    assert instructions == expected
+    assert offsets == expected_offsets
+    assert offsets[-1] == len(recording) == tokenizer.consumed
+    assert tokenizer.pending() == 0
+
+
+def test_non_ascii_values(guac):
+    # The LENGTH counts the characters, not the bytes
+    value = 'é;,.€'
+    data = ('6.custom,%d.%s;4.sync,3.100;' % (len(value), value)).encode()
+    for chunk_size in (1, 2, len(data)):
+        instructions, _, _ = tokenize(guac, data, chunk_size)
+        assert instructions == [[b'custom', value.encode()], [b'sync', b'100']]
+
+
+def test_malformed_instruction_recovery(guac):
+    # An invalid length prefix, and a value not followed by a separator: Skipped up to the next semicolon
+    data = b'4.sync,3.100;4.size,x1.0;4.sync,3.100X;4.sync,3.200;'
+    for chunk_size in (1, 5, len(data)):
+        instructions, _, tokenizer = tokenize(guac, data, chunk_size)
+        assert instructions == [[b'sync', b'100'], [b'sync', b'200']]
+        assert tokenizer.consumed == len(data)
+
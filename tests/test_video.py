@@ -0,0 +1,63 @@
+import logging
+import os
+import stat
+import sys
+
+import pytest
+
+FFMPEG = '''#!%s
+""" Stands in for ffmpeg: Reads the raw frames from stdin, then writes the output (or fails) """
+import sys
+frame_size, fail_after = %d, %s
+frames = 0
+while fail_after is None or frames < fail_after:
+    if len(sys.stdin.buffer.read(frame_size)) < frame_size:
+        break
+    frames += 1
+if fail_after is not None:
+    sys.stderr.write('Conversion failed!')
+    sys.exit(3)
+with open(sys.argv[-1], 'w') as file_obj:
+    file_obj.write(str(frames))
+'''
+
+
+def fake_ffmpeg(directory, fail_after: int = None, frame_size: int = 128 * 96 * 3) -> str:
+    path = os.path.join(str(directory), 'ffmpeg')
+    with open(path, 'w') as file_obj:
+        file_obj.write(FFMPEG % (sys.executable, frame_size, fail_after))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def test_export(guac, recording, tmp_path):
+    output = str(tmp_path / 'recording.mp4')
+    video = guac.GuacVideoExporter(output, fps=10, ffmpeg=fake_ffmpeg(tmp_path))
+    rebuilder = guac.GuacRecordingRebuilder(recording, CreateScreenshots=False, ExportVideo=video)
+    rebuilder.start()
+
+    # 5.9 seconds between the first and the last sync at 10 fps, the last canvas is shown for one frame
+    assert rebuilder.stream_error is None
+    assert video.frames_written == 60
+    assert video.frames_presented == 60
+    with open(output) as file_obj:
+        assert file_obj.read() == '60'
+
+
+def test_ffmpeg_failure_is_reported_once(guac, recording, tmp_path, caplog):
+    video = guac.GuacVideoExporter(str(tmp_path / 'recording.mp4'), fps=25, ffmpeg=fake_ffmpeg(tmp_path, fail_after=5))
+    rebuilder = guac.GuacRecordingRebuilder(recording, ScreenshotWriter=str(tmp_path / 'screenshots'),
+                                            ExportVideo=video)
+    rebuilder.cache = {'screenshots': []}
+    with caplog.at_level(logging.ERROR):
+        rebuilder.start()
+
+    assert isinstance(rebuilder.stream_error, RuntimeError)
+    assert 'exit code 3' in str(rebuilder.stream_error)
+    assert 'Conversion failed!' in str(rebuilder.stream_error)
+    assert len([record for record in caplog.records if 'video export stopped' in record.getMessage()]) == 1
+    assert not [record for record in caplog.records if 'Unable to composite' in record.getMessage()]
+    # The rest of the run is not affected
+    assert len(rebuilder.cache['screenshots']) == 3
+    with pytest.raises(RuntimeError):
+        video.close()
@@ -0,0 +1,60 @@
+import io
+import threading
+
+import pytest
+from PIL import Image
+
+
+def image(index: int) -> Image.Image:
+    return Image.new('RGB', (32, 24), (index % 256, 0, 0))
+
+
+def test_directory(guac, tmp_path):
+    with guac.GuacScreenshotWriter(directory=str(tmp_path / 'out'), format='png') as writer:
+        for index in range(20):
+            writer.submit(image(index), '%d_screen%s' % (index, writer.extension))
+
+    assert writer.stats() == {'written': 20, 'errors': 0, 'pending': 0}
+    decoded = Image.open(tmp_path / 'out' / '7_screen.png')
+    assert decoded.getpixel((0, 0)) == (7, 0, 0)
+
+
+def test_sink_and_bounded_pending(guac):
+    # The sink blocks until released: submit() waits once max_pending screenshots are queued
+    received, release = {}, threading.Event()
+
+    def sink(image_name, data):
+        release.wait(5)
+        received[image_name] = data
+
+    writer = guac.GuacScreenshotWriter(format='jpeg', sink=sink, max_workers=1, max_pending=2)
+    submitter = threading.Thread(target=lambda: [writer.submit(image(index), str(index)) for index in range(5)])
+    submitter.start()
+    submitter.join(0.3)
+    assert submitter.is_alive()
+    assert writer.stats()['pending'] == 2
+
+    release.set()
+    submitter.join(5)
+    writer.close()
+    assert sorted(received) == ['0', '1', '2', '3', '4']
+    assert Image.open(io.BytesIO(received['3'])).format == 'JPEG'
+    assert writer.path('0') is None
+
+
+def test_errors_are_counted(guac):
+    def sink(image_name, data):
+        if image_name.startswith('bad'):
+            raise OSError('disk full')
+
+    with guac.GuacScreenshotWriter(sink=sink, max_workers=4) as writer:
+        futures = [writer.submit(image(index), '%s%d' % ('bad' if index % 3 == 0 else 'ok', index))
+                   for index in range(30)]
+
+    assert [future.result() for future in futures].count(False) == 10
+    assert writer.stats() == {'written': 20, 'errors': 10, 'pending': 0}
+
+
+def test_unsupported_format(guac):
+    with pytest.raises(ValueError):
+        guac.GuacScreenshotWriter(format='gif')